@@ -4,53 +4,59 @@ from mininet.topo import Topo
 from mininet.link import TCLink
 from mininet.node import RemoteController, OVSSwitch
 from mininet.cli import CLI
+from topology import Topology
+from multicast_tree import build_tree
+from topo_builder import StageTimer, dpid_str, link_opts, run_on_hosts
 
 
 class CustomSwitch(OVSSwitch):
-    """Custom OVSSwitch class that uses OpenFlow 1.3."""
+    """Custom OVSSwitch class that uses OpenFlow 1.3, started in batches."""
 
     def __init__(self, *args, **kwargs):
         kwargs['protocols'] = 'OpenFlow13'
+        kwargs.setdefault('batch', True)
         super(CustomSwitch, self).__init__(*args, **kwargs)
 
 
 class JSONBasedTopo(Topo):
     def __init__(self, config, **kwargs):
         self.config = config
+        self.topology = Topology(config)
         super(JSONBasedTopo, self).__init__(**kwargs)
 
     def build(self):
         # 添加交换机和主机
         for dpid, switch_name in self.config['dpid_to_switchname'].items():
-            self.addSwitch(switch_name, dpid=str(dpid))
+            self.addSwitch(switch_name, dpid=dpid_str(dpid))
 
         for host_name, ip in self.config['host_ips'].items():
             self.addHost(host_name, ip=ip)
 
-        # 添加链接
-        for node1, connections in self.config['topo'].items():
-            for node2, port in connections.items():
-                self.addLink(node1, node2)
+        # 添加链接，每条链路只添加一次，带宽和时延取自 link_attrs
+        for node1, port1, node2, port2 in self.topology.links():
+            self.addLink(node1, node2, port1=port1, port2=port2,
+                         **link_opts(self.topology, node1, node2))
 
 
-def install_multicast_flow_entries(net, config):
+def install_multicast_flow_entries(net, config, topology=None):
     created_groups = {}  # 记录已创建的组播组
+    if topology is None:
+        topology = Topology(config)
 
     for group_name, group_info in config['multicast_groups'].items():
         source_ip = config['host_ips'][group_info['source']]
         multicast_ip = group_info['multicast_address']
         group_id = int(group_name.replace("group", ""))
 
-        # 构建组播组配置
+        # 构建组播组配置：沿组播树逐跳复制
+        method = group_info.get('tree', 'spt')
+        options = {'bound': group_info.get('max_delay')} if method == 'delay' else {}
+        tree = build_tree(topology, group_info['source'], group_info['targets'], method, **options)
+        if method == 'delay' and tree.late:
+            print(f'Group {group_name} misses max_delay={group_info.get("max_delay")} ms at {", ".join(tree.late)}')
         group_configs = {}
-        for target in group_info['targets']:
-            target_ip = config['host_ips'][target]
-            for sw_name, connections in config['topo'].items():
-                if target in connections:
-                    port = connections[target]
-                    if sw_name not in group_configs:
-                        group_configs[sw_name] = []
-                    group_configs[sw_name].append(f"bucket=output:{port}")
+        for sw_name, ports in tree.buckets.items():
+            group_configs[sw_name] = [f"bucket=output:{port}" for port in ports]
 
         # 创建组播组
         for sw_name, buckets in group_configs.items():
@@ -82,11 +88,9 @@ def install_multicast_flow_entries(net, config):
 
 
 def configure_default_multicast_routes(net):
-    for host in net.hosts:
-        # 为每个主机添加默认多播路由
-        cmd = "route add -net 224.0.0.0 netmask 240.0.0.0 dev %s-eth0" % host.name
-        print(f"为 {host.name} 添加多播路由: {cmd}")  # 打印即将执行的命令
-        host.cmd(cmd)
+    # 为每个主机添加默认多播路由，所有主机同时执行
+    run_on_hosts(net.hosts, lambda host: "route add -net 224.0.0.0 netmask 240.0.0.0 dev %s-eth0" % host.name)
+    print(f"为 {len(net.hosts)} 个主机添加了多播路由")
 
 
 def load_config(filename='simple.json'):
@@ -94,15 +98,28 @@ def load_config(filename='simple.json'):
         return json.load(f)
 
 
-def create_network(config):
+def start_network(config, timer=None):
+    # 建立拓扑、启动交换机并配置多播路由，返回 (net, topo)
+    timer = timer or StageTimer()
     topo = JSONBasedTopo(config=config)
     net = Mininet(topo=topo, link=TCLink, controller=None, switch=CustomSwitch)
     net.addController('c0', controller=RemoteController, ip="127.0.0.1", port=6653)
-    net.start()
-
-    install_multicast_flow_entries(net, config)  # 安装多播流表项
+    timer.lap('build')
+    net.start()  # 批量启动交换机
+    timer.lap('start')
 
     configure_default_multicast_routes(net)  # 配置默认多播路由
+    timer.lap('host routes')
+    return net, topo
+
+
+def create_network(config):
+    timer = StageTimer()
+    net, topo = start_network(config, timer)
+
+    install_multicast_flow_entries(net, config, topo.topology)  # 安装多播流表项
+    timer.lap('flow entries')
+    timer.report()
 
     CLI(net)
     net.stop()
@@ -110,4 +127,4 @@ def create_network(config):
 
 if __name__ == '__main__':
     config = load_config()
-    create_network(config)
\ No newline at end of file
+    create_network(config)
\ No newline at end of file
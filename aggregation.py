@@ -0,0 +1,193 @@
+import ofmsg
+from multicast_tree import attachment, steiner_tree
+
+OFPVID_PRESENT = 0x1000
+OFPVID_NONE = 0x0000
+# VLAN ids the core trees are tagged with start here
+FIRST_TAG = 100
+
+
+def core_ports(tree):
+    """Ports of every switch on a tree towards its parent and children, so
+    the tree carries traffic from any of its edge switches. An ALL group
+    never sends a copy back out the ingress port."""
+    ports = {}
+    for switch, children in tree.children.items():
+        adj = tree.topo.neighbors(switch)
+        out = [adj[child][0] for child in children]
+        if switch in tree.parent:
+            out.append(adj[tree.parent[switch]][0])
+        ports[switch] = sorted(out)
+    return ports
+
+
+class CoreTree(object):
+    """A tagged, bidirectional tree spanning a set of edge switches, shared
+    by every group whose members sit behind those switches."""
+
+    def __init__(self, topo, tag, edges):
+        self.topo = topo
+        self.tag = tag
+        self.edges = set(edges)
+        self.groups = set()
+        self.build()
+
+    def build(self):
+        edges = sorted(self.edges)
+        tree = steiner_tree(self.topo, (edges[0], None), [(e, None) for e in edges[1:]])
+        self.ports = core_ports(tree)
+
+    def extend(self, edges):
+        self.edges |= set(edges)
+        self.build()
+
+    def leak(self, edges):
+        """Edge switches reached for nothing, per edge switch a group needs."""
+        return len(self.edges - set(edges)) / float(len(edges))
+
+
+class Aggregator(object):
+    """Aggregated multicast: many groups mapped onto a few core trees.
+
+    The ingress edge switch of a group pushes the VLAN tag of the group's
+    core tree; core switches only hold one group entry and one flow per
+    tree, matched on the tag, and the egress edge switches pop the tag and
+    hand the packet to the group's receivers. Per-group state therefore
+    stays at the edges and core table usage grows with the number of trees.
+
+    A group goes onto the tree covering its edge switches with the least
+    leak (edges reached that it does not need) within max_leak, else onto
+    a new tree while there are fewer than max_trees, else the tree that
+    needs the fewest extra edges is extended to cover it.
+
+    The mapping is static: the configured groups are assigned before the
+    switch plans are compiled from switch_msgs(), and IGMP joins and
+    leaves do not move a group between trees. Reassigning a group means
+    compiling the plans again.
+    """
+
+    def __init__(self, topo, max_trees=16, max_leak=0.5, first_tag=FIRST_TAG):
+        self.topo = topo
+        self.max_trees = max_trees
+        self.max_leak = max_leak
+        self.first_tag = first_tag
+        self.trees = []
+        self.assigned = {}   # group -> CoreTree
+        self.sources = {}    # group -> (switch, port)
+        self.receivers = {}  # group -> {switch: set of ports}
+        self.matches = {}    # group -> match dict
+
+    def edges(self, group):
+        return set(self.receivers[group]) | set([self.sources[group][0]])
+
+    def assign(self, group, source, targets, match):
+        """Map a group onto a core tree, returns the tree (None when all of
+        the group sits behind one edge switch)."""
+        self.remove(group)
+        self.sources[group] = attachment(self.topo, source)
+        receivers = self.receivers[group] = {}
+        for target in targets:
+            switch, port = attachment(self.topo, target)
+            if switch is not None:
+                receivers.setdefault(switch, set()).add(port)
+        self.matches[group] = match
+        edges = self.edges(group)
+        if len(edges) < 2:
+            return None
+
+        covering = [t for t in self.trees
+                    if edges <= t.edges and t.leak(edges) <= self.max_leak]
+        if covering:
+            tree = min(covering, key=lambda t: (t.leak(edges), t.tag))
+        elif len(self.trees) < self.max_trees:
+            tree = CoreTree(self.topo, self._free_tag(), edges)
+            self.trees.append(tree)
+        else:
+            tree = min(self.trees, key=lambda t: (len(edges - t.edges), len(t.edges), t.tag))
+            tree.extend(edges)
+        tree.groups.add(group)
+        self.assigned[group] = tree
+        return tree
+
+    def remove(self, group):
+        """Forget a group, and its tree when it was the last one on it."""
+        if group not in self.sources:
+            return
+        tree = self.assigned.pop(group, None)
+        if tree is not None:
+            tree.groups.discard(group)
+            if not tree.groups:
+                self.trees.remove(tree)
+        del self.sources[group], self.receivers[group], self.matches[group]
+
+    def _free_tag(self):
+        used = set(t.tag for t in self.trees)
+        tag = self.first_tag
+        while tag in used:
+            tag += 1
+        return tag
+
+    def switch_msgs(self, dp, switch, group_ids, priority):
+        """Every group entry and flow switch needs, dp may be a ProtocolDesc.
+
+        Group ids come from group_ids (a GroupIds), keyed "tree:<tag>" for
+        the core entries and by group for the ingress ones.
+        """
+        ofproto = dp.ofproto
+        parser = dp.ofproto_parser
+        msgs = []
+        tree_gids = {}
+        for tree in self.trees:
+            ports = tree.ports.get(switch)
+            if ports is None:
+                continue
+            gid = tree_gids[tree.tag] = group_ids.allocate(switch, "tree:%d" % tree.tag)
+            msgs.append(ofmsg.group_mod(dp, ofproto.OFPGC_DELETE, gid, []))
+            msgs.append(ofmsg.group_mod(dp, ofproto.OFPGC_ADD, gid, ports))
+            msgs.append(ofmsg.group_flow_mod(dp, priority, dict(vlan_vid=OFPVID_PRESENT | tree.tag), gid))
+
+        for group in sorted(self.sources):
+            tree = self.assigned.get(group)
+            local = sorted(self.receivers[group].get(switch, ()))
+            if self.sources[group][0] == switch:
+                # ingress: local receivers untagged, a tagged copy into the core
+                action_lists = [[parser.OFPActionOutput(p)] for p in local]
+                if tree is not None:
+                    for port in tree.ports[switch]:
+                        action_lists.append([
+                            parser.OFPActionPushVlan(0x8100),
+                            parser.OFPActionSetField(vlan_vid=OFPVID_PRESENT | tree.tag),
+                            parser.OFPActionOutput(port)])
+                gid = group_ids.allocate(switch, group)
+                match = dict(self.matches[group], vlan_vid=OFPVID_NONE)
+                msgs.append(ofmsg.group_mod(dp, ofproto.OFPGC_DELETE, gid, []))
+                msgs.append(ofmsg.action_group_mod(dp, ofproto.OFPGC_ADD, gid, action_lists))
+                msgs.append(ofmsg.group_flow_mod(dp, priority, match, gid))
+            elif local and tree is not None:
+                # egress: keep the tree going if the switch is a transit one,
+                # then untag for the group's own receivers
+                actions = []
+                if len(tree.ports[switch]) > 1:
+                    actions.append(parser.OFPActionGroup(tree_gids[tree.tag]))
+                actions.append(parser.OFPActionPopVlan())
+                actions.extend(parser.OFPActionOutput(p) for p in local)
+                match = dict(self.matches[group], vlan_vid=OFPVID_PRESENT | tree.tag)
+                msgs.append(ofmsg.flow_mod(dp, priority + 1, match, actions))
+        return msgs
+
+    def usage(self):
+        """{switch: (group entries, flows)} the aggregated state costs."""
+        usage = {}
+        for tree in self.trees:
+            for switch in tree.ports:
+                groups, flows = usage.get(switch, (0, 0))
+                usage[switch] = (groups + 1, flows + 1)
+        for group in self.sources:
+            tree = self.assigned.get(group)
+            for switch in self.edges(group):
+                groups, flows = usage.get(switch, (0, 0))
+                if self.sources[group][0] == switch:
+                    usage[switch] = (groups + 1, flows + 1)
+                elif tree is not None:
+                    usage[switch] = (groups, flows + 1)
+        return usage
@@ -0,0 +1,104 @@
+from multicast_tree import repair_tree
+
+
+class BackupTrees(object):
+    """The switch links that are down, and for every installed tree the
+    tree to fail over to when one of its links goes down too.
+
+    A backup is multicast_tree.repair_tree() of the tree around that link
+    and the ones already down, so it differs from the tree only on the
+    switches the link's loss concerns. refresh() works them out ahead of
+    time, a few trees per call; backup() falls back to repairing on the
+    spot for a tree refresh() has not got to yet.
+
+    A link is down from the first of its ends reporting its port down
+    until both are up again.
+    """
+
+    def __init__(self, topo):
+        self.topo = topo
+        self.down_ends = {}  # link -> (switch, port) ends reported down
+        self.down = set()  # frozenset((u, v)) of the switch links down
+        self.epoch = 0  # bumped whenever a link goes down or up
+        self.backups = {}  # group -> (tree, epoch, {link: backup tree})
+        self.repaired = set()  # groups on a tree routed around a down link
+
+    def link(self, switch, port):
+        """The switch link on switch's port, None for host and unknown ports."""
+        peer = self.topo.port_peer(switch, port)
+        if peer is None or peer[0] not in self.topo.neighbors(switch):
+            return None
+        return frozenset((switch, peer[0]))
+
+    def port_down(self, switch, port):
+        """Returns the link the port is on if that just went down."""
+        link = self.link(switch, port)
+        if link is None:
+            return None
+        ends = self.down_ends.setdefault(link, set())
+        ends.add((switch, port))
+        if link in self.down:
+            return None
+        self.down.add(link)
+        self.epoch += 1
+        return link
+
+    def port_up(self, switch, port):
+        """Returns the link the port is on if that just came back up."""
+        link = self.link(switch, port)
+        ends = self.down_ends.get(link)
+        if not ends:
+            return None
+        ends.discard((switch, port))
+        if ends:
+            return None
+        del self.down_ends[link]
+        self.down.discard(link)
+        self.epoch += 1
+        return link
+
+    def repair(self, group, tree):
+        """tree around the links that are down."""
+        repaired = repair_tree(tree, self.down) if self.down else tree
+        if repaired is tree:
+            self.repaired.discard(group)
+        else:
+            self.repaired.add(group)
+        return repaired
+
+    def crosses(self, tree, link):
+        return any(frozenset(edge) == link for edge in tree.edges())
+
+    def backup(self, group, tree, link):
+        """The tree to move the group from tree onto now that link is down."""
+        stored = self.backups.get(group)
+        new = None
+        if stored is not None and stored[0] is tree:
+            new = stored[2].get(link)
+        # worked out before another link went down, and over it
+        if new is None or any(frozenset(edge) in self.down for edge in new.edges()):
+            new = repair_tree(tree, self.down)
+        self.repaired.add(group)
+        return new
+
+    def refresh(self, trees, limit=None):
+        """Work out the backups of up to limit trees of trees ({group:
+        (key, tree)}) that changed, or whose links did, since theirs were.
+        Returns the number of trees done."""
+        for group in list(self.backups):
+            if group not in trees:
+                del self.backups[group]
+        done = 0
+        for group, (_, tree) in sorted(trees.items()):
+            if limit is not None and done >= limit:
+                break
+            stored = self.backups.get(group)
+            if stored is not None and stored[0] is tree and stored[1] == self.epoch:
+                continue
+            backups = {}
+            for edge in tree.edges():
+                link = frozenset(edge)
+                backups[link] = repair_tree(tree, self.down | set([link]))
+            self.backups[group] = (tree, self.epoch, backups)
+            done += 1
+        return done
@@ -0,0 +1,195 @@
+"""Packet-in throughput of the L2 learning controller.
+
+Compares the full ryu packet decode with the header-only fast path, then
+pushes ARP broadcast bursts and learned unicast traffic through
+MulticastController's packet-in handler on a fake datapath, and through
+the handler it had before the fast path for comparison.
+
+    python bench_packet_in.py [-n PACKETS] [--hosts HOSTS]
+"""
+import argparse
+import importlib.util
+import os
+import time
+
+from ryu.controller import ofp_event
+from ryu.lib.packet import arp, ethernet, ether_types, ipv4, packet, udp
+from ryu.ofproto import ofproto_v1_3, ofproto_v1_3_parser
+
+import fastpath
+from emulate import FakeDatapath
+
+
+def host_mac(i):
+    return '00:00:00:00:%02x:%02x' % (i >> 8 & 0xff, i & 0xff)
+
+
+def host_ip(i):
+    return '10.0.%d.%d' % (i >> 8 & 0xff, i & 0xff)
+
+
+def arp_request(i, j):
+    pkt = packet.Packet()
+    pkt.add_protocol(ethernet.ethernet(dst='ff:ff:ff:ff:ff:ff', src=host_mac(i),
+                                       ethertype=ether_types.ETH_TYPE_ARP))
+    pkt.add_protocol(arp.arp(src_mac=host_mac(i), src_ip=host_ip(i), dst_ip=host_ip(j)))
+    pkt.serialize()
+    return bytes(pkt.data)
+
+
+def udp_frame(i, j):
+    pkt = packet.Packet()
+    pkt.add_protocol(ethernet.ethernet(dst=host_mac(j), src=host_mac(i)))
+    pkt.add_protocol(ipv4.ipv4(src=host_ip(i), dst=host_ip(j), proto=17))
+    pkt.add_protocol(udp.udp(src_port=5000, dst_port=5001))
+    pkt.add_protocol(b'x' * 64)
+    pkt.serialize()
+    return bytes(pkt.data)
+
+
+def load_controller():
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'new', 'new', 'controller.py')
+    spec = importlib.util.spec_from_file_location('multicast_controller', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.MulticastController
+
+
+def baseline(cls):
+    """cls with the packet-in handler and MAC learning it had before the
+    fast path: a full decode, a plain mac_to_port dict and a log call per
+    packet."""
+
+    class Baseline(cls):
+        def __init__(self, *args, **kwargs):
+            super(Baseline, self).__init__(*args, **kwargs)
+            self.mac_to_port = {}
+
+        def mac_learning(self, datapath, src, in_port):
+            self.mac_to_port.setdefault((datapath,datapath.id), {})
+            if src in self.mac_to_port[(datapath,datapath.id)]:
+                if in_port != self.mac_to_port[(datapath,datapath.id)][src]:
+                    return False
+            else:
+                self.mac_to_port[(datapath,datapath.id)][src] = in_port
+                return True
+
+        def _packet_in_handler(self, ev):
+            msg = ev.msg
+            datapath = msg.datapath
+            ofproto = datapath.ofproto
+            parser = datapath.ofproto_parser
+            in_port = msg.match['in_port']
+            pkt = packet.Packet(msg.data)
+            eth = pkt.get_protocols(ethernet.ethernet)[0]
+            if eth.ethertype == ether_types.ETH_TYPE_LLDP:
+                match = parser.OFPMatch(eth_type=eth.ethertype)
+                actions = []
+                self.add_flow(datapath, 10, match, actions)
+                return
+
+            if eth.ethertype == ether_types.ETH_TYPE_IPV6:
+                match = parser.OFPMatch(eth_type=eth.ethertype)
+                actions = []
+                self.add_flow(datapath, 10, match, actions)
+                return
+
+            dst = eth.dst
+            src = eth.src
+            dpid = datapath.id
+
+            self.logger.info("packet in %s %s %s %s", dpid, src, dst, in_port)
+            self.mac_learning(datapath, src, in_port)
+
+            if dst in self.mac_to_port[(datapath,datapath.id)]:
+                out_port = self.mac_to_port[(datapath,datapath.id)][dst]
+            else:
+                if self.mac_learning(datapath, src, in_port) is False:
+                    out_port = ofproto.OFPPC_NO_RECV
+                else:
+                    out_port = ofproto.OFPP_FLOOD
+
+            actions = [parser.OFPActionOutput(out_port)]
+
+            if out_port != ofproto.OFPP_FLOOD:
+                match = parser.OFPMatch(in_port=in_port, eth_dst=dst)
+                if msg.buffer_id != ofproto.OFP_NO_BUFFER:
+                    self.add_flow(datapath, 10, match, actions, msg.buffer_id)
+                    return
+                else:
+                    self.add_flow(datapath, 10, match, actions)
+
+            data = None
+            if msg.buffer_id == ofproto.OFP_NO_BUFFER:
+                data = msg.data
+            out = parser.OFPPacketOut(datapath=datapath, buffer_id=msg.buffer_id,
+                                      in_port=in_port, actions=actions, data=data)
+            datapath.send_msg(out)
+
+    return Baseline
+
+
+def rate(n, elapsed):
+    return n / elapsed if elapsed else float('inf')
+
+
+def bench_decode(frames):
+    start = time.perf_counter()
+    for data in frames:
+        pkt = packet.Packet(data)
+        pkt.get_protocols(ethernet.ethernet)[0]
+    full = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for data in frames:
+        fastpath.parse_eth(data)
+    fast = time.perf_counter() - start
+    return full, fast
+
+
+def bench_handler(app, dp, frames):
+    parser = dp.ofproto_parser
+    events = []
+    for in_port, data in frames:
+        msg = parser.OFPPacketIn(dp, buffer_id=dp.ofproto.OFP_NO_BUFFER,
+                                 match=parser.OFPMatch(in_port=in_port), data=data)
+        events.append(ofp_event.EventOFPPacketIn(msg))
+    start = time.perf_counter()
+    for ev in events:
+        app._packet_in_handler(ev)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--packets', type=int, default=50000)
+    parser.add_argument('--hosts', type=int, default=64)
+    args = parser.parse_args()
+    n, hosts = args.packets, args.hosts
+
+    arps = [(1 + i % hosts, arp_request(i % hosts, (i + 1) % hosts)) for i in range(n)]
+    unicast = [(1 + i % hosts, udp_frame(i % hosts, (i + 1) % hosts)) for i in range(n)]
+
+    full, fast = bench_decode([data for _, data in arps + unicast])
+    print ('decode     full %10.0f pkt/s   fast path %10.0f pkt/s   (%.1fx)'
+           % (rate(2 * n, full), rate(2 * n, fast), full / fast))
+
+    cls = load_controller()
+    results = []
+    for name, app in (('before', baseline(cls)()), ('after', cls())):
+        dp = FakeDatapath(1, ofproto_v1_3.OFP_VERSION, tables=False)
+        arp_time = bench_handler(app, dp, arps)
+        arp_sent = dp.sent
+        # every host is learned now, so the unicast run hits the flow install path
+        dp.sent = 0
+        unicast_time = bench_handler(app, dp, unicast)
+        results.append((rate(n, arp_time), arp_sent, rate(n, unicast_time), dp.sent))
+    print ('%-10s %14s %14s %8s' % ('pkt-in/s', 'before', 'after', 'speedup'))
+    for label, i in (('arp burst', 0), ('unicast', 2)):
+        print ('%-10s %14.0f %14.0f %7.1fx' % (label, results[0][i], results[1][i],
+                                               results[1][i] / results[0][i]))
+    print ('messages sent, arp burst before %d after %d, unicast before %d after %d'
+           % (results[0][1], results[1][1], results[0][3], results[1][3]))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,382 @@
+"""End-to-end multicast provisioning and teardown latency per controller.
+
+    sudo python bench_provision.py controller newryu --netconf netconf.json --rules file.json
+    sudo python bench_provision.py controller --rules file.json --trace churn.jsonl --builder newtopo
+
+For every controller variant it starts ryu-manager in a scratch
+directory, brings the netconf topology up with gen_topo.py (or
+NewTopo.py) and plays the workload: the rules are added at the start,
+then the trace (gen_config.py churn format) runs, and whatever is left
+is removed --hold seconds after the last event.
+
+Each group's source sends a numbered UDP stream from shortly before the
+group is added until after it is removed. Every target joins the group
+when it is added to it and leaves when it is removed. It watches its
+interface with a packet socket, so it still sees what arrives after it
+left. controller.py is told through file.json at the same instants, and
+the IGMP snooping apps by the joins and leaves themselves.
+
+  provisioning = first packet seen after the host was added - that instant
+  teardown     = last packet seen after the host was removed - that instant
+                 (0 when nothing arrived after it)
+
+Hosts that never see the stream count as missed. Hosts that still see
+it --hold seconds after they were removed count as leaked. Packets a
+host gets of a group it has not joined yet, or never joins, are strays:
+the stream was flooded rather than sent down the group's tree.
+
+controller.py is started with every group of the run in netconf, so
+its drop entries hold each stream at the source until the group is
+added.
+"""
+import argparse
+import json
+import os
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import fastpath
+import gen_config
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+LEAFSPINE = os.path.join(ROOT, 'leafspine-simple', 'leafspine-simple')
+
+# app, OpenFlow version its switches must speak, how it learns of groups
+VARIANTS = {
+    'controller': (os.path.join(ROOT, 'controller.py'), 'OpenFlow13', 'file'),
+    'newryu': (os.path.join(LEAFSPINE, 'NewRyu.py'), 'OpenFlow13', 'igmp'),
+    'simple': (os.path.join(LEAFSPINE, 'ryu-simple-multicast.py'), 'OpenFlow15', 'igmp'),
+}
+
+PORT = 5007
+PAYLOAD = struct.Struct('!Qd')  # sequence number, send time
+
+
+def schedule(rules, trace, hold):
+    """Turn rules added at t=0 plus a churn trace into per-group send
+    periods and per-host membership windows.
+
+    Returns (events, groups, windows, final): events are (t, event) for
+    the rule file, groups {group: dict(address, source, start, stop)},
+    windows {host: [dict(group, address, start, stop)]} and final the
+    time the run ends.
+    """
+    events = [(0.0, {"op": "add", "group": g, "info": info}) for g, info in sorted(rules.items())]
+    events += [(e["t"], e) for e in trace]
+    end = (events[-1][0] if events else 0.0) + hold
+    live = {}
+    groups = {}
+    windows = {}
+    open_windows = {}
+
+    def join(group, host, t):
+        w = dict(group=group, address=live[group]["multicast_address"], start=t, stop=end)
+        windows.setdefault(host, []).append(w)
+        open_windows[(group, host)] = w
+
+    def leave(group, host, t):
+        w = open_windows.pop((group, host), None)
+        if w is not None:
+            w["stop"] = t
+
+    for t, e in events:
+        op, group = e["op"], e["group"]
+        if op == "add" and group not in live:
+            info = live[group] = dict(e["info"], targets=list(e["info"]["targets"]))
+            groups[group] = dict(address=info["multicast_address"], source=info["source"],
+                                 start=t, stop=end)
+            for host in info["targets"]:
+                join(group, host, t)
+        elif op == "remove" and group in live:
+            for host in live.pop(group)["targets"]:
+                leave(group, host, t)
+            groups[group]["stop"] = t
+        elif op in ("join", "leave") and group in live:
+            targets = live[group]["targets"]
+            if op == "join" and e["host"] not in targets:
+                targets.append(e["host"])
+                join(group, e["host"], t)
+            elif op == "leave" and e["host"] in targets:
+                targets.remove(e["host"])
+                leave(group, e["host"], t)
+    # whatever is still up is torn down at the end and watched for hold more
+    final = end + hold
+    for group in live:
+        events.append((end, {"op": "remove", "group": group}))
+        groups[group]["stop"] = end
+    return events, groups, windows, final
+
+
+# host side
+
+def send_stream(address, start, stop, interval, ttl=10):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+    seq = 0
+    wait_until(start)
+    while time.time() < stop:
+        sock.sendto(PAYLOAD.pack(seq, time.time()), (address, PORT))
+        seq += 1
+        time.sleep(interval)
+    sock.close()
+
+
+def membership(windows):
+    """Join and leave each window's group at its start and stop."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    actions = []
+    for w in windows:
+        actions.append((w["start"], socket.IP_ADD_MEMBERSHIP, w["address"]))
+        actions.append((w["stop"], socket.IP_DROP_MEMBERSHIP, w["address"]))
+    for at, option, address in sorted(actions, key=lambda a: a[0]):
+        wait_until(at)
+        mreq = struct.pack("4sl", socket.inet_aton(address), socket.INADDR_ANY)
+        try:
+            sock.setsockopt(socket.IPPROTO_IP, option, mreq)
+        except OSError:
+            pass
+    sock.close()
+
+
+def watch(iface, windows, end, addresses=()):
+    """Record, per window, the first packet of its group after it opened
+    and the last one after it closed (before the next window opened).
+    Returns the number of packets of addresses that came before any
+    window of theirs opened."""
+    addresses = set(addresses)
+    strays = 0
+    by_address = {}
+    for w in sorted(windows, key=lambda w: w["start"]):
+        w["first"] = w["last"] = None
+        by_address.setdefault(w["address"], []).append(w)
+    sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(fastpath.ETH_TYPE_IP))
+    sock.bind((iface, 0))
+    sock.settimeout(0.1)
+    while time.time() < end:
+        try:
+            data, addr = sock.recvfrom(2048)
+        except socket.timeout:
+            continue
+        now = time.time()
+        if addr[2] == socket.PACKET_OUTGOING:
+            continue
+        _, _, ethertype, offset = fastpath.parse_eth(data)
+        if ethertype != fastpath.ETH_TYPE_IP:
+            continue
+        proto, _, dst = fastpath.parse_ipv4(data, offset)
+        if proto != 17:
+            continue
+        if dst not in by_address:
+            strays += dst in addresses
+            continue
+        group_windows = by_address[dst]
+        if now < group_windows[0]["start"]:
+            strays += 1
+            continue
+        for i, w in enumerate(group_windows):
+            if now < w["start"]:
+                break
+            following = group_windows[i + 1]["start"] if i + 1 < len(group_windows) else None
+            if now < w["stop"]:
+                if w["first"] is None:
+                    w["first"] = now
+            elif following is None or now < following:
+                w["last"] = now
+    sock.close()
+    return strays
+
+
+def agent(spec_file, out_file):
+    with open(spec_file) as f:
+        spec = json.load(f)
+    senders = [threading.Thread(target=send_stream, args=(s["address"], s["start"], s["stop"],
+                                                          spec["interval"]))
+               for s in spec["sends"]]
+    member = threading.Thread(target=membership, args=(spec["windows"],))
+    for t in senders + [member]:
+        t.daemon = True
+        t.start()
+    strays = watch(spec["iface"], spec["windows"], spec["end"], spec["addresses"])
+    with open(out_file, "w") as f:
+        json.dump(dict(windows=spec["windows"], strays=strays), f)
+
+
+def wait_until(at):
+    delay = at - time.time()
+    if delay > 0:
+        time.sleep(delay)
+
+
+# controller side
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[int(round(q * (len(values) - 1)))]
+
+
+def summarize(windows, hold, strays=0):
+    # the source keeps sending hold seconds past the group's removal, a
+    # host still fed by then was never torn down
+    provision, teardown = [], []
+    missed = leaked = 0
+    for w in windows:
+        if w["first"] is None:
+            missed += 1
+        else:
+            provision.append(w["first"] - w["start"])
+        last = w["last"] - w["stop"] if w["last"] is not None else 0.0
+        if last > hold - 0.1:
+            leaked += 1
+        else:
+            teardown.append(last)
+    return dict(windows=len(windows), missed=missed, leaked=leaked, strays=strays,
+                provision=provision, teardown=teardown)
+
+
+def build(builder, config, protocols):
+    if builder == 'newtopo':
+        if protocols != 'OpenFlow13':
+            raise SystemExit("NewTopo.py switches only speak OpenFlow13, use --builder gen_topo")
+        from NewTopo import start_network
+        net, _ = start_network(config)
+        return net
+    from gen_topo import build_network
+    return build_network(config, protocols)
+
+
+def run_variant(name, config, rules, trace, args):
+    app, protocols, mode = VARIANTS[name]
+    workdir = tempfile.mkdtemp(prefix='provision-%s-' % name)
+    events, groups, windows, final = schedule(rules, trace, args.hold)
+    known = {}
+    if mode == 'file':
+        # netconf's groups are the streams held at the source from the
+        # start, once each however often their group comes and goes
+        streams = set()
+        for t, event in events:
+            info = event.get("info")
+            if event["op"] == "add" and (info["source"], info["multicast_address"]) not in streams:
+                streams.add((info["source"], info["multicast_address"]))
+                known["stream%d" % len(streams)] = info
+    netconf = dict(config, multicast_groups=known)
+    gen_config.write_json(netconf, os.path.join(workdir, 'netconf.json'))
+    with open(os.path.join(workdir, 'netconf.txt'), 'w') as f:
+        f.write(repr(netconf) + '\n')
+    rule_file = os.path.join(workdir, 'file.json')
+    gen_config.write_json({}, rule_file)
+
+    log = open(os.path.join(workdir, 'ryu.log'), 'w')
+    ryu = subprocess.Popen(['ryu-manager', app], cwd=workdir, stdout=log, stderr=subprocess.STDOUT)
+    net = None
+    try:
+        net = build(args.builder, config, protocols)
+        time.sleep(args.settle)
+
+        addresses = sorted(set(group["address"] for group in groups.values()))
+        base = time.time() + args.lead_in
+        specs = {}
+        for host, ws in windows.items():
+            specs[host] = dict(windows=[dict(w, start=base + w["start"], stop=base + w["stop"])
+                                        for w in ws], sends=[])
+        for group in groups.values():
+            spec = specs.setdefault(group["source"], dict(windows=[], sends=[]))
+            spec["sends"].append(dict(address=group["address"],
+                                      start=base + group["start"] - args.lead,
+                                      stop=base + group["stop"] + args.hold))
+        agents = []
+        for host, spec in specs.items():
+            spec.update(iface=host + '-eth0', end=base + final, interval=args.interval,
+                        addresses=addresses)
+            spec_file = os.path.join(workdir, host + '.spec.json')
+            out_file = os.path.join(workdir, host + '.out.json')
+            with open(spec_file, 'w') as f:
+                json.dump(spec, f)
+            agents.append((out_file, net.get(host).popen(
+                [sys.executable, os.path.abspath(__file__), 'agent', spec_file, out_file])))
+
+        current = {}
+        for t, event in events:
+            if mode != 'file':
+                break
+            wait_until(base + t)
+            gen_config.apply_event(current, event)
+            gen_config.write_json(current, rule_file)
+        results = []
+        strays = 0
+        for out_file, proc in agents:
+            proc.wait()
+            if os.path.exists(out_file):
+                with open(out_file) as f:
+                    out = json.load(f)
+                results.extend(out["windows"])
+                strays += out["strays"]
+        if mode == 'file' and strays:
+            # controller.py only forwards a stream down its group's tree
+            sys.stderr.write('%s: %d packets reached hosts outside their group\n' % (name, strays))
+        return summarize(results, args.hold, strays)
+    finally:
+        if net is not None:
+            net.stop()
+        ryu.terminate()
+        ryu.wait()
+        log.close()
+
+
+def ms(value):
+    return '%8.1f' % (value * 1000) if value is not None else '%8s' % '-'
+
+
+def report(results, out=sys.stdout):
+    out.write('%-12s %6s %6s %6s %6s  %8s %8s  %8s %8s\n' % (
+        'controller', 'hosts', 'missed', 'leaked', 'strays', 'prov p50', 'prov p99',
+        'tear p50', 'tear p99'))
+    for name, r in results.items():
+        out.write('%-12s %6d %6d %6d %6d  %s %s  %s %s\n' % (
+            name, r['windows'], r['missed'], r['leaked'], r['strays'],
+            ms(percentile(r['provision'], 0.5)), ms(percentile(r['provision'], 0.99)),
+            ms(percentile(r['teardown'], 0.5)), ms(percentile(r['teardown'], 0.99))))
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == 'agent':
+        return agent(sys.argv[2], sys.argv[3])
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('controllers', nargs='+', choices=sorted(VARIANTS))
+    parser.add_argument('--netconf', default='netconf.json')
+    parser.add_argument('--rules', default='file.json', help='groups added at the start')
+    parser.add_argument('--trace', default=None, help='gen_config.py churn trace played after them')
+    parser.add_argument('--builder', choices=('gen_topo', 'newtopo'), default='gen_topo')
+    parser.add_argument('--hold', type=float, default=5.0,
+                        help='seconds to keep the groups after the last event, and to watch after')
+    parser.add_argument('--settle', type=float, default=5.0,
+                        help='seconds for the switches to connect before the run')
+    parser.add_argument('--lead-in', type=float, default=2.0, help='seconds for the host agents to start')
+    parser.add_argument('--lead', type=float, default=0.5,
+                        help='seconds a source sends before its group is added')
+    parser.add_argument('--interval', type=float, default=0.001, help='seconds between packets')
+    parser.add_argument('--json', default=None, help='also write the raw latencies here')
+    args = parser.parse_args()
+
+    from mininet.log import setLogLevel
+    setLogLevel('warning')
+    config = gen_config.load_json(args.netconf)
+    rules = gen_config.load_json(args.rules) if args.rules else {}
+    trace = gen_config.load_trace(args.trace) if args.trace else []
+    results = {}
+    for name in args.controllers:
+        results[name] = run_variant(name, config, rules, trace, args)
+    report(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,10 @@
+import logging
 import os
 import sys
 import time
 from ryu.base import app_manager
 from ryu.controller import ofp_event
-from ryu.controller.handler import CONFIG_DISPATCHER, MAIN_DISPATCHER
+from ryu.controller.handler import CONFIG_DISPATCHER, MAIN_DISPATCHER, DEAD_DISPATCHER
 from ryu.controller.handler import set_ev_cls
 from ryu.ofproto import ofproto_v1_3
 from ryu.lib.packet import packet
@@ -19,6 +20,12 @@ from ryu.lib.packet import udp
 from ryu.lib import hub
 import json
 import group_table
+import fastpath
+from mac_table import MOVED, MacTables, int_to_mac, mac_to_int
+from shadow_table import ShadowTable
+from telemetry import StatsCollector
+from link_load import LinkLoad
+from rule_watcher import RuleWatcher, diff_rules
 
 
 rule_file =  "file" + ".json"
@@ -34,14 +41,43 @@ json_file =  "netconf" + ".json"
 
 config = load_config()
 
+# learned flows expire once the host has been quiet this long (seconds)
+IDLE_TIMEOUT = 60
+# marks learned flows so a port going down only removes those
+LEARNED_COOKIE = 0x1
+# how often switches are read back and repaired (seconds)
+AUDIT_INTERVAL = 30
+# per-group rates are written here this often (seconds) for anyone to read
+STATS_FILE = "stats.json"
+STATS_INTERVAL = 5
+# "load" trees crossing a link busier than this are moved off it, at
+# most REBALANCE_GROUPS of them every REBALANCE_INTERVAL seconds
+REBALANCE_THRESHOLD = 0.8
+REBALANCE_GROUPS = 4
+REBALANCE_INTERVAL = 10
+# trees whose backups are worked out per monitor round, so a link going
+# down only has to look them up
+BACKUP_TREES = 20
+
 
 class Controller13(app_manager.RyuApp):
     OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
 
     def __init__(self, *args, **kwargs):
         super(Controller13, self).__init__(*args, **kwargs)
-        self.mac_to_port = {}
-        self.info = []
+        # hosts moving between edge ports are rebound, fabric ports keep
+        # the loop guard
+        self.mac_tables = MacTables(fabric=group_table.topo.fabric_ports())
+        self.decisions = fastpath.DecisionCache()
+        self.installed = {}
+        self.datapaths = {}
+        self.barriers = {}
+        # everything but the learned flows, as intended and as read back
+        self.shadow = ShadowTable(cookie=0, cookie_mask=0xffffffffffffffff)
+        self.repair = False
+        # traffic per multicast group, polled harder on busy switches
+        self.stats = StatsCollector(cookie=0, cookie_mask=0xffffffffffffffff)
+        group_table.link_load = LinkLoad(group_table.topo, self.stats)
         self.monitor_thread = hub.spawn(self._monitor)
 
     @set_ev_cls(ofp_event.EventOFPSwitchFeatures, CONFIG_DISPATCHER)
@@ -49,15 +85,17 @@ class Controller13(app_manager.RyuApp):
         datapath = ev.msg.datapath
         ofproto = datapath.ofproto
         parser = datapath.ofproto_parser
-        
+        self.datapaths[datapath.id] = datapath
+
         match = parser.OFPMatch()
         actions = [parser.OFPActionOutput(ofproto.OFPP_CONTROLLER,
                                           ofproto.OFPCML_NO_BUFFER)]
         self.add_flow(datapath, 0, match, actions)
+        self.shadow.audit(datapath)
 
     
 
-    def add_flow(self, datapath, priority, match, actions, buffer_id=None):
+    def add_flow(self, datapath, priority, match, actions, buffer_id=None, idle_timeout=0, cookie=0):
         ofproto = datapath.ofproto
         parser = datapath.ofproto_parser
 
@@ -66,39 +104,238 @@ class Controller13(app_manager.RyuApp):
 
         if buffer_id:
           mod = parser.OFPFlowMod(datapath=datapath, buffer_id=buffer_id,
-                             priority=priority, match=match,
-                             instructions=inst)
+                             priority=priority, match=match, cookie=cookie,
+                             idle_timeout=idle_timeout, instructions=inst)
         else:
             mod = parser.OFPFlowMod(datapath=datapath, priority=priority,
-                             match=match, instructions=inst)
-        datapath.send_msg(mod)
+                             match=match, cookie=cookie, idle_timeout=idle_timeout,
+                             instructions=inst)
+        mod = self.shadow.apply(datapath, mod)
+        if mod is not None:
+            datapath.send_msg(mod)
+
+    @set_ev_cls(ofp_event.EventOFPStateChange, DEAD_DISPATCHER)
+    def _state_change_handler(self, ev):
+        datapath = ev.datapath
+        if self.datapaths.get(datapath.id) is datapath:
+            del self.datapaths[datapath.id]
+            self.mac_tables.remove(datapath.id)
+            self.decisions.bump(datapath.id)
+            self.shadow.forget(datapath.id)
+            self.stats.forget(datapath.id)
+
+    @set_ev_cls(ofp_event.EventOFPFlowStatsReply, MAIN_DISPATCHER)
+    def _flow_stats_reply_handler(self, ev):
+        if self.stats.flow_stats_reply(ev.msg):
+            return
+        if self.shadow.flow_stats_reply(ev.msg):
+            self.repair_switch(ev.msg.datapath)
+
+    @set_ev_cls(ofp_event.EventOFPPortStatsReply, MAIN_DISPATCHER)
+    def _port_stats_reply_handler(self, ev):
+        self.stats.port_stats_reply(ev.msg)
+
+    @set_ev_cls(ofp_event.EventOFPGroupDescStatsReply, MAIN_DISPATCHER)
+    def _group_desc_stats_reply_handler(self, ev):
+        if self.shadow.group_desc_reply(ev.msg):
+            self.repair_switch(ev.msg.datapath)
+
+    @set_ev_cls(ofp_event.EventOFPGroupStatsReply, MAIN_DISPATCHER)
+    def _group_stats_reply_handler(self, ev):
+        self.stats.group_stats_reply(ev.msg)
+
+    def repair_switch(self, datapath):
+        # before the first install the intended state is still empty
+        if not self.repair:
+            return
+        msgs = self.shadow.diff(datapath)
+        if msgs:
+            print ("dpid {} drifted, sending {} corrections".format(datapath.id, len(msgs)))
+            for msg in msgs:
+                datapath.send_msg(msg)
+
+    @set_ev_cls(ofp_event.EventOFPBarrierReply, MAIN_DISPATCHER)
+    def _barrier_reply_handler(self, ev):
+        start = self.barriers.pop((ev.msg.datapath.id, ev.msg.xid), None)
+        if start is not None:
+            print ("batch installed on dpid {} in {:.1f} ms".format(
+                ev.msg.datapath.id, (time.time() - start) * 1000))
+
+    def commit(self, batch):
+        # only what the switches do not hold already
+        batch.rewrite(self.shadow.apply)
+        start = time.time()
+        for dpid, xid in batch.commit().items():
+            self.barriers[(dpid, xid)] = start
 
     def _monitor(self):
-        time.sleep(1)
-        group_table.drop()
+        # wait for the topo built by gen_topo.py to connect and be read back
+        while (len(self.datapaths) < len(group_table.switchname_to_dpid)
+               or not all(self.shadow.synced(dpid) for dpid in self.datapaths)):
+            time.sleep(0.1)
+        self.install_drop()
+        watcher = RuleWatcher(rule_file)
+        audited = saved = rebalanced = time.time()
         while True:
-            rule = load_config()
-            for item in rule.keys():
-                if item not in self.info:
-                    print ("add group table:", item)
-                    self.info.append(item)
-                    group_table.access(item)
-                    time.sleep(0.1)
-                    group_table.add_group(item)
-                    time.sleep(0.1)
-                    group_table.add_flow(item)
-            time.sleep(3)
+            rule = watcher.poll()
+            if rule is not None:
+                self.reconcile(rule)
+            if self.repair and time.time() - audited > AUDIT_INTERVAL:
+                audited = time.time()
+                for datapath in list(self.datapaths.values()):
+                    self.shadow.audit(datapath)
+            self.stats.poll(dict(self.datapaths))
+            if time.time() - saved > STATS_INTERVAL:
+                saved = time.time()
+                self.stats.save(STATS_FILE)
+            self.follow_spines()
+            if time.time() - rebalanced > REBALANCE_INTERVAL:
+                rebalanced = time.time()
+                self.rebalance()
+            group_table.backups.refresh(group_table.trees, BACKUP_TREES)
+            time.sleep(0.1)
+
+    def install_drop(self):
+        # the drop entries every switch holds before any group is added
+        batch = group_table.FlowBatch(self.datapaths)
+        group_table.drop(batch)
+        self.commit(batch)
+
+    def reconcile(self, rule):
+        added, removed, modified = diff_rules(self.installed, rule)
+        batch = group_table.FlowBatch(self.datapaths)
+        for item in removed:
+            print ("delete group table:", item)
+            group_table.del_group(item, batch, self.installed[item])
+            group_table.block(item, batch, self.installed.pop(item))
+            self.stats.untrack(item)
+        for item in modified:
+            print ("modify group table:", item)
+            group_table.mod_group(item, batch, self.installed[item], rule[item])
+            self.installed[item] = rule[item]
+            self.stats.track(item, group_table.group_match(item, rule[item]))
+        for item in added:
+            print ("add group table:", item)
+            self.installed[item] = rule[item]
+            group_table.access(item, batch, rule[item])
+            group_table.add_group(item, batch, rule[item])
+            group_table.add_flow(item, batch, rule[item])
+            self.stats.track(item, group_table.group_match(item, rule[item]))
+        if not self.repair:
+            group_table.prune_groups(batch)
+        self.commit(batch)
+        group_table.group_ids.save()
+        # from now on drifted switches are repaired
+        self.repair = True
+
+
+    def rebalance(self):
+        batch = group_table.FlowBatch(self.datapaths)
+        hot = group_table.link_load.hot_links(REBALANCE_THRESHOLD)
+        if hot:
+            moved = group_table.rebalance(self.installed, hot, batch, REBALANCE_GROUPS)
+            if moved:
+                print ("moved {} off {}".format(", ".join(moved),
+                                                ", ".join("{}->{}".format(u, v) for u, v in hot)))
+        placement = group_table.spine_placement
+        moved = group_table.rehome(self.installed, placement.rebalance(), batch)
+        if moved:
+            print ("spread {} over the spines".format(", ".join(moved)))
+        if len(batch):
+            self.commit(batch)
+            group_table.group_ids.save()
+
+    def follow_spines(self):
+        # "spine" trees leave a spine that went away and take their share
+        # of one that (re)joined once it has been read back
+        placement = group_table.spine_placement
+        live = [s for s in sorted(placement.known)
+                if self.shadow.synced(group_table.switchname_to_dpid[s])
+                and group_table.switchname_to_dpid[s] in self.datapaths]
+        if live == placement.spines:
+            return
+        batch = group_table.FlowBatch(self.datapaths)
+        moved = group_table.rehome(self.installed, placement.set_spines(live), batch)
+        print ("spines now {}, rehomed {}".format(", ".join(live), ", ".join(moved) or "nothing"))
+        if moved:
+            self.commit(batch)
+            group_table.group_ids.save()
 
 
     #mac learning
     def mac_learning(self, datapath, src, in_port):
-        self.mac_to_port.setdefault((datapath,datapath.id), {})
-        if src in self.mac_to_port[(datapath,datapath.id)]:
-            if in_port != self.mac_to_port[(datapath,datapath.id)][src]:
-                return False
+        table = self.mac_tables.table(datapath.id)
+        if table.expire():
+            self.decisions.bump(datapath.id)
+        learned = table.learn(src, in_port)
+        if learned:
+            self.decisions.bump(datapath.id)
+        if learned is MOVED:
+            self.forget_flows_to(datapath, src)
+        return learned
+
+    def forget_flows_to(self, datapath, mac):
+        # the learned flows still send a moved host's traffic where it was
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        mod = parser.OFPFlowMod(datapath=datapath, cookie=LEARNED_COOKIE,
+                                cookie_mask=0xffffffffffffffff,
+                                command=ofproto.OFPFC_DELETE, table_id=ofproto.OFPTT_ALL,
+                                out_port=ofproto.OFPP_ANY, out_group=ofproto.OFPG_ANY,
+                                match=parser.OFPMatch(eth_dst=int_to_mac(mac)))
+        datapath.send_msg(mod)
+
+    @set_ev_cls(ofp_event.EventOFPPortStatus, MAIN_DISPATCHER)
+    def _port_status_handler(self, ev):
+        msg = ev.msg
+        ofproto = msg.datapath.ofproto
+        if msg.reason == ofproto.OFPPR_DELETE or msg.desc.state & ofproto.OFPPS_LINK_DOWN:
+            self.port_down(msg.datapath, msg.desc.port_no)
+            self.link_down(msg.datapath, msg.desc.port_no)
         else:
-            self.mac_to_port[(datapath,datapath.id)][src] = in_port
-            return True
+            self.link_up(msg.datapath, msg.desc.port_no)
+
+    def port_down(self, datapath, port_no):
+        """Forget the hosts behind a dead port and the flows leading to it."""
+        if self.mac_tables.flush_port(datapath.id, port_no):
+            self.decisions.bump(datapath.id)
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        mod = parser.OFPFlowMod(datapath=datapath, cookie=LEARNED_COOKIE,
+                                cookie_mask=0xffffffffffffffff,
+                                command=ofproto.OFPFC_DELETE, table_id=ofproto.OFPTT_ALL,
+                                out_port=port_no, out_group=ofproto.OFPG_ANY,
+                                match=parser.OFPMatch())
+        datapath.send_msg(mod)
+
+    def link_down(self, datapath, port_no):
+        """Fail the multicast trees crossing the port's link over to their
+        backups, only the switches whose buckets change are sent anything."""
+        start = time.time()
+        switch = group_table.topo.switch_name(datapath.id)
+        link = group_table.backups.port_down(switch, port_no)
+        if link is None or not self.installed:
+            return
+        batch = group_table.FlowBatch(self.datapaths)
+        moved = group_table.fail_over(self.installed, link, batch)
+        if len(batch):
+            self.commit(batch)
+            group_table.group_ids.save()
+        print ("link {} down, failed over {} in {:.1f} ms".format(
+            "-".join(sorted(link)), ", ".join(moved) or "nothing", (time.time() - start) * 1000))
+
+    def link_up(self, datapath, port_no):
+        # trees routed around the link may go back over it
+        switch = group_table.topo.switch_name(datapath.id)
+        link = group_table.backups.port_up(switch, port_no)
+        if link is None or not self.installed:
+            return
+        batch = group_table.FlowBatch(self.datapaths)
+        moved = group_table.restore(self.installed, batch)
+        if len(batch):
+            self.commit(batch)
+            group_table.group_ids.save()
+        print ("link {} up, restored {}".format("-".join(sorted(link)), ", ".join(moved) or "nothing"))
 
     @set_ev_cls(ofp_event.EventOFPPacketIn, MAIN_DISPATCHER)
     def _packet_in_handler(self, ev):
@@ -107,46 +344,45 @@ class Controller13(app_manager.RyuApp):
         ofproto = datapath.ofproto
         parser = datapath.ofproto_parser
         in_port = msg.match['in_port']
-        pkt = packet.Packet(msg.data)
-        eth = pkt.get_protocols(ethernet.ethernet)[0]
-        if eth.ethertype == ether_types.ETH_TYPE_LLDP:
-            match = parser.OFPMatch(eth_type=eth.ethertype)
-            actions = []
-            self.add_flow(datapath, 10, match, actions)
-            return
-
-        if eth.ethertype == ether_types.ETH_TYPE_IPV6:
-            match = parser.OFPMatch(eth_type=eth.ethertype)
+        # only the Ethernet header is read, no full packet decode
+        dst_mac, src_mac, ethertype, _ = fastpath.parse_eth(msg.data)
+        if ethertype == fastpath.ETH_TYPE_LLDP or ethertype == fastpath.ETH_TYPE_IPV6:
+            match = parser.OFPMatch(eth_type=ethertype)
             actions = []
             self.add_flow(datapath, 10, match, actions)
             return
 
-        dst = eth.dst
-        src = eth.src
         dpid = datapath.id
+        dst = mac_to_int(dst_mac)
+        src = mac_to_int(src_mac)
 
-        self.logger.info("packet in %s %s %s %s", dpid, src, dst, in_port)
-        self.mac_learning(datapath, src, in_port)
-
-        if dst in self.mac_to_port[(datapath,datapath.id)]:
-            out_port = self.mac_to_port[(datapath,datapath.id)][dst]
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug("packet in %s %s %s %s", dpid, fastpath.mac_str(src_mac),
+                              fastpath.mac_str(dst_mac), in_port)
+        if self.mac_learning(datapath, src, in_port) is False:
+            out_port = self.mac_tables.table(dpid).lookup(dst)
+            if out_port is None:
+                # src showed up on another fabric port: a loop, do not flood it again
+                return
         else:
-            if self.mac_learning(datapath, src, in_port) is False:
-                out_port = ofproto.OFPPC_NO_RECV
-            else:
-                out_port = ofproto.OFPP_FLOOD
+            out_port = self.decisions.get(dpid, in_port, dst)
+            if out_port is None:
+                out_port = self.mac_tables.table(dpid).lookup(dst)
+                if out_port is None:
+                    out_port = ofproto.OFPP_FLOOD
+                self.decisions.put(dpid, in_port, dst, out_port)
 
         actions = [parser.OFPActionOutput(out_port)]
-        if eth.ethertype == ether_types.ETH_TYPE_IP:
-            ip = pkt.get_protocol(ipv4.ipv4)
 
         if out_port != ofproto.OFPP_FLOOD:
-            match = parser.OFPMatch(in_port=in_port, eth_dst=dst)
+            match = parser.OFPMatch(in_port=in_port, eth_dst=fastpath.mac_str(dst_mac))
             if msg.buffer_id != ofproto.OFP_NO_BUFFER:
-                self.add_flow(datapath, 10, match, actions, msg.buffer_id)
+                self.add_flow(datapath, 10, match, actions, msg.buffer_id,
+                              idle_timeout=IDLE_TIMEOUT, cookie=LEARNED_COOKIE)
                 return
             else:
-                self.add_flow(datapath, 10, match, actions)
+                self.add_flow(datapath, 10, match, actions,
+                              idle_timeout=IDLE_TIMEOUT, cookie=LEARNED_COOKIE)
 
         data = None
         if msg.buffer_id == ofproto.OFP_NO_BUFFER:
@@ -154,6 +390,3 @@ class Controller13(app_manager.RyuApp):
         out = parser.OFPPacketOut(datapath=datapath, buffer_id=msg.buffer_id,
                                   in_port=in_port, actions=actions, data=data)
         datapath.send_msg(out)
-
-
- 
\ No newline at end of file
@@ -0,0 +1,527 @@
+"""Run a multicast controller against emulated switches, no Mininet needed.
+
+    python emulate.py controller --netconf netconf.json --rules file.json
+    python emulate.py newryu --netconf netconf.json --trace churn.jsonl
+    python emulate.py simple --netconf netconf.json --rules file.json --trace churn.jsonl
+
+The app is loaded in-process with its handlers wired the way ryu-manager
+wires them, and every switch is a FakeDatapath that serializes and counts
+what the app sends, applies FlowMods, GroupMods and bundles to its own
+tables and answers barriers and flow/group stats requests from them.
+
+All switches enter first, then the rules (file.json schema) are installed
+and the trace is played event by event, as fast as the app takes them.
+A trace is JSON lines as written by gen_config.py churn, plus
+    {"op": "igmp_join" | "igmp_leave", "host": ..., "address": ...}
+    {"op": "packet_in", "switch": ..., "port": ..., "data": hex frame}
+    {"op": "switch_enter" | "switch_leave", "switch": ...}
+    {"op": "link_down" | "link_up", "switch": ..., "peer": ...}
+    {"op": "rules", "rules": {...}}
+Controller13 gets membership changes as rule file updates, the IGMP
+snooping apps as IGMP reports and leaves from the host's port.
+
+Per event type it reports the messages sent, wall time and controller
+CPU time, and messages per group for the whole run. The apps run in a
+scratch directory so their group_ids.json stays out of the tree.
+"""
+import argparse
+import collections
+import contextlib
+import copy
+import importlib.util
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from ryu.controller import dpset, handler, ofp_event
+from ryu.controller.handler import CONFIG_DISPATCHER, DEAD_DISPATCHER, MAIN_DISPATCHER
+from ryu.lib.packet import ethernet, ether_types, igmp, ipv4, packet, udp
+from ryu.ofproto import ofproto_parser, ofproto_protocol
+
+import gen_config
+from shadow_table import apply_flow_mod, apply_group_mod
+from topology import Topology
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+LEAFSPINE = os.path.join(ROOT, 'leafspine-simple', 'leafspine-simple')
+
+# name -> (file, class)
+APPS = {
+    'controller': (os.path.join(ROOT, 'controller.py'), 'Controller13'),
+    'learning': (os.path.join(ROOT, 'new', 'new', 'controller.py'), 'MulticastController'),
+    'newryu': (os.path.join(LEAFSPINE, 'NewRyu.py'), 'MulticastRyuApp'),
+    'simple': (os.path.join(LEAFSPINE, 'ryu-simple-multicast.py'), 'APP'),
+}
+
+IGMP_ALL_ROUTERS = '224.0.0.2'
+
+
+_message_names = {}
+
+
+def message_names(parser):
+    """{OpenFlow message type: parser class name} for parser."""
+    names = _message_names.get(parser)
+    if names is None:
+        names = _message_names[parser] = {}
+        for name, cls in vars(parser).items():
+            if name.startswith('OFP') and isinstance(cls, type) and hasattr(cls, 'cls_msg_type'):
+                names.setdefault(cls.cls_msg_type, name)
+    return names
+
+
+class FakeDatapath(object):
+    """Serializes what the controller sends, like a real connection would,
+    and unless tables is False keeps the flow and group tables the
+    messages would leave behind."""
+
+    def __init__(self, dpid, version, tables=True):
+        desc = ofproto_protocol.ProtocolDesc(version)
+        self.id = dpid
+        self.ofproto = desc.ofproto
+        self.ofproto_parser = desc.ofproto_parser
+        self.ports = {}
+        self.is_active = True
+        self.tables = tables
+        self.xid = 0
+        self.sent = 0
+        self.bytes = 0
+        self.counts = collections.Counter()
+        self.flows = {}
+        self.groups = {}
+        self.bundles = {}
+        self.replies = []
+
+    def set_xid(self, msg):
+        self.xid += 1
+        msg.set_xid(self.xid)
+        return self.xid
+
+    def send_msg(self, msg):
+        if msg.xid is None:
+            self.set_xid(msg)
+        msg.serialize()
+        self.sent += 1
+        self.bytes += len(msg.buf)
+        self.counts[type(msg).__name__] += 1
+        if self.tables:
+            self.receive(msg)
+
+    def send(self, buf):
+        """Raw writes (InstallPlan.replay) are counted per message; ryu
+        cannot parse GroupMods back, so they are not applied to the tables."""
+        names = message_names(self.ofproto_parser)
+        offset = 0
+        while offset < len(buf):
+            version, msg_type, msg_len, xid = ofproto_parser.header(buf[offset:])
+            self.sent += 1
+            self.counts[names.get(msg_type, 'unknown')] += 1
+            if msg_type == self.ofproto.OFPT_BARRIER_REQUEST:
+                reply = self.ofproto_parser.OFPBarrierReply(self)
+                reply.xid = xid
+                self.replies.append(reply)
+            offset += msg_len
+        self.bytes += len(buf)
+
+    def close(self):
+        self.is_active = False
+
+    def receive(self, msg):
+        parser = self.ofproto_parser
+        ofproto = self.ofproto
+        if isinstance(msg, parser.OFPFlowMod):
+            apply_flow_mod(self.flows, msg)
+        elif isinstance(msg, parser.OFPGroupMod):
+            apply_group_mod(self.groups, self.flows, msg)
+        elif isinstance(msg, parser.OFPBarrierRequest):
+            self.reply(parser.OFPBarrierReply(self), msg)
+        elif hasattr(parser, 'OFPBundleAddMsg') and isinstance(msg, parser.OFPBundleAddMsg):
+            # counted by what they carry too, so bundled FlowMods show up
+            self.counts[type(msg.message).__name__] += 1
+            self.bundles.setdefault(msg.bundle_id, []).append(msg.message)
+        elif hasattr(parser, 'OFPBundleCtrlMsg') and isinstance(msg, parser.OFPBundleCtrlMsg):
+            if msg.type == ofproto.OFPBCT_COMMIT_REQUEST:
+                for inner in self.bundles.pop(msg.bundle_id, []):
+                    self.receive(inner)
+            elif msg.type == ofproto.OFPBCT_DISCARD_REQUEST:
+                self.bundles.pop(msg.bundle_id, None)
+        elif ofproto.OFP_VERSION == 0x04:
+            self.stats(msg)
+
+    def stats(self, msg):
+        # the OpenFlow 1.3 multipart replies Controller13 reads back
+        parser = self.ofproto_parser
+        if isinstance(msg, parser.OFPFlowStatsRequest):
+            body = [parser.OFPFlowStats(
+                table_id=e.table_id, duration_sec=0, duration_nsec=0, priority=e.priority,
+                idle_timeout=e.idle_timeout, hard_timeout=e.hard_timeout, flags=e.flags,
+                cookie=e.cookie, packet_count=0, byte_count=0, match=e.match,
+                instructions=e.instructions)
+                for e in self.flows.values() if e.matches(msg, False)]
+            self.reply(parser.OFPFlowStatsReply(self, body=body, flags=0), msg)
+        elif isinstance(msg, parser.OFPGroupDescStatsRequest):
+            body = [parser.OFPGroupDescStats(e.type, gid, e.buckets) for gid, e in self.groups.items()]
+            self.reply(parser.OFPGroupDescStatsReply(self, body=body, flags=0), msg)
+        elif isinstance(msg, parser.OFPGroupStatsRequest):
+            # counters are not emulated
+            self.reply(parser.OFPGroupStatsReply(self, body=[], flags=0), msg)
+        elif isinstance(msg, parser.OFPPortStatsRequest):
+            self.reply(parser.OFPPortStatsReply(self, body=[], flags=0), msg)
+
+    def reply(self, reply, request):
+        reply.xid = request.xid
+        self.replies.append(reply)
+
+
+class Emulator(object):
+    """Drives one app instance: switches, packet-ins, rules and churn."""
+
+    def __init__(self, name, config, quiet=True):
+        self.name = name
+        self.config = config
+        self.topology = Topology(config)
+        self.rules = {}
+        self.quiet = quiet
+        self.workdir = tempfile.mkdtemp(prefix='emulate-')
+        self.datapaths = {}
+        self.left = []
+        self.stats = collections.OrderedDict()
+        self.bricks = []
+        self.app = None
+        self.dpset = None
+
+    def close(self):
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    @contextlib.contextmanager
+    def app_context(self):
+        cwd = os.getcwd()
+        os.chdir(self.workdir)
+        out = io.StringIO() if self.quiet else sys.stdout
+        try:
+            with contextlib.redirect_stdout(out):
+                yield
+        finally:
+            os.chdir(cwd)
+
+    def start(self):
+        filename, cls_name = APPS[self.name]
+        with open(os.path.join(self.workdir, 'netconf.json'), 'w') as f:
+            json.dump(self.config, f)
+        with open(os.path.join(self.workdir, 'netconf.txt'), 'w') as f:
+            f.write(repr(self.config) + '\n')
+        with open(os.path.join(self.workdir, 'file.json'), 'w') as f:
+            # Controller13 installs the rules itself once the switches are in
+            json.dump({}, f)
+        for path in (ROOT, os.path.dirname(filename)):
+            if path not in sys.path:
+                sys.path.insert(0, path)
+
+        def load():
+            spec = importlib.util.spec_from_file_location('emulated_' + self.name, filename)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            cls = getattr(module, cls_name)
+            kwargs = {}
+            if 'dpset' in getattr(cls, '_CONTEXTS', {}):
+                self.dpset = kwargs['dpset'] = dpset.DPSet()
+                self.bricks.append(self.dpset)
+            self.app = cls(**kwargs)
+            self.bricks.append(self.app)
+            for brick in self.bricks:
+                handler.register_instance(brick)
+            self.version = cls.OFP_VERSIONS[0]
+        self.measure('start', load)
+
+    def dispatch(self, ev, state):
+        for brick in self.bricks:
+            for fn in brick.get_handlers(ev, state):
+                fn(ev)
+
+    def deliver_replies(self):
+        while True:
+            pending = [dp for dp in self.datapaths.values() if dp.replies]
+            if not pending:
+                return
+            for dp in pending:
+                replies, dp.replies = dp.replies, []
+                for reply in replies:
+                    cls = ofp_event.ofp_msg_to_ev_cls(type(reply))
+                    self.dispatch(cls(reply), MAIN_DISPATCHER)
+
+    def measure(self, op, fn, *args):
+        """Run fn with the app's cwd, count what it sends and its time."""
+        sent = self.sent()
+        wire = self.wire()
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        with self.app_context():
+            fn(*args)
+            if self.app is not None:
+                self.deliver_replies()
+        cpu = time.process_time() - cpu
+        wall = time.perf_counter() - wall
+        after = self.sent()
+        stat = self.stats.setdefault(op, dict(events=0, wall=[], cpu=0.0, msgs=0,
+                                              counts=collections.Counter()))
+        stat['events'] += 1
+        stat['msgs'] += self.wire() - wire
+        stat['wall'].append(wall)
+        stat['cpu'] += cpu
+        stat['counts'].update(dict((k, v - sent.get(k, 0)) for k, v in after.items()))
+
+    def all_datapaths(self):
+        return list(self.datapaths.values()) + self.left
+
+    def wire(self):
+        return sum(dp.sent for dp in self.all_datapaths())
+
+    def sent(self):
+        total = collections.Counter()
+        for dp in self.all_datapaths():
+            total.update(dp.counts)
+        return total
+
+    # events
+
+    def event(self, event):
+        """Play one event, measured as a whole under its op."""
+        op = event["op"]
+        if op == 'rules':
+            return self.install_rules(event["rules"])
+        if op not in self.handlers:
+            raise ValueError("unknown event %r" % op)
+        self.measure(op, self.handlers[op], self, event)
+
+    def switch_enter(self, event):
+        dpid = self.topology.switch_dpid(event["switch"])
+        dp = self.datapaths[dpid] = FakeDatapath(dpid, self.version)
+        parser = dp.ofproto_parser
+        features = parser.OFPSwitchFeatures(dp, datapath_id=dpid, n_buffers=0, n_tables=254,
+                                            auxiliary_id=0, capabilities=0)
+        self.dispatch(ofp_event.EventOFPSwitchFeatures(features), CONFIG_DISPATCHER)
+        ev = ofp_event.EventOFPStateChange(dp)
+        ev.state = MAIN_DISPATCHER
+        self.dispatch(ev, MAIN_DISPATCHER)
+        if self.dpset is not None:
+            # DPSet only tells observers ryu-manager wired up, tell the app directly
+            self.dispatch(dpset.EventDP(dp, True), dpset.DPSET_EV_DISPATCHER)
+
+    def switch_leave(self, event):
+        dp = self.datapaths.get(self.topology.switch_dpid(event["switch"]))
+        if dp is None:
+            return
+        dp.close()
+        ev = ofp_event.EventOFPStateChange(dp)
+        ev.state = DEAD_DISPATCHER
+        self.dispatch(ev, DEAD_DISPATCHER)
+        if self.dpset is not None:
+            self.dispatch(dpset.EventDP(dp, False), dpset.DPSET_EV_DISPATCHER)
+        # keep its counters in the totals, it just gets no more events
+        self.left.append(self.datapaths.pop(dp.id))
+
+    def link_status(self, event):
+        """Both ends of the switch link report their port down, or up again."""
+        down = event["op"] == 'link_down'
+        u, v = event["switch"], event["peer"]
+        for a, b in ((u, v), (v, u)):
+            dp = self.datapaths.get(self.topology.switch_dpid(a))
+            ports = self.topology.neighbors(a).get(b)
+            if dp is None or ports is None:
+                continue
+            ofproto = dp.ofproto
+            parser = dp.ofproto_parser
+            desc = parser.OFPPort(port_no=ports[0], hw_addr='00:00:00:00:00:00',
+                                  name=('%s-eth%d' % (a, ports[0])).encode(), config=0,
+                                  state=ofproto.OFPPS_LINK_DOWN if down else ofproto.OFPPS_LIVE,
+                                  curr=0, advertised=0, supported=0, peer=0, curr_speed=0,
+                                  max_speed=0)
+            msg = parser.OFPPortStatus(dp, reason=ofproto.OFPPR_MODIFY, desc=desc)
+            self.dispatch(ofp_event.EventOFPPortStatus(msg), MAIN_DISPATCHER)
+
+    def packet_in(self, event):
+        self.send_packet_in(event["switch"], event["port"], bytes.fromhex(event["data"]))
+
+    def send_packet_in(self, switch, port, data):
+        dp = self.datapaths.get(self.topology.switch_dpid(switch))
+        if dp is None:
+            return
+        parser = dp.ofproto_parser
+        msg = parser.OFPPacketIn(dp, buffer_id=dp.ofproto.OFP_NO_BUFFER,
+                                 match=parser.OFPMatch(in_port=port), data=data)
+        self.dispatch(ofp_event.EventOFPPacketIn(msg), MAIN_DISPATCHER)
+
+    def host_packet_in(self, host, data):
+        switch, port = self.topology.host_port(host)
+        if switch is not None:
+            self.send_packet_in(switch, port, data)
+
+    def igmp_join(self, event):
+        host = event["host"]
+        self.host_packet_in(host, igmp_frame(self.topology.host_ip(host), event["address"], True))
+
+    def igmp_leave(self, event):
+        host = event["host"]
+        self.host_packet_in(host, igmp_frame(self.topology.host_ip(host), event["address"], False))
+
+    def churn(self, event):
+        """gen_config.py churn events, as the app would be told of them."""
+        op = event["op"]
+        if self.name == 'controller':
+            gen_config.apply_event(self.rules, event)
+            self.app.reconcile(copy.deepcopy(self.rules))
+            return
+        if op in ('join', 'leave'):
+            info = self.rules.get(event["group"])
+            if info is not None:
+                self.host_packet_in(event["host"], igmp_frame(
+                    self.topology.host_ip(event["host"]), info["multicast_address"], op == 'join'))
+        elif op == 'add':
+            # the source's first packet roots the tree, then the receivers join
+            info = event["info"]
+            source_ip = self.topology.host_ip(info["source"])
+            self.host_packet_in(info["source"], multicast_frame(source_ip, info["multicast_address"]))
+            for host in info["targets"]:
+                self.host_packet_in(host, igmp_frame(
+                    self.topology.host_ip(host), info["multicast_address"], True))
+        elif op == 'remove':
+            info = self.rules.get(event["group"])
+            if info is not None:
+                for host in info["targets"]:
+                    self.host_packet_in(host, igmp_frame(
+                        self.topology.host_ip(host), info["multicast_address"], False))
+        gen_config.apply_event(self.rules, event)
+
+    handlers = {
+        'switch_enter': switch_enter,
+        'switch_leave': switch_leave,
+        'link_down': link_status,
+        'link_up': link_status,
+        'packet_in': packet_in,
+        'igmp_join': igmp_join,
+        'igmp_leave': igmp_leave,
+        'join': churn,
+        'leave': churn,
+        'add': churn,
+        'remove': churn,
+    }
+
+    def install_rules(self, rules):
+        """Bring the groups to rules, the way the app would be told."""
+        if self.name == 'controller':
+            if not self.app.installed:
+                self.measure('install_drop', self.app.install_drop)
+            self.rules = copy.deepcopy(rules)
+            self.measure('rules', self.app.reconcile, copy.deepcopy(rules))
+            return
+        for group in [g for g in self.rules if g not in rules]:
+            self.event({"op": "remove", "group": group})
+        for group, info in rules.items():
+            if group not in self.rules:
+                self.event({"op": "add", "group": group, "info": info})
+
+    def groups(self):
+        handler_ = getattr(self.app, 'igmp_handler', None)
+        if handler_ is not None:
+            return len(handler_.trees)
+        return len(getattr(self.app, 'installed', ()))
+
+    def report(self, out=sys.stdout):
+        out.write('%-14s %7s %9s %9s %9s %10s %10s %10s\n' % (
+            'event', 'count', 'msgs', 'flowmods', 'groupmods', 'wall ms', 'p99 ms', 'cpu ms'))
+        for op, stat in self.stats.items():
+            walls = sorted(stat['wall'])
+            counts = stat['counts']
+            n = stat['events']
+            out.write('%-14s %7d %9d %9d %9d %10.3f %10.3f %10.3f\n' % (
+                op, n, stat['msgs'], counts['OFPFlowMod'], counts['OFPGroupMod'],
+                1000 * sum(walls) / n, 1000 * walls[min(n - 1, int(n * 0.99))],
+                1000 * stat['cpu'] / n))
+        total = self.sent()
+        groups = self.groups()
+        mods = total['OFPFlowMod'] + total['OFPGroupMod']
+        out.write('%d switches, %d groups, %d messages (%d bytes), %.1f flow/group mods per group\n' % (
+            len(self.datapaths), groups, self.wire(),
+            sum(dp.bytes for dp in self.all_datapaths()), mods / float(groups) if groups else 0.0))
+
+    def results(self):
+        return dict((op, dict(events=s['events'], wall=sum(s['wall']), cpu=s['cpu'],
+                              msgs=s['msgs'], counts=dict(s['counts'])))
+                    for op, s in self.stats.items())
+
+
+def igmp_frame(src, group, join):
+    dst = group if join else IGMP_ALL_ROUTERS
+    msgtype = igmp.IGMP_TYPE_REPORT_V2 if join else igmp.IGMP_TYPE_LEAVE
+    pkt = packet.Packet()
+    pkt.add_protocol(ethernet.ethernet(dst=multicast_mac(dst), src=host_mac(src),
+                                       ethertype=ether_types.ETH_TYPE_IP))
+    pkt.add_protocol(ipv4.ipv4(src=src, dst=dst, proto=2, ttl=1))
+    pkt.add_protocol(igmp.igmp(msgtype=msgtype, address=group))
+    pkt.serialize()
+    return bytes(pkt.data)
+
+
+def multicast_frame(src, group):
+    pkt = packet.Packet()
+    pkt.add_protocol(ethernet.ethernet(dst=multicast_mac(group), src=host_mac(src),
+                                       ethertype=ether_types.ETH_TYPE_IP))
+    pkt.add_protocol(ipv4.ipv4(src=src, dst=group, proto=17, ttl=8))
+    pkt.add_protocol(udp.udp(src_port=5000, dst_port=5001))
+    pkt.add_protocol(b'x' * 64)
+    pkt.serialize()
+    return bytes(pkt.data)
+
+
+def host_mac(ip):
+    return '02:00:' + ':'.join('%02x' % int(b) for b in ip.split('.'))
+
+
+def multicast_mac(ip):
+    b = [int(x) for x in ip.split('.')]
+    return '01:00:5e:%02x:%02x:%02x' % (b[1] & 0x7f, b[2], b[3])
+
+
+def run(name, config, rules=None, trace=(), quiet=True):
+    """Start name against config, enter every switch, install rules and
+    play trace, returns the Emulator (closed) with its stats."""
+    emulator = Emulator(name, config, quiet=quiet)
+    try:
+        emulator.start()
+        for dpid in sorted(emulator.topology.switches):
+            emulator.event({"op": "switch_enter", "switch": emulator.topology.switches[dpid]})
+        if rules is not None:
+            emulator.install_rules(rules)
+        for event in trace:
+            emulator.event(event)
+    finally:
+        emulator.close()
+    return emulator
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('app', choices=sorted(APPS))
+    parser.add_argument('--netconf', default='netconf.json')
+    parser.add_argument('--rules', default=None, help='file.json schema rules to install first')
+    parser.add_argument('--trace', default=None, help='JSON lines of events to play')
+    parser.add_argument('--json', default=None, help='also write the stats to this file')
+    parser.add_argument('-v', '--verbose', action='store_true', help="show the app's own output")
+    args = parser.parse_args()
+
+    config = gen_config.load_json(args.netconf)
+    rules = gen_config.load_json(args.rules) if args.rules else None
+    trace = gen_config.load_trace(args.trace) if args.trace else []
+    emulator = run(args.app, config, rules, trace, quiet=not args.verbose)
+    emulator.report()
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(emulator.results(), f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+import struct
+from collections import OrderedDict
+
+ETH_TYPE_IP = 0x0800
+ETH_TYPE_ARP = 0x0806
+ETH_TYPE_8021Q = 0x8100
+ETH_TYPE_IPV6 = 0x86dd
+ETH_TYPE_LLDP = 0x88cc
+
+IPPROTO_IGMP = 2
+
+_eth = struct.Struct('!6s6sH')
+_vlan = struct.Struct('!HH')
+_ipv4 = struct.Struct('!9xB2x4s4s')
+
+
+def parse_eth(data):
+    """(dst, src, ethertype, payload offset) straight from the frame.
+
+    MACs stay raw 6-byte strings; one VLAN tag is skipped.
+    """
+    dst, src, ethertype = _eth.unpack_from(data)
+    offset = _eth.size
+    if ethertype == ETH_TYPE_8021Q:
+        _, ethertype = _vlan.unpack_from(data, offset)
+        offset += _vlan.size
+    return dst, src, ethertype, offset
+
+
+def parse_ipv4(data, offset):
+    """(proto, src, dst) of the IPv4 header at offset, addresses raw."""
+    return _ipv4.unpack_from(data, offset)
+
+
+def is_multicast_ip(addr):
+    return 224 <= bytearray(addr)[0] <= 239
+
+
+def mac_str(mac):
+    return ':'.join('%02x' % b for b in bytearray(mac))
+
+
+class DecisionCache(object):
+    """Recent forwarding decisions, (dpid, in_port, dst) -> out_port.
+
+    A switch's entries are only valid for the generation of its MAC table
+    they were made in; bump() invalidates them without walking the cache.
+    """
+
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.generations = {}
+
+    def bump(self, dpid):
+        self.generations[dpid] = self.generations.get(dpid, 0) + 1
+
+    def get(self, dpid, in_port, dst):
+        entry = self.entries.get((dpid, in_port, dst))
+        if entry is None or entry[0] != self.generations.get(dpid, 0):
+            return None
+        return entry[1]
+
+    def put(self, dpid, in_port, dst, out_port):
+        key = (dpid, in_port, dst)
+        self.entries[key] = (self.generations.get(dpid, 0), out_port)
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
@@ -0,0 +1,482 @@
+"""Generate netconf.json topologies, multicast workloads and churn traces.
+
+    python gen_config.py leafspine --spines 16 --leaves 64 -o netconf.json
+    python gen_config.py fattree -k 8 -o netconf.json
+    python gen_config.py wan --switches 200 --degree 3 -o netconf.json
+    python gen_config.py b4 --site-size 4 -o netconf.json
+    python gen_config.py groups netconf.json --groups 1000 --fanout zipf:1.2 -o file.json
+    python gen_config.py churn netconf.json file.json --events 5000 --rate 50 -o churn.jsonl
+    python gen_config.py replay churn.jsonl --rules file.json
+
+Topologies follow the netconf.json schema (dpid_to_switchname, topo,
+host_ips) with every switch-to-switch link listed from both ends and
+hosts listed from their switch, so Topology, gen_topo.py and the
+controllers read them as they are. groups writes the multicast_groups
+schema of file.json; --into-netconf also stores the groups in the
+netconf so NewRyu.py installs them at start.
+
+A churn trace is one JSON event per line, {"t": seconds, "op": ...}:
+"join"/"leave" add or remove a target of a group, "add" creates a group
+(with its "info") and "remove" deletes one. replay applies a trace to a
+rule file in real time, which Controller13 picks up through RuleWatcher.
+"""
+import argparse
+import bisect
+import ipaddress
+import json
+import os
+import random
+import sys
+import time
+
+# switch-to-switch links between the 12 B4 sites, as in new/new/B4.json
+B4_LINKS = [(0, 1), (0, 2), (1, 3), (2, 4), (2, 5), (3, 4), (3, 5), (4, 6), (4, 7),
+            (5, 6), (5, 7), (6, 7), (6, 8), (7, 9), (8, 9), (8, 10), (8, 11),
+            (9, 10), (9, 11)]
+# one-way ms of each of B4_LINKS, rough fibre distances between the
+# sites; the real ones are not published
+B4_DELAYS = [5, 8, 12, 6, 9, 7, 10, 4, 6, 5, 7, 3, 15, 18, 4, 9, 11, 6, 8]
+B4_SITES = 12
+# one-way ms of a link inside a site
+SITE_DELAY = 0.1
+
+FIRST_HOST_IP = ipaddress.ip_address('10.0.0.100')
+# administratively scoped (RFC 2365), clear of 224.0.0.0/24 where
+# all-hosts, all-routers and IGMP itself live
+FIRST_GROUP_IP = ipaddress.ip_address('239.1.0.0')
+
+
+class NetconfBuilder(object):
+    """Assigns dpids and ports the way gen_topo.py brings a netconf up:
+    dpids count from 1 in the order switches are added and every node
+    numbers its ports from 1 in the order its links are added."""
+
+    def __init__(self):
+        self.dpid_to_switchname = {}
+        self.topo = {}
+        self.host_ips = {}
+        self.link_attrs = {}
+        self.next_port = {}
+
+    def switch(self, name):
+        self.dpid_to_switchname[str(len(self.dpid_to_switchname) + 1)] = name
+        self.topo[name] = {}
+        return name
+
+    def port(self, node):
+        port = self.next_port.get(node, 1)
+        self.next_port[node] = port + 1
+        return port
+
+    def attrs(self, u, v, attrs):
+        if attrs:
+            self.link_attrs.setdefault(u, {})[v] = attrs
+
+    def link(self, u, v, **attrs):
+        self.topo[u][v] = self.port(u)
+        self.topo[v][u] = self.port(v)
+        self.attrs(u, v, attrs)
+
+    def host(self, name, switch, ip=None, **attrs):
+        if ip is None:
+            ip = str(FIRST_HOST_IP + len(self.host_ips))
+        self.host_ips[name] = ip
+        self.topo[switch][name] = self.port(switch)
+        self.attrs(switch, name, attrs)
+        return name
+
+    def config(self):
+        config = {
+            "dpid_to_switchname": self.dpid_to_switchname,
+            "topo": self.topo,
+            "host_ips": self.host_ips,
+        }
+        if self.link_attrs:
+            config["link_attrs"] = self.link_attrs
+        return config
+
+
+def rack_ip(i, j, k):
+    # the 10.<leaf>.<rack>.<100 + host> plan of LeafSpine.set_host_ip
+    if i > 255 or j > 255 or k > 155:
+        raise ValueError("10.i.j.(100+k) host addressing needs i, j <= 255 and k <= 155")
+    return "10.%d.%d.%d" % (i, j, 100 + k)
+
+
+def leaf_spine(spines, leaves, racks=2, hosts=4, bw=(10, 40, 100)):
+    """The LeafSpine fabric of leaf-spine-ecmp.py: spines S<i>, leaves
+    L<i> linked to every spine, ToRs T<i>m<j> under each leaf and hosts
+    H<i>m<j>m<k> under each ToR. racks=0 puts the hosts on the leaves.
+
+    bw is the Mbit/s of its core (spine-leaf), aggregation (leaf-ToR)
+    and access links, run_exmaple()'s by default."""
+    core_bw, aggr_bw, access_bw = bw
+    b = NetconfBuilder()
+    spine_names = [b.switch('S%d' % i) for i in range(spines)]
+    for i in range(leaves):
+        leaf = b.switch('L%d' % i)
+        for spine in spine_names:
+            b.link(leaf, spine, bw=core_bw)
+        if not racks:
+            for k in range(hosts):
+                b.host('H%dm%d' % (i, k), leaf, rack_ip(i, 0, k), bw=access_bw)
+    for i in range(leaves):
+        for j in range(racks):
+            tor = b.switch('T%dm%d' % (i, j))
+            b.link('L%d' % i, tor, bw=aggr_bw)
+            for k in range(hosts):
+                b.host('H%dm%dm%d' % (i, j, k), tor, rack_ip(i, j, k), bw=access_bw)
+    return b.config()
+
+
+def fat_tree(k, hosts=None):
+    """A k-ary fat-tree: (k/2)^2 core switches S<i>, k pods of k/2
+    aggregation switches L<pod>m<i> and k/2 edge switches T<pod>m<i>,
+    each edge switch with hosts (k/2 by default) hosts H<pod>m<i>m<j>."""
+    if k < 2 or k % 2:
+        raise ValueError("fat-tree k must be even")
+    half = k // 2
+    hosts = half if hosts is None else hosts
+    b = NetconfBuilder()
+    cores = [b.switch('S%d' % i) for i in range(half * half)]
+    for pod in range(k):
+        aggs = [b.switch('L%dm%d' % (pod, i)) for i in range(half)]
+        for i, agg in enumerate(aggs):
+            # aggregation switch i of every pod reaches core group i
+            for core in cores[i * half:(i + 1) * half]:
+                b.link(agg, core)
+    for pod in range(k):
+        for i in range(half):
+            edge = b.switch('T%dm%d' % (pod, i))
+            for a in range(half):
+                b.link('L%dm%d' % (pod, a), edge)
+            for j in range(hosts):
+                b.host('H%dm%dm%d' % (pod, i, j), edge, rack_ip(pod, i, j))
+    return b.config()
+
+
+def random_wan(switches, degree=3.0, hosts=1, seed=None, delay=None):
+    """A connected random WAN of switches S<i>: a random spanning tree
+    plus random extra links up to an average degree of degree, and hosts
+    H<i>m<j> on every switch. With delay=(lo, hi) every switch link gets
+    a one-way delay drawn uniformly from lo to hi ms."""
+    rng = random.Random(seed)
+    b = NetconfBuilder()
+    names = [b.switch('S%d' % i) for i in range(switches)]
+    links = set()
+    order = list(range(switches))
+    rng.shuffle(order)
+    for n, i in enumerate(order[1:], 1):
+        j = order[rng.randrange(n)]
+        links.add((min(i, j), max(i, j)))
+    wanted = min(int(switches * degree / 2), switches * (switches - 1) // 2)
+    while len(links) < wanted:
+        i, j = rng.sample(range(switches), 2)
+        links.add((min(i, j), max(i, j)))
+    for i, j in sorted(links):
+        # drawn after the links so a seed gives the same graph either way
+        attrs = {'delay': round(rng.uniform(*delay), 2)} if delay else {}
+        b.link(names[i], names[j], **attrs)
+    for i, name in enumerate(names):
+        for j in range(hosts):
+            b.host('H%dm%d' % (i, j), name)
+    return b.config()
+
+
+def b4(site_size=1, hosts=1):
+    """The 12-site B4 WAN. With site_size > 1 every site is a full mesh
+    of that many switches S<site>m<i> and the inter-site links are spread
+    over them round-robin; hosts H<site>m<j> hang off the sites' switches
+    in turn. Links carry B4_DELAYS and SITE_DELAY as their delay."""
+    b = NetconfBuilder()
+    if site_size == 1:
+        sites = [[b.switch('S%d' % s)] for s in range(B4_SITES)]
+    else:
+        sites = [[b.switch('S%dm%d' % (s, i)) for i in range(site_size)] for s in range(B4_SITES)]
+    for site in sites:
+        for n, u in enumerate(site):
+            for v in site[n + 1:]:
+                b.link(u, v, delay=SITE_DELAY)
+    used = [0] * B4_SITES
+    for (s, t), delay in zip(B4_LINKS, B4_DELAYS):
+        u = sites[s][used[s] % site_size]
+        v = sites[t][used[t] % site_size]
+        used[s] += 1
+        used[t] += 1
+        b.link(u, v, delay=delay)
+    for s, site in enumerate(sites):
+        for j in range(hosts):
+            b.host('H%dm%d' % (s, j), site[j % site_size])
+    return b.config()
+
+
+def fanout_dist(spec):
+    """Parse a fan-out distribution, returns rng -> number of targets.
+
+        fixed:K         always K
+        uniform:A:B     A to B, uniformly
+        zipf:S[:MAX]    P(k) ~ 1/k^S for k in 1..MAX (MAX defaults to all hosts)
+        exp:MEAN        exponential with the given mean, rounded
+    """
+    kind, _, args = spec.partition(':')
+    args = [float(a) for a in args.split(':')] if args else []
+    if kind == 'fixed':
+        k = int(args[0])
+        return lambda rng, hosts: k
+    if kind == 'uniform':
+        lo, hi = int(args[0]), int(args[1])
+        return lambda rng, hosts: rng.randint(lo, hi)
+    if kind == 'zipf':
+        s = args[0]
+        cdfs = {}
+
+        def zipf(rng, hosts):
+            top = int(args[1]) if len(args) > 1 else hosts
+            cdf = cdfs.get(top)
+            if cdf is None:
+                total = 0.0
+                cdf = cdfs[top] = []
+                for k in range(1, top + 1):
+                    total += 1.0 / k ** s
+                    cdf.append(total)
+            return bisect.bisect_left(cdf, rng.random() * cdf[-1]) + 1
+        return zipf
+    if kind == 'exp':
+        mean = args[0]
+        return lambda rng, hosts: max(1, int(round(rng.expovariate(1.0 / mean))))
+    raise ValueError("unknown fan-out distribution %r" % spec)
+
+
+def group_address(index):
+    return str(FIRST_GROUP_IP + index)
+
+
+def make_group(rng, hosts, fanout, index):
+    source = rng.choice(hosts)
+    others = [h for h in hosts if h != source]
+    k = max(1, min(fanout(rng, len(others)), len(others)))
+    return {
+        "source": source,
+        "targets": sorted(rng.sample(others, k)),
+        "multicast_address": group_address(index),
+    }
+
+
+def make_groups(config, groups, fanout='uniform:2:8', seed=None):
+    """{group<i>: {source, targets, multicast_address}} over config's hosts."""
+    rng = random.Random(seed)
+    fanout = fanout_dist(fanout)
+    hosts = sorted(config["host_ips"])
+    if len(hosts) < 2:
+        raise ValueError("a workload needs at least two hosts")
+    return dict(("group%d" % (i + 1), make_group(rng, hosts, fanout, i)) for i in range(groups))
+
+
+def make_churn(config, rules, events, rate=10.0, group_churn=0.05,
+               fanout='uniform:2:8', seed=None):
+    """A churn trace over rules: Poisson arrivals at rate events/s, each a
+    member join or leave, or with probability group_churn a group add or
+    remove. The trace never empties a group through leaves."""
+    rng = random.Random(seed)
+    fanout = fanout_dist(fanout)
+    hosts = sorted(config["host_ips"])
+    rules = dict((g, dict(info, targets=list(info["targets"]))) for g, info in rules.items())
+    used = set(info["multicast_address"] for info in rules.values())
+    next_index = len(rules)
+    trace = []
+    t = 0.0
+    for _ in range(events):
+        t += rng.expovariate(rate)
+        if not rules or rng.random() < group_churn:
+            if rules and rng.random() < 0.5:
+                group = rng.choice(sorted(rules))
+                used.discard(rules.pop(group)["multicast_address"])
+                trace.append({"t": round(t, 6), "op": "remove", "group": group})
+                continue
+            while group_address(next_index) in used:
+                next_index += 1
+            group = "group%d" % (next_index + 1)
+            while group in rules:
+                next_index += 1
+                group = "group%d" % (next_index + 1)
+            info = rules[group] = make_group(rng, hosts, fanout, next_index)
+            used.add(info["multicast_address"])
+            next_index += 1
+            trace.append({"t": round(t, 6), "op": "add", "group": group, "info": info})
+            continue
+        group = rng.choice(sorted(rules))
+        info = rules[group]
+        members = set(info["targets"]) | set([info["source"]])
+        joinable = len(members) < len(hosts)
+        if len(info["targets"]) > 1 and (not joinable or rng.random() < 0.5):
+            host = rng.choice(info["targets"])
+            info["targets"].remove(host)
+            trace.append({"t": round(t, 6), "op": "leave", "group": group, "host": host})
+        elif joinable:
+            host = rng.choice([h for h in hosts if h not in members])
+            info["targets"].append(host)
+            trace.append({"t": round(t, 6), "op": "join", "group": group, "host": host})
+    return trace
+
+
+def apply_event(rules, event):
+    """Apply one churn event to a rule dict in place."""
+    op = event["op"]
+    group = event["group"]
+    if op == "add":
+        rules[group] = dict(event["info"], targets=list(event["info"]["targets"]))
+    elif op == "remove":
+        rules.pop(group, None)
+    elif group in rules:
+        targets = rules[group]["targets"]
+        if op == "join" and event["host"] not in targets:
+            targets.append(event["host"])
+        elif op == "leave" and event["host"] in targets:
+            targets.remove(event["host"])
+
+
+def load_trace(filename):
+    with open(filename) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def write_json(obj, filename):
+    if filename == '-':
+        json.dump(obj, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+        return
+    tmp = filename + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(obj, f, indent=2)
+    # the controllers may be polling the file, never let them see half of it
+    os.replace(tmp, filename)
+
+
+def replay(trace, rules, filename, speed=1.0, min_interval=0.1):
+    """Write rules to filename as the trace goes, coalescing the events
+    that fall within min_interval of each other into one write."""
+    write_json(rules, filename)
+    start = time.time()
+    i = 0
+    while i < len(trace):
+        due = trace[i]["t"] / speed
+        delay = start + due - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        while i < len(trace) and trace[i]["t"] / speed <= due + min_interval:
+            apply_event(rules, trace[i])
+            i += 1
+        write_json(rules, filename)
+    return rules
+
+
+def load_json(filename):
+    with open(filename) as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest='command')
+    sub.required = True
+
+    p = sub.add_parser('leafspine', help='leaf-spine fabric')
+    p.add_argument('--spines', type=int, default=2)
+    p.add_argument('--leaves', type=int, default=2)
+    p.add_argument('--racks', type=int, default=2, help='ToRs per leaf, 0 for hosts on the leaves')
+    p.add_argument('--hosts', type=int, default=4, help='hosts per ToR (or leaf)')
+
+    p = sub.add_parser('fattree', help='k-ary fat-tree')
+    p.add_argument('-k', type=int, default=4)
+    p.add_argument('--hosts', type=int, default=None, help='hosts per edge switch, k/2 by default')
+
+    p = sub.add_parser('wan', help='random connected WAN')
+    p.add_argument('--switches', type=int, default=50)
+    p.add_argument('--degree', type=float, default=3.0, help='average switch degree')
+    p.add_argument('--hosts', type=int, default=1, help='hosts per switch')
+    p.add_argument('--seed', type=int, default=None)
+    p.add_argument('--delay', type=float, nargs=2, default=None, metavar=('LO', 'HI'),
+                   help='random one-way link delays in ms')
+
+    p = sub.add_parser('b4', help='B4-like 12-site WAN')
+    p.add_argument('--site-size', type=int, default=1, help='switches per site')
+    p.add_argument('--hosts', type=int, default=1, help='hosts per site')
+
+    for name in ('leafspine', 'fattree', 'wan', 'b4'):
+        p = sub.choices[name]
+        p.add_argument('--groups', type=int, default=0, help='also add a multicast_groups workload')
+        p.add_argument('--fanout', default='uniform:2:8')
+        p.add_argument('--group-seed', type=int, default=None)
+        p.add_argument('-o', '--output', default='-')
+
+    p = sub.add_parser('groups', help='multicast workload for a netconf')
+    p.add_argument('netconf')
+    p.add_argument('--groups', type=int, default=100)
+    p.add_argument('--fanout', default='uniform:2:8',
+                   help='fixed:K, uniform:A:B, zipf:S[:MAX] or exp:MEAN')
+    p.add_argument('--seed', type=int, default=None)
+    p.add_argument('--into-netconf', action='store_true',
+                   help='store the groups as the netconf multicast_groups too')
+    p.add_argument('-o', '--output', default='-')
+
+    p = sub.add_parser('churn', help='membership churn trace for a workload')
+    p.add_argument('netconf')
+    p.add_argument('rules', help='the starting file.json')
+    p.add_argument('--events', type=int, default=1000)
+    p.add_argument('--rate', type=float, default=10.0, help='events per second')
+    p.add_argument('--group-churn', type=float, default=0.05,
+                   help='share of events that add or remove a whole group')
+    p.add_argument('--fanout', default='uniform:2:8', help='fan-out of added groups')
+    p.add_argument('--seed', type=int, default=None)
+    p.add_argument('-o', '--output', default='-')
+
+    p = sub.add_parser('replay', help='play a churn trace into a rule file')
+    p.add_argument('trace')
+    p.add_argument('--rules', default='file.json', help='rule file to rewrite (and start from)')
+    p.add_argument('--start', default=None, help='starting rules, the current rule file by default')
+    p.add_argument('--speed', type=float, default=1.0)
+    p.add_argument('--min-interval', type=float, default=0.1,
+                   help='events closer than this are written together (s)')
+
+    args = parser.parse_args()
+
+    if args.command in ('leafspine', 'fattree', 'wan', 'b4'):
+        if args.command == 'leafspine':
+            config = leaf_spine(args.spines, args.leaves, args.racks, args.hosts)
+        elif args.command == 'fattree':
+            config = fat_tree(args.k, args.hosts)
+        elif args.command == 'wan':
+            config = random_wan(args.switches, args.degree, args.hosts, args.seed, args.delay)
+        else:
+            config = b4(args.site_size, args.hosts)
+        config["multicast_groups"] = make_groups(config, args.groups, args.fanout, args.group_seed) \
+            if args.groups else {}
+        write_json(config, args.output)
+        sys.stderr.write("%d switches, %d hosts, %d groups\n" % (
+            len(config["dpid_to_switchname"]), len(config["host_ips"]),
+            len(config["multicast_groups"])))
+
+    elif args.command == 'groups':
+        config = load_json(args.netconf)
+        rules = make_groups(config, args.groups, args.fanout, args.seed)
+        if args.into_netconf:
+            config["multicast_groups"] = rules
+            write_json(config, args.netconf)
+        write_json(rules, args.output)
+
+    elif args.command == 'churn':
+        trace = make_churn(load_json(args.netconf), load_json(args.rules), args.events,
+                           args.rate, args.group_churn, args.fanout, args.seed)
+        out = sys.stdout if args.output == '-' else open(args.output, 'w')
+        for event in trace:
+            out.write(json.dumps(event) + '\n')
+        if out is not sys.stdout:
+            out.close()
+
+    elif args.command == 'replay':
+        rules = load_json(args.start or args.rules)
+        replay(load_trace(args.trace), rules, args.rules, args.speed, args.min_interval)
+
+
+if __name__ == '__main__':
+    main()
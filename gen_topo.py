@@ -10,20 +10,20 @@ from subprocess import call
 import time
 import json
 import sys
+from topology import Topology
+from topo_builder import StageTimer, dpid_str, link_opts, run_on_hosts, start_switches
 
-json_file =  sys.argv[1] + ".json"
-
-def load_config(filename=json_file):
+def load_config(filename):
     with open(filename) as f:
         return json.load(f)
-    
-config = load_config()
-
-# print config["dpid_to_switchname"].items()
 
 
-def myNetwork():
+def build_network(config, protocols=None):
+    """Bring the netconf topology up against a controller on 127.0.0.1:6653,
+    returns the started net."""
 
+    topology = Topology(config)
+    timer = StageTimer()
     net = Mininet( topo=None,
                    build=False,
                    ipBase='10.0.0.0/8')
@@ -39,41 +39,47 @@ def myNetwork():
                       port=6653)
 
     info( '*** Add switches\n')
-    for index, item in enumerate(config["dpid_to_switchname"].items()):
-        switch_dict[item[0]] = net.addSwitch(item[1], cls=OVSKernelSwitch, dpid="000000000000000" + str(index + 1))
+    for dpid, name in config["dpid_to_switchname"].items():
+        switch_dict[dpid] = net.addSwitch(name, cls=OVSKernelSwitch, dpid=dpid_str(dpid), batch=True,
+                                          protocols=protocols)
 
     info( '*** Add hosts\n')
     for item in config["host_ips"].items():
         host_dict[item[0]] = net.addHost(item[0], cls=Host, ip=item[1], defaultRoute=None)
 
     info( '*** Add links\n')
-    temp = []
-    for item in config["topo"].items():
-        for dst in item[1].items():
-            if '{}-{}'.format(item[0], dst[0]) not in temp:
-                net.addLink(item[0], dst[0], port1=dst[1])
-                temp.append('{}-{}'.format(item[0], dst))
-                temp.append('{}-{}'.format(dst, item[0]))
-
+    for node1, port1, node2, port2 in topology.links():
+        # shaped with tc only where netconf gives the link a bw or delay
+        opts = link_opts(topology, node1, node2)
+        if opts:
+            opts['cls'] = TCLink
+        net.addLink(node1, node2, port1=port1, port2=port2, **opts)
+    timer.lap('add nodes')
 
     info( '*** Starting network\n')
     net.build()
+    timer.lap('build links')
     info( '*** Starting controllers\n')
     for controller in net.controllers:
         controller.start()
+    timer.lap('start controllers')
 
     info( '*** Starting switches\n')
+    start_switches(net)
+    timer.lap('start switches')
 
-    for item in config["dpid_to_switchname"].items():
-        net.get(item[1]).start([c0])
+    run_on_hosts(net.hosts, lambda h: "route add -net 224.0.0.0 netmask 224.0.0.0 {}-eth0".format(h.name))
+    # ip route add default via 10.0.0.1
+    timer.lap('host routes')
+    timer.report()
+    return net
 
-    for item in config["host_ips"].items():
-        net.get(item[0]).cmd("route add -net 224.0.0.0 netmask 224.0.0.0 {}-eth0".format(item[0]))
-        # net.get(item[0]).cmd("ip route add default via 10.0.0.1")
 
+def myNetwork(config):
+    net = build_network(config)
     CLI(net)
     net.stop()
 
 if __name__ == '__main__':
     setLogLevel( 'info' )
-    myNetwork()
\ No newline at end of file
+    myNetwork(load_config(sys.argv[1] + ".json"))
\ No newline at end of file
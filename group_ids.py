@@ -0,0 +1,225 @@
+import json
+import os
+
+# highest group id a switch accepts, the ones above are reserved
+OFPG_MAX = 0xffffff00
+
+
+class GroupIdAllocator(object):
+    """OpenFlow group ids of one switch, group key -> id.
+
+    Released ids go on a free list and are handed out again before the
+    high-water mark moves, so the live ids stay dense however many groups
+    come and go. allocate() and release() are both O(1).
+    """
+
+    def __init__(self, first=1, last=OFPG_MAX):
+        self.first = first
+        self.last = last
+        self.next = first
+        self.free = []
+        self.ids = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, key):
+        return key in self.ids
+
+    def get(self, key):
+        return self.ids.get(key)
+
+    def allocate(self, key):
+        gid = self.ids.get(key)
+        if gid is not None:
+            return gid
+        if self.free:
+            gid = self.free.pop()
+        elif self.next <= self.last:
+            gid = self.next
+            self.next += 1
+        else:
+            raise RuntimeError("no group id left between {} and {}".format(self.first, self.last))
+        self.ids[key] = gid
+        return gid
+
+    def release(self, key):
+        gid = self.ids.pop(key, None)
+        if gid is not None:
+            self.free.append(gid)
+        return gid
+
+    def rename(self, old, new):
+        """Give old's id to new, releasing the one new had."""
+        self.release(new)
+        gid = self.ids.pop(old)
+        self.ids[new] = gid
+        return gid
+
+    def keys(self):
+        return list(self.ids)
+
+    def state(self):
+        return {"next": self.next, "free": self.free, "ids": self.ids}
+
+    def load(self, state):
+        self.next = state["next"]
+        self.free = list(state["free"])
+        self.ids = dict(state["ids"])
+
+
+class GroupIds(object):
+    """A GroupIdAllocator per switch, saved to filename so a restarted
+    controller gives every group the id it already has on the switches.
+
+    Keys are strings (switch names, group names or addresses) so they
+    survive the round trip through JSON.
+    """
+
+    def __init__(self, filename=None, first=1):
+        self.filename = filename
+        self.first = first
+        self.switches = {}
+        self.dirty = False
+        if filename is not None and os.path.exists(filename):
+            self.load()
+
+    def allocator(self, switch):
+        ids = self.switches.get(switch)
+        if ids is None:
+            ids = self.switches[switch] = GroupIdAllocator(self.first)
+        return ids
+
+    def get(self, switch, key):
+        ids = self.switches.get(switch)
+        return ids.get(key) if ids is not None else None
+
+    def allocate(self, switch, key):
+        ids = self.allocator(switch)
+        if key not in ids:
+            self.dirty = True
+        return ids.allocate(key)
+
+    def release(self, switch, key):
+        ids = self.switches.get(switch)
+        if ids is None:
+            return None
+        gid = ids.release(key)
+        if gid is not None:
+            self.dirty = True
+        return gid
+
+    def rename(self, switch, old, new):
+        self.dirty = True
+        return self.switches[switch].rename(old, new)
+
+    def load(self):
+        with open(self.filename) as f:
+            state = json.load(f)
+        for switch, ids in state.items():
+            self.allocator(switch).load(ids)
+        self.dirty = False
+
+    def save(self):
+        """Write the ids out if anything changed since the last save."""
+        if self.filename is None or not self.dirty:
+            return
+        tmp = self.filename + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(dict((s, ids.state()) for s, ids in self.switches.items()), f)
+        os.replace(tmp, self.filename)
+        self.dirty = False
+
+
+def bucket_key(ports):
+    return "ports:" + ",".join(str(p) for p in sorted(ports))
+
+
+class SharedGroups(object):
+    """Group entries shared, per switch, by every multicast group that
+    replicates to the same set of ports.
+
+    Entries are reference counted. A group whose ports change moves to the
+    entry of its new port set, or takes its old entry along with a MODIFY
+    when it was the only user; an entry is deleted with its last user.
+    Ids come from a GroupIds keyed by port set.
+
+    Only the ids are saved, not which groups use them, so once the groups
+    are bound again after a restart prune() frees the port sets nothing
+    came back to.
+    """
+
+    def __init__(self, ids):
+        self.ids = ids
+        self.users = {}  # switch -> {port set key: set of groups}
+        self.ports = {}  # switch -> {port set key: ports}
+        self.bound = {}  # switch -> {group: port set key}
+
+    def get(self, switch, group):
+        key = self.bound.get(switch, {}).get(group)
+        return self.ids.get(switch, key) if key is not None else None
+
+    def entries(self, switch):
+        """{gid: ports} of the entries in use on switch."""
+        return dict((self.ids.get(switch, key), ports)
+                    for key, ports in self.ports.get(switch, {}).items())
+
+    def groups(self, switch):
+        return list(self.bound.get(switch, ()))
+
+    def bind(self, switch, group, ports):
+        """Point group at the entry for ports on switch.
+
+        Returns (gid, command, moved, stale): command is "add" or "modify"
+        when the entry needs that GroupMod first, moved whether the group's
+        flow has to be (re)pointed at gid, and stale the id of an entry left
+        without users, to delete once the flow has moved.
+        """
+        key = bucket_key(ports)
+        users = self.users.setdefault(switch, {})
+        bound = self.bound.setdefault(switch, {})
+        old = bound.get(group)
+        if old == key:
+            return self.ids.get(switch, key), None, False, None
+        bound[group] = key
+        if key in users:
+            users[key].add(group)
+            stale = self._release(switch, group, old) if old is not None else None
+            return self.ids.get(switch, key), None, True, stale
+        if old is not None and len(users[old]) == 1:
+            del users[old], self.ports[switch][old]
+            users[key] = set([group])
+            self.ports[switch][key] = sorted(ports)
+            return self.ids.rename(switch, old, key), "modify", False, None
+        users[key] = set([group])
+        self.ports.setdefault(switch, {})[key] = sorted(ports)
+        gid = self.ids.allocate(switch, key)
+        stale = self._release(switch, group, old) if old is not None else None
+        return gid, "add", True, stale
+
+    def unbind(self, switch, group):
+        """Detach group from switch, returns (gid it used, stale id)."""
+        key = self.bound.get(switch, {}).pop(group, None)
+        if key is None:
+            return None, None
+        gid = self.ids.get(switch, key)
+        return gid, self._release(switch, group, key)
+
+    def prune(self):
+        """Release the port set ids no group is bound to, loaded from
+        the file or otherwise; returns {switch: [freed ids]}."""
+        freed = {}
+        for switch, ids in self.ids.switches.items():
+            bound = self.ports.get(switch, {})
+            for key in ids.keys():
+                if key.startswith("ports:") and key not in bound:
+                    freed.setdefault(switch, []).append(self.ids.release(switch, key))
+        return freed
+
+    def _release(self, switch, group, key):
+        users = self.users[switch][key]
+        users.discard(group)
+        if users:
+            return None
+        del self.users[switch][key], self.ports[switch][key]
+        return self.ids.release(switch, key)
@@ -1,48 +1,357 @@
-import json
-import os
+import topology
+from multicast_tree import build_tree, bottleneck
+from group_ids import GroupIds, SharedGroups
+from spine_placement import SpinePlacement, find_spines
+from backup_trees import BackupTrees
+from ofmsg import MessageBatch, group_mod, flow_mod, group_flow_mod, delete_flows, bound_group_msgs, unbound_group_msgs
 
 json_file =  "netconf" + ".json"
 
-def load_config(filename=json_file):
-    with open(filename) as f:
-        return json.load(f)
+MCAST_ADDR = "224.1.10.100"
 
-config = load_config()
+# "spt", "steiner", "load", "spine" or "delay", a group can override it
+# with a "tree" key; "delay" trees keep to the group's "max_delay" (ms)
+TREE_METHOD = "spt"
+# a "load" tree is only moved when that takes this much off its bottleneck
+REBALANCE_GAIN = 0.1
+# how "spine" trees are spread over the spines: "hash" or "pack" by
+# measured rate, over how many spines each
+SPINE_MODE = "hash"
+SPINE_WIDTH = 1
+
+topo = topology.load_topology(json_file)
+config = topo.config
+
+switchname_to_dpid = topo.dpids
+
+# per-switch group ids, kept across controller restarts; groups that
+# replicate to the same ports on a switch share one entry there
+group_ids = GroupIds("group_ids.json")
+shared_groups = SharedGroups(group_ids)
+
+# link_load.LinkLoad the controller keeps up to date, for "load" trees
+link_load = None
+# group -> ((source, targets, method, max_delay), tree) of the trees installed, so
+# a tree that depends on the load is not recomputed under the group
+trees = {}
+
+# links that are down and the trees to fail over to when another goes
+backups = BackupTrees(topo)
+
+spine_placement = SpinePlacement(
+    find_spines(topo), SPINE_MODE, SPINE_WIDTH,
+    demand=lambda group: link_load.demand(group) if link_load is not None else 0.0)
 
 
 def get_switch_port(local):
-    for item in config["topo"].items():
-        if local in item[1].keys():
-            return item[0], item[1][local]
+    return topo.host_port(local)
 
 
 def get_host_ip(local):
-    return config["host_ips"][local]
+    return topo.host_ip(local)
+
+
+def get_group_id(group, switch):
+    return shared_groups.get(switch, group)
+
+
+class FlowBatch(MessageBatch):
+    """Collects OpenFlow messages per switch and sends them straight over the
+    datapaths the controller holds. Every batch ends with a barrier so the
+    caller knows when the switch has applied all of it, or is committed as
+    one bundle per switch with bundle=True (OpenFlow 1.4+)."""
+
+    def __init__(self, datapaths, bundle=False):
+        super(FlowBatch, self).__init__(bundle)
+        self.datapaths = datapaths
+
+    def datapath(self, switch):
+        return self.datapaths.get(switchname_to_dpid[switch])
+
+    def add(self, switch, build):
+        # build(datapath) -> OpenFlow message, called once the switch is known
+        dp = self.datapath(switch)
+        if dp is None:
+            print ("switch {} is not connected, skip".format(switch))
+            return
+        self.append(dp, build(dp))
+
+    def extend(self, switch, build):
+        # build(datapath) -> list of OpenFlow messages
+        dp = self.datapath(switch)
+        if dp is None:
+            print ("switch {} is not connected, skip".format(switch))
+            return
+        for msg in build(dp):
+            self.append(dp, msg)
+
+
+def group_info(group, info=None):
+    return info if info is not None else config["multicast_groups"][group]
+
+
+def tree_method(group, info=None):
+    return group_info(group, info).get("tree", TREE_METHOD)
+
+
+def group_tree(group, info=None):
+    info = group_info(group, info)
+    method = tree_method(group, info)
+    key = (info["source"], tuple(info["targets"]), method, info.get("max_delay"))
+    cached = trees.get(group)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    tree = new_tree(group, info)
+    trees[group] = (key, tree)
+    return tree
+
+
+def new_tree(group, info=None):
+    """Build the group's tree by its method, around the links that are down."""
+    info = group_info(group, info)
+    method = tree_method(group, info)
+    if method == "load":
+        rate = link_load.demand(group) if link_load is not None else 0.0
+        tree = backups.repair(group, build_tree(topo, info["source"], info["targets"], method,
+                                                cost=load_cost(rate)))
+        if link_load is not None:
+            link_load.reserve(tree.edges(), rate)
+        return tree
+    if method == "spine":
+        return spine_tree(group, info)
+    if method == "delay":
+        tree = build_tree(topo, info["source"], info["targets"], method,
+                          bound=info.get("max_delay"))
+        if tree.late:
+            print ("group {} misses max_delay={} ms at {}".format(
+                group, info.get("max_delay"), ", ".join(tree.late)))
+    else:
+        tree = build_tree(topo, info["source"], info["targets"], method)
+    return backups.repair(group, tree)
+
+
+def spine_tree(group, info=None):
+    info = group_info(group, info)
+    return backups.repair(group, build_tree(topo, info["source"], info["targets"], "spine",
+                                            spines=spine_placement.spines_for(group),
+                                            avoid=spine_placement.avoid(group)))
+
+
+def load_cost(rate, own=()):
+    """cost for load_aware_tree(): utilization of u -> v with rate bit/s
+    more on it, unless the link is in own and carries it already."""
+    if link_load is None:
+        return None
+    return lambda u, v: link_load.utilization(u, v, 0.0 if (u, v) in own else rate)
+
+
+def group_ports(group, info=None):
+    return group_tree(group, info).buckets
 
 
+def group_match(group, info=None):
+    info = group_info(group, info)
+    sip = get_host_ip(info["source"])
+    return dict(eth_type=0x0800, ipv4_src=sip, ipv4_dst=info.get("multicast_address", MCAST_ADDR))
 
-def add_group(group):
-    for item in config["multicast_groups"][group]["targets"]:
-        s, p = get_switch_port(item)
-        os.system("sudo ovs-ofctl -O OpenFlow13 add-group {} group_id={},type=all,bucket=output:{}".format(s, group[-1], p))
-        print ("sudo ovs-ofctl -O OpenFlow13 add-group {} group_id={},type=all,bucket=output:{}".format(s, group[-1], p))
 
+def print_binding(s, binding, ports):
+    gid, command, moved, stale = binding
+    if command is not None:
+        print ("{}-group {} group_id={},type=all,{}".format(
+            command[:3], s, gid, ",".join("bucket=output:{}".format(p) for p in ports)))
+    elif moved:
+        print ("share-group {} group_id={}".format(s, gid))
+    if stale is not None:
+        print ("del-groups {} group_id={}".format(s, stale))
 
-def add_flow(group):
-    sip =  get_host_ip(config["multicast_groups"][group]["source"])
-    for item in config["multicast_groups"][group]["targets"]:
-        s, p = get_switch_port(item)
-        os.system("sudo ovs-ofctl  -O OpenFlow13 add-flow {} ip,priority=65535,nw_src={},nw_dst=224.1.10.100,actions=group:{}".format(s, sip, group[-1]))
-        print ("sudo ovs-ofctl  -O OpenFlow13 add-flow {} ip,priority=65535,nw_src={},nw_dst=224.1.10.100,actions=group:{}".format(s, sip, group[-1]))
 
+def bind(group, s, ports, batch, match):
+    binding = shared_groups.bind(s, group, ports)
+    batch.extend(s, lambda dp: bound_group_msgs(dp, 65535, match, ports, binding))
+    print_binding(s, binding, ports)
 
-def drop():
-    for item in range(1,5):
-        host =  config["multicast_groups"]["group" + str(item)]["source"]
-        s, p = get_switch_port(host)
-        os.system("sudo ovs-ofctl add-flow {} in_port={},actions=drop".format(s, p))
 
-def access(group):
-    host =  config["multicast_groups"][group]["source"]
+def unbind(group, s, batch, match):
+    binding = shared_groups.unbind(s, group)
+    batch.extend(s, lambda dp: unbound_group_msgs(dp, match, binding))
+    if binding[1] is not None:
+        print ("del-groups {} group_id={}".format(s, binding[1]))
+
+
+def add_group(group, batch, info=None):
+    """Bind the group to a shared entry on every switch of its tree; the
+    entries are created here, the flows pointing at them by add_flow."""
+    for s, ports in group_ports(group, info).items():
+        binding = shared_groups.bind(s, group, ports)
+        gid = binding[0]
+        if binding[1] == "add":
+            batch.add(s, lambda dp, gid=gid, ports=ports: group_mod(dp, dp.ofproto.OFPGC_ADD, gid, ports))
+        print_binding(s, binding, ports)
+
+
+def add_flow(group, batch, info=None):
+    match = group_match(group, info)
+    for s in group_ports(group, info):
+        gid = get_group_id(group, s)
+        batch.add(s, lambda dp: group_flow_mod(dp, 65535, match, gid))
+        print ("add-flow {} ip,priority=65535,nw_src={},nw_dst={},actions=group:{}".format(
+            s, match["ipv4_src"], match["ipv4_dst"], gid))
+
+
+def del_group(group, batch, info=None):
+    match = group_match(group, info)
+    tree = group_tree(group, info)
+    for s in tree.buckets:
+        unbind(group, s, batch, match)
+    trees.pop(group, None)
+    backups.repaired.discard(group)
+    method = tree_method(group, info)
+    if link_load is not None and method == "load":
+        link_load.reserve(tree.edges(), -link_load.demand(group))
+    elif method == "spine":
+        spine_placement.release(group)
+
+
+def prune_groups(batch):
+    """Delete the entries group_ids.json kept for port sets no group was
+    bound to again, once the groups are back after a restart."""
+    for s, gids in sorted(shared_groups.prune().items()):
+        for gid in gids:
+            batch.add(s, lambda dp, gid=gid: group_mod(dp, dp.ofproto.OFPGC_DELETE, gid, []))
+            print ("del-groups {} group_id={}".format(s, gid))
+
+
+def mod_group(group, batch, old, new):
+    """Apply a change of targets only where the buckets actually differ."""
+    if old["source"] != new["source"]:
+        del_group(group, batch, old)
+        block(group, batch, old)
+        access(group, batch, new)
+        add_group(group, batch, new)
+        add_flow(group, batch, new)
+        return
+    match = group_match(group, new)
+    old_ports = group_ports(group, old)
+    new_ports = group_ports(group, new)
+    for s, ports in new_ports.items():
+        bind(group, s, ports, batch, match)
+    for s in old_ports:
+        if s not in new_ports:
+            unbind(group, s, batch, match)
+
+
+def retree(group, batch, info=None):
+    """Move a "load" group onto the tree the current load calls for, if
+    that lowers its bottleneck by REBALANCE_GAIN. Returns whether it moved."""
+    old = group_tree(group, info)
+    rate = link_load.demand(group)
+    own = set(old.edges())
+    cost = load_cost(rate, own)
+    info = group_info(group, info)
+    new = backups.repair(group, build_tree(topo, info["source"], info["targets"], "load", cost=cost))
+    if new.buckets == old.buckets or bottleneck(new, cost) > bottleneck(old, cost) - REBALANCE_GAIN:
+        return False
+    move_tree(group, batch, info, new)
+    link_load.reserve(old.edges(), -rate)
+    link_load.reserve(new.edges(), rate)
+    return True
+
+
+def move_tree(group, batch, info, new):
+    """Rebind the group's switches from its installed tree to new."""
+    old = group_tree(group, info)
+    match = group_match(group, info)
+    for s, ports in new.buckets.items():
+        bind(group, s, ports, batch, match)
+    for s in old.buckets:
+        if s not in new.buckets:
+            unbind(group, s, batch, match)
+    trees[group] = (trees[group][0], new)
+
+
+def rehome(installed, groups, batch):
+    """Move the "spine" groups among groups onto the spines they are
+    placed on now. Returns the ones whose tree changed."""
+    moved = []
+    for group in groups:
+        info = installed.get(group)
+        if info is None or tree_method(group, info) != "spine":
+            continue
+        new = spine_tree(group, info)
+        if new.buckets != group_tree(group, info).buckets:
+            move_tree(group, batch, info, new)
+            moved.append(group)
+    return moved
+
+
+def rebalance(installed, hot, batch, limit=None):
+    """retree() the "load" groups crossing a hot (u, v) link, busiest
+    first, at most limit of them. Returns the groups moved."""
+    crossing = [group for group, info in installed.items()
+                if tree_method(group, info) == "load"
+                and any(edge in hot for edge in group_tree(group, info).edges())]
+    crossing.sort(key=link_load.demand, reverse=True)
+    moved = []
+    for group in crossing:
+        if limit is not None and len(moved) >= limit:
+            break
+        if retree(group, batch, installed[group]):
+            moved.append(group)
+    return moved
+
+
+def fail_over(installed, link, batch):
+    """Move the groups whose tree crosses link, which just went down,
+    onto their backup trees. Returns the groups moved."""
+    moved = []
+    for group, info in sorted(installed.items()):
+        cached = trees.get(group)
+        if cached is None or not backups.crosses(cached[1], link):
+            continue
+        old = cached[1]
+        new = backups.backup(group, old, link)
+        move_tree(group, batch, info, new)
+        if link_load is not None and tree_method(group, info) == "load":
+            rate = link_load.demand(group)
+            link_load.reserve(old.edges(), -rate)
+            link_load.reserve(new.edges(), rate)
+        moved.append(group)
+    return moved
+
+
+def restore(installed, batch):
+    """Rebuild the trees that were routed around down links, now some of
+    those are back up. Returns the groups whose tree changed."""
+    moved = []
+    for group in sorted(backups.repaired):
+        info = installed.get(group)
+        if info is None or group not in trees:
+            backups.repaired.discard(group)
+            continue
+        old = group_tree(group, info)
+        if link_load is not None and tree_method(group, info) == "load":
+            link_load.reserve(old.edges(), -link_load.demand(group))
+        new = new_tree(group, info)
+        if new.buckets != old.buckets:
+            move_tree(group, batch, info, new)
+            moved.append(group)
+    return moved
+
+
+def drop(batch):
+    for group in config["multicast_groups"]:
+        block(group, batch)
+
+def block(group, batch, info=None):
+    # only the group's stream, the source host's other traffic still goes
+    host =  group_info(group, info)["source"]
+    s, p = get_switch_port(host)
+    match = dict(group_match(group, info), in_port=p)
+    batch.add(s, lambda dp: flow_mod(dp, dp.ofproto.OFP_DEFAULT_PRIORITY, match, []))
+
+def access(group, batch, info=None):
+    host =  group_info(group, info)["source"]
     s, p = get_switch_port(host)
-    os.system("sudo ovs-ofctl del-flows {} in_port={}".format(s, p))
\ No newline at end of file
+    match = dict(group_match(group, info), in_port=p)
+    batch.add(s, lambda dp: delete_flows(dp, match))
@@ -0,0 +1,233 @@
+import time
+
+from ryu.lib.packet import ether_types, ethernet, igmp, ipv4, packet
+
+import ofmsg
+from multicast_tree import build_tree
+
+# RFC 2236 query interval and max response time, and the group
+# membership interval they give (robustness 2 x 125 s + 10 s)
+QUERY_INTERVAL = 125
+QUERY_RESPONSE = 10
+GROUP_MEMBERSHIP_INTERVAL = 2 * QUERY_INTERVAL + QUERY_RESPONSE
+# a snooping switch querying for want of a router uses 0.0.0.0
+# (RFC 4541 2.1.1)
+QUERIER_IP = '0.0.0.0'
+QUERIER_MAC = '02:00:00:00:00:01'
+ALL_HOSTS = '224.0.0.1'
+
+
+class MembershipTable(object):
+    """Snooped receivers: group address -> {(switch, port): last report}."""
+
+    def __init__(self):
+        self.groups = {}
+
+    def join(self, group, switch, port, now):
+        """Refresh a receiver, True if it was not a member yet."""
+        members = self.groups.setdefault(group, {})
+        new = (switch, port) not in members
+        members[(switch, port)] = now
+        return new
+
+    def leave(self, group, switch, port):
+        members = self.groups.get(group)
+        if not members or (switch, port) not in members:
+            return False
+        del members[(switch, port)]
+        if not members:
+            del self.groups[group]
+        return True
+
+    def members(self, group):
+        return list(self.groups.get(group, ()))
+
+    def expire(self, now, interval=GROUP_MEMBERSHIP_INTERVAL):
+        """Drop receivers that stopped reporting, returns them."""
+        expired = []
+        for group, members in list(self.groups.items()):
+            for receiver, seen in list(members.items()):
+                if now - seen > interval:
+                    expired.append((group, receiver))
+                    self.leave(group, *receiver)
+        return expired
+
+
+def general_query():
+    """An IGMPv2 general query to all hosts, as an Ethernet frame."""
+    pkt = packet.Packet()
+    pkt.add_protocol(ethernet.ethernet(dst='01:00:5e:00:00:01', src=QUERIER_MAC,
+                                       ethertype=ether_types.ETH_TYPE_IP))
+    pkt.add_protocol(ipv4.ipv4(src=QUERIER_IP, dst=ALL_HOSTS, proto=2, ttl=1))
+    pkt.add_protocol(igmp.igmp(msgtype=igmp.IGMP_TYPE_QUERY, maxresp=QUERY_RESPONSE * 10,
+                               address='0.0.0.0'))
+    pkt.serialize()
+    return bytes(pkt.data)
+
+
+def membership_changes(igmp_pkt):
+    """(group, joined) pairs carried by an IGMPv1/v2/v3 message."""
+    msgtype = igmp_pkt.msgtype
+    if msgtype in (igmp.IGMP_TYPE_REPORT_V1, igmp.IGMP_TYPE_REPORT_V2):
+        return [(igmp_pkt.address, True)]
+    if msgtype == igmp.IGMP_TYPE_LEAVE:
+        return [(igmp_pkt.address, False)]
+    if msgtype != igmp.IGMP_TYPE_REPORT_V3:
+        return []
+    changes = []
+    for record in igmp_pkt.records:
+        if record.type_ in (igmp.MODE_IS_EXCLUDE, igmp.CHANGE_TO_EXCLUDE_MODE):
+            changes.append((record.address, True))
+        elif record.type_ in (igmp.MODE_IS_INCLUDE, igmp.ALLOW_NEW_SOURCES) and record.srcs:
+            # source-specific joins are served by the any-source tree
+            changes.append((record.address, True))
+        elif record.type_ in (igmp.MODE_IS_INCLUDE, igmp.CHANGE_TO_INCLUDE_MODE) and not record.srcs:
+            changes.append((record.address, False))
+    return changes
+
+
+class IGMP_Handler(object):
+    """IGMP snooping on top of the multicast trees.
+
+    A join grafts the receiver's branch onto the group's tree and a leave
+    prunes it; only switches on the changed branch get a GroupMod, the rest
+    of the tree is left alone.
+
+    Groups that replicate to the same ports on a switch share one group
+    entry there, so the controller provides topology, dpset and
+    shared_groups (a group_ids.SharedGroups) and may set
+    multicast_priority, and use_bundles to commit each switch's changes as
+    one OpenFlow bundle. If it has tree_changed(group, switches) that is
+    called with the switches whose state changed.
+
+    Receivers are only kept while they report, which hosts do when
+    queried: maintain() sends a general query out of every host port
+    each QUERY_INTERVAL and drops the receivers that stopped answering.
+    """
+
+    def __init__(self, controller):
+        self.controller = controller
+        self.topology = controller.topology
+        self.members = MembershipTable()
+        self.sources = {}  # group address -> source host or (switch, port)
+        self.static = {}   # group address -> configured targets
+        self.methods = {}  # group address -> tree method
+        self.trees = {}    # group address -> MulticastTree
+        self.last_query = None
+
+    def add_group(self, group, source, targets=(), method='spt'):
+        """Register a configured group, its tree is built on demand."""
+        self.sources[group] = source
+        self.static[group] = list(targets)
+        self.methods[group] = method
+
+    def tree(self, group):
+        if group not in self.trees and group in self.sources:
+            targets = self.static.get(group, []) + self.members.members(group)
+            self.trees[group] = build_tree(self.topology, self.sources[group], targets,
+                                           self.methods.get(group, 'spt'))
+        return self.trees.get(group)
+
+    def process_igmp(self, datapath, in_port, ipv4_pkt, igmp_pkt):
+        switch = self.topology.switch_name(datapath.id)
+        if switch is None:
+            return
+        now = time.time()
+        for group, joined in membership_changes(igmp_pkt):
+            if joined:
+                if self.members.join(group, switch, in_port, now):
+                    self.graft(group, (switch, in_port))
+            elif self.members.leave(group, switch, in_port):
+                self.prune(group, (switch, in_port))
+
+    def process_multicast_pktin(self, datapath, in_port, ipv4_pkt):
+        # first packet of an unknown group: root its tree at the sender
+        group = ipv4_pkt.dst
+        if group in self.trees:
+            return
+        if group not in self.sources:
+            source = self.topology.host_for_ip(ipv4_pkt.src)
+            if source is None:
+                source = (self.topology.switch_name(datapath.id), in_port)
+            self.add_group(group, source)
+        tree = self.tree(group)
+        # leaves first, so no switch forwards into one that is not ready
+        added = sorted(tree.switches(), key=tree.depth, reverse=True)
+        self.push(group, added, [], [])
+
+    def graft(self, group, receiver):
+        tree = self.trees.get(group)
+        if tree is None:
+            return
+        added, modified = tree.graft(receiver)
+        self.push(group, added, modified, [])
+
+    def prune(self, group, receiver):
+        tree = self.trees.get(group)
+        if tree is None:
+            return
+        modified, removed = tree.prune(receiver)
+        self.push(group, [], modified, removed)
+
+    def expire(self, now=None):
+        for group, receiver in self.members.expire(now or time.time()):
+            self.prune(group, receiver)
+
+    def query(self):
+        """Send a general query out of the host ports of every connected
+        switch, returns the number of switches it went to."""
+        edge = {}
+        for switch, port in self.topology.hosts.values():
+            edge.setdefault(switch, []).append(port)
+        frame = general_query()
+        sent = 0
+        for switch, ports in sorted(edge.items()):
+            dp = self.datapath(switch)
+            if dp is not None:
+                dp.send_msg(ofmsg.packet_out(dp, sorted(ports), frame))
+                sent += 1
+        return sent
+
+    def maintain(self, now=None):
+        """Query when one is due and expire the receivers that did not
+        answer the last ones; call it every few seconds."""
+        now = now or time.time()
+        if self.last_query is None or now - self.last_query >= QUERY_INTERVAL:
+            # not due until a switch actually got one
+            if self.query():
+                self.last_query = now
+        self.expire(now)
+
+    def match(self, group):
+        match = dict(eth_type=0x0800, ipv4_dst=group)
+        source = self.sources.get(group)
+        if source is not None and not isinstance(source, tuple):
+            match['ipv4_src'] = self.topology.host_ip(source)
+        return match
+
+    def push(self, group, added, modified, removed):
+        tree = self.trees[group]
+        shared = self.controller.shared_groups
+        priority = getattr(self.controller, 'multicast_priority', 50)
+        match = self.match(group)
+        batch = ofmsg.MessageBatch(getattr(self.controller, 'use_bundles', False))
+        for switch in list(added) + list(modified):
+            ports = tree.buckets[switch]
+            binding = shared.bind(switch, group, ports)
+            dp = self.datapath(switch)
+            if dp is not None:
+                for msg in ofmsg.bound_group_msgs(dp, priority, match, ports, binding):
+                    batch.append(dp, msg)
+        for switch in removed:
+            binding = shared.unbind(switch, group)
+            dp = self.datapath(switch)
+            if dp is not None:
+                for msg in ofmsg.unbound_group_msgs(dp, match, binding):
+                    batch.append(dp, msg)
+        batch.commit()
+        tree_changed = getattr(self.controller, 'tree_changed', None)
+        if tree_changed is not None and (added or modified or removed):
+            tree_changed(group, list(added) + list(modified) + list(removed))
+
+    def datapath(self, switch):
+        return self.controller.dpset.get(self.topology.switch_dpid(switch))
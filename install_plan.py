@@ -0,0 +1,72 @@
+import struct
+
+from ryu.ofproto import ofproto_protocol
+
+
+class _Xid(object):
+    # what Datapath.set_xid() needs of a message
+    xid = None
+
+    def set_xid(self, xid):
+        self.xid = xid
+
+
+class InstallPlan(object):
+    """The desired state of every switch, compiled to wire format.
+
+    build(desc, dpid) returns the OpenFlow messages that bring one switch to
+    the desired state; desc stands in for the datapath so plans can be built
+    before the switch connects. Each slice is serialized once, ends with a
+    barrier and is cached until invalidate() is called for its dpid, so a
+    reconnecting switch gets its whole slice in a single write. The xids
+    are filled in on replay from the datapath's own counter, so they do
+    not clash with the requests the app sends.
+    """
+
+    def __init__(self, build, ofp_version):
+        self.build = build
+        self.desc = ofproto_protocol.ProtocolDesc(ofp_version)
+        self.slices = {}
+        self.offsets = {}  # dpid -> where each message of its slice starts
+
+    def compile(self, dpid):
+        parser = self.desc.ofproto_parser
+        msgs = list(self.build(self.desc, dpid))
+        msgs.append(parser.OFPBarrierRequest(self.desc))
+        bufs = []
+        offsets = []
+        size = 0
+        for msg in msgs:
+            msg.set_xid(0)
+            msg.serialize()
+            bufs.append(bytes(msg.buf))
+            offsets.append(size)
+            size += len(msg.buf)
+        self.slices[dpid] = b''.join(bufs)
+        self.offsets[dpid] = offsets
+        return self.slices[dpid]
+
+    def compile_all(self, dpids):
+        for dpid in dpids:
+            self.compile(dpid)
+
+    def get(self, dpid):
+        buf = self.slices.get(dpid)
+        if buf is None:
+            buf = self.compile(dpid)
+        return buf
+
+    def invalidate(self, dpids=None):
+        if dpids is None:
+            self.slices.clear()
+            return
+        for dpid in dpids:
+            self.slices.pop(dpid, None)
+
+    def replay(self, datapath):
+        buf = bytearray(self.get(datapath.id))
+        for offset in self.offsets[datapath.id]:
+            # the xid follows version, type and length in the header
+            struct.pack_into('!I', buf, offset + 4, datapath.set_xid(_Xid()))
+        datapath.send(bytes(buf))
+        return len(buf)
@@ -1,4 +1,6 @@
 import json
+import os
+import sys
 from ryu.base import app_manager
 from ryu.controller import ofp_event
 from ryu.controller.handler import MAIN_DISPATCHER, CONFIG_DISPATCHER
@@ -6,8 +8,18 @@ from ryu.controller.handler import set_ev_cls
 from ryu.ofproto import ofproto_v1_3
 from ryu.lib.packet import packet, ethernet, ipv4, igmp
 from ryu.controller import dpset
+from ryu.lib import hub
 from ipaddress import IPv4Address
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from topology import Topology
+from igmp_snooping import IGMP_Handler
+from install_plan import InstallPlan
+from group_ids import GroupIds, SharedGroups
+from aggregation import Aggregator
+import ofmsg
+import fastpath
+
 
 def load_netconf(filename='netconf.json'):
     with open(filename) as f:
@@ -22,67 +34,108 @@ class MulticastRyuApp(app_manager.RyuApp):
         super(MulticastRyuApp, self).__init__(*args, **kwargs)
         self.dpset = kwargs['dpset']
         self.netconf = load_netconf()
+        self.topology = Topology(self.netconf)
 
-        self.dpid_to_switchname = self.netconf['dpid_to_switchname']
         self.host_ips = self.netconf['host_ips']
-        self.topo = self.netconf['topo']
         self.multicast_groups = self.netconf['multicast_groups']
-        self.switchname_to_dpid = {switch_name: dpid for dpid, switch_name in self.dpid_to_switchname.items()}
-
-        # 新增字典，用于将字符串形式的 group_id 映射到整数 ID
-        self.group_id_mapping = {}
-        self.next_group_id = 1  # 用于分配新的整数 group_id
-
-    def get_group_id(self, string_group_id):
-        if string_group_id not in self.group_id_mapping:
-            self.group_id_mapping[string_group_id] = self.next_group_id
-            self.next_group_id += 1
-        print("Assigned Group ID:", self.group_id_mapping[string_group_id])  # 打印分配的组 ID
-        return self.group_id_mapping[string_group_id]
+        self.multicast_priority = 50
+
+        # 聚合模式（netconf 中的 "aggregation"，如 {"max_trees": 8, "max_leak": 0.5}）：
+        # 配置的组播组映射到少量打 VLAN 标签的共享核心树，核心交换机只保存每棵树的状态
+        # 映射只在启动时做一次，之后 IGMP 加入/离开不会让组换到别的核心树
+        self.aggregator = None
+        if 'aggregation' in self.netconf:
+            self.aggregator = Aggregator(self.topology, **self.netconf['aggregation'])
+
+        # IGMP 侦听，组播树按组播地址维护，加入/离开只改受影响的分支
+        self.igmp_handler = IGMP_Handler(self)
+        for group_name, group_info in self.multicast_groups.items():
+            if self.aggregator is not None:
+                self.aggregator.assign(group_info['multicast_address'], group_info['source'],
+                                       group_info['targets'], self.group_match(group_info))
+                continue
+            self.igmp_handler.add_group(group_info['multicast_address'], group_info['source'],
+                                        group_info['targets'], group_info.get('tree', 'spt'))
+        self.igmp_thread = hub.spawn(self._igmp_aging)
+
+        # 每台交换机各自分配组 ID，释放的 ID 回收复用，重启后从文件恢复
+        self.group_ids = GroupIds('group_ids.json')
+        # 同一交换机上输出端口相同的组播组共用一个组表项（引用计数）
+        self.shared_groups = SharedGroups(self.group_ids)
+
+        # 预编译每台交换机的安装计划，交换机重连时一次性下发
+        self.plan = InstallPlan(self.build_switch_plan, ofproto_v1_3.OFP_VERSION)
+        self.plan.compile_all(self.topology.switches)
+        # 上次运行留下、这次没有组再用到的组 ID 释放掉
+        self.shared_groups.prune()
+        self.group_ids.save()
+
+    def group_match(self, group_info):
+        return dict(eth_type=0x0800, ipv4_dst=group_info['multicast_address'],
+                    ipv4_src=self.topology.host_ip(group_info['source']))
 
     # 在交换机状态变化时处理组播组和流表项的安装
     @set_ev_cls(dpset.EventDP, dpset.DPSET_EV_DISPATCHER)
     def switch_state_change(self, ev):
         datapath = ev.dp
-        if ev.enter and str(datapath.id) in self.dpid_to_switchname:
-            self.logger.info("Switch %s has entered", self.dpid_to_switchname[str(datapath.id)])
-            for group_name, group_info in self.multicast_groups.items():
-                self.install_multicast_group(datapath, group_name, group_info)
-
-    # 安装组播组
-    def install_multicast_group(self, datapath, group_name, group_info):
-        ofproto = datapath.ofproto
-        parser = datapath.ofproto_parser
-
-        # 创建组播组的 buckets
-        buckets = []
-        for target in group_info['targets']:
-            target_ip = self.host_ips[target]
-            target_switch_name = self.find_switch_for_host(target)
-            target_dpid = self.switchname_to_dpid[target_switch_name]
-            if str(datapath.id) != target_dpid:
-                continue  # 只在目标主机直接连接的交换机上安装组播组
-            out_port = self.topo[target_switch_name][target]
-            actions = [parser.OFPActionOutput(out_port)]
-            buckets.append(parser.OFPBucket(actions=actions))
-
-        group_id = self.get_group_id(group_name)
-        group_mod = parser.OFPGroupMod(datapath, ofproto.OFPGC_ADD, ofproto.OFPGT_ALL, group_id, buckets)
-        datapath.send_msg(group_mod)
-
-        # 为源主机到组播地址的流量安装流表项
-        source_ip = self.host_ips[group_info['source']]
-        multicast_ip = group_info['multicast_address']
-        match = parser.OFPMatch(eth_type=0x0800, ipv4_src=source_ip, ipv4_dst=multicast_ip)
-        actions = [parser.OFPActionGroup(group_id)]
-        self.add_flow(datapath, 50, match, actions)
+        switch_name = self.topology.switch_name(datapath.id)
+        if ev.enter and switch_name is not None:
+            size = self.plan.replay(datapath)
+            self.logger.info("Switch %s has entered, sent %d bytes of plan", switch_name, size)
+
+    # 计算从源交换机出发、覆盖所有目标交换机的组播树
+    def get_tree(self, group_name, group_info):
+        return self.igmp_handler.tree(group_info['multicast_address'])
+
+    def tree_changed(self, group, switches):
+        self.plan.invalidate(self.topology.switch_dpid(s) for s in switches)
+        self.group_ids.save()
+
+    # 定期发送通用查询，主机应答后成员关系才不会老化
+    def _igmp_aging(self):
+        while True:
+            hub.sleep(10)
+            self.igmp_handler.maintain()
+
+    # 生成一台交换机的全部流表项和组表项
+    def build_switch_plan(self, desc, dpid):
+        ofproto = desc.ofproto
+        parser = desc.ofproto_parser
+        switch_name = self.topology.switch_name(dpid)
+
+        # IGMP 报文送控制器
+        actions = [parser.OFPActionOutput(ofproto.OFPP_CONTROLLER, ofproto.OFPCML_NO_BUFFER)]
+        msgs = [ofmsg.flow_mod(desc, 100, dict(eth_type=0x0800, ip_proto=2), actions)]
+        # 没有组播树的组播数据也送控制器，首包以发送者为根建树
+        msgs.append(ofmsg.flow_mod(desc, 1, dict(eth_type=0x0800, ipv4_dst=('224.0.0.0', '240.0.0.0')),
+                                   actions))
+        if self.aggregator is not None:
+            msgs.extend(self.aggregator.switch_msgs(desc, switch_name, self.group_ids,
+                                                    self.multicast_priority))
+
+        for group_name, group_info in self.multicast_groups.items():
+            self.get_tree(group_name, group_info)
+        # 只在组播树经过的交换机上安装，每个分支复制一份
+        multicast_ips = []
+        for multicast_ip, tree in self.igmp_handler.trees.items():
+            out_ports = tree.buckets.get(switch_name)
+            if out_ports is not None:
+                self.shared_groups.bind(switch_name, multicast_ip, out_ports)
+                multicast_ips.append(multicast_ip)
+        for group_id, out_ports in sorted(self.shared_groups.entries(switch_name).items()):
+            # 先删后加，重连的交换机上残留的同号组表项不会导致报错
+            msgs.append(ofmsg.group_mod(desc, ofproto.OFPGC_DELETE, group_id, []))
+            msgs.append(ofmsg.group_mod(desc, ofproto.OFPGC_ADD, group_id, out_ports))
+        for multicast_ip in multicast_ips:
+            # 为源主机到组播地址的流量安装流表项，指向共用的组表项
+            group_id = self.shared_groups.get(switch_name, multicast_ip)
+            msgs.append(ofmsg.group_flow_mod(desc, self.multicast_priority,
+                                             self.igmp_handler.match(multicast_ip), group_id))
+        return msgs
 
     # 根据主机名找到其直接连接的交换机名
     def find_switch_for_host(self, host):
-        for switch_name, connections in self.topo.items():
-            if host in connections:
-                return switch_name
-        return None
+        return self.topology.host_switch(host)
 
     def add_flow(self, datapath, priority, match, actions, buffer_id=None):
         ofproto = datapath.ofproto
@@ -98,32 +151,28 @@ class MulticastRyuApp(app_manager.RyuApp):
         dp = msg.datapath
         ofp = dp.ofproto
         ofp_parser = dp.ofproto_parser
+        in_port = msg.match['in_port']
+        # skip the full decode for anything that is neither IGMP nor multicast
+        _, _, ethertype, offset = fastpath.parse_eth(msg.data)
+        if ethertype != fastpath.ETH_TYPE_IP:
+            return
+        proto, _, dst = fastpath.parse_ipv4(msg.data, offset)
+        if proto != fastpath.IPPROTO_IGMP and not fastpath.is_multicast_ip(dst):
+            return
         pkt = packet.Packet(msg.data)
 
         ipv4_pkt = pkt.get_protocol(ipv4.ipv4)
         igmp_pkt = pkt.get_protocol(igmp.igmp)
         if igmp_pkt is not None:
-            return self.igmp_handler.process_igmp(ipv4_pkt, igmp_pkt)
+            return self.igmp_handler.process_igmp(dp, in_port, ipv4_pkt, igmp_pkt)
         else:
             if ipv4_pkt and IPv4Address(ipv4_pkt.dst).is_multicast:
-                return self.igmp_handler.process_multicast_pktin(ipv4_pkt)
+                return self.igmp_handler.process_multicast_pktin(dp, in_port, ipv4_pkt)
 
         pass
         # print('get pkt', pkt)
 
 
-class IGMP_Handler(object):
-    def __init__(self, controller):
-        self.controller = controller
-
-    def process_igmp(self, ipv4_pkt, igmp_pkt):
-        print('# msgtype', igmp_pkt.msgtype)
-        print('#xxx src, dst', ipv4_pkt.src, ipv4_pkt.dst)
-
-    def process_multicast_pktin(self, ipv4_pkt):
-        print("# src, dst", ipv4_pkt.src, ipv4_pkt.dst)
-
-
 # Entry point
 def main():
     app_mgr = app_manager.AppManager.instance()
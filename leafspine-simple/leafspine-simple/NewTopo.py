@@ -4,6 +4,11 @@ from mininet.topo import Topo
 from mininet.link import TCLink
 from mininet.node import RemoteController, OVSSwitch
 from mininet.cli import CLI
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from topology import Topology
+from topo_builder import dpid_str
 
 
 class CustomSwitch(OVSSwitch):
@@ -17,24 +22,26 @@ class CustomSwitch(OVSSwitch):
 class JSONBasedTopo(Topo):
     def __init__(self, config, **kwargs):
         self.config = config
+        self.topology = Topology(config)
         super(JSONBasedTopo, self).__init__(**kwargs)
 
     def build(self):
         # 添加交换机和主机
         for dpid, switch_name in self.config['dpid_to_switchname'].items():
-            self.addSwitch(switch_name, dpid=str(dpid))
+            self.addSwitch(switch_name, dpid=dpid_str(dpid))
 
         for host_name, ip in self.config['host_ips'].items():
             self.addHost(host_name, ip=ip)
 
-        # 添加链接
-        for node1, connections in self.config['topo'].items():
-            for node2, port in connections.items():
-                self.addLink(node1, node2)
+        # 添加链接，每条链路只添加一次
+        for node1, port1, node2, port2 in self.topology.links():
+            self.addLink(node1, node2, port1=port1, port2=port2)
 
 
-def install_multicast_flow_entries(net, config):
+def install_multicast_flow_entries(net, config, topology=None):
     created_groups = {}  # 记录已创建的组播组
+    if topology is None:
+        topology = Topology(config)
 
     for group_name, group_info in config['multicast_groups'].items():
         source_ip = config['host_ips'][group_info['source']]
@@ -44,13 +51,10 @@ def install_multicast_flow_entries(net, config):
         # 构建组播组配置
         group_configs = {}
         for target in group_info['targets']:
-            target_ip = config['host_ips'][target]
-            for sw_name, connections in config['topo'].items():
-                if target in connections:
-                    port = connections[target]
-                    if sw_name not in group_configs:
-                        group_configs[sw_name] = []
-                    group_configs[sw_name].append(f"bucket=output:{port}")
+            sw_name, port = topology.host_port(target)
+            if sw_name is None:
+                continue
+            group_configs.setdefault(sw_name, []).append(f"bucket=output:{port}")
 
         # 创建组播组
         for sw_name, buckets in group_configs.items():
@@ -120,7 +124,7 @@ def create_network(config):
     net.addController('c0', controller=RemoteController, ip="127.0.0.1", port=6653)
     net.start()
 
-    install_multicast_flow_entries(net, config)  # 安装多播流表项
+    install_multicast_flow_entries(net, config, topo.topology)  # 安装多播流表项
 
     configure_default_multicast_routes(net)  # 配置默认多播路由
 
@@ -27,6 +27,10 @@ from mininet.util import dumpNodeConnections
 
 import logging
 import os
+import shutil
+import subprocess
+import tempfile
+import threading
 import time
 
 
@@ -139,28 +143,44 @@ class LeafSpine(Topo):
 		h = self.net.get(host_name)
 		return h.IP()
 
-	def install_ecmp_routes(self, net=None):
+	def install_ecmp_routes(self, net=None, workers=16):
 		"""
 			Install ECMP routes proactively.
 		"""
 		if net is None:
 			net = self.net
 
+		start = time.time()
+		groups, flows = self.ecmp_flow_sets(net)
+		self.push_flow_sets(groups, flows, workers)
+		print('# %d flows and %d groups on %d switches in %.2fs' % (
+			sum(map(len, flows.values())), sum(map(len, groups.values())),
+			len(flows), time.time() - start))
+
+	def ecmp_flow_sets(self, net=None):
+		"""
+			Build the ECMP routes of every switch in memory, returns
+			({switch: group lines}, {switch: flow lines}) in ovs-ofctl
+			add-groups / add-flows file syntax.
+		"""
+		if net is None:
+			net = self.net
+
+		groups = dict((sw_name, []) for sw_name in self.switches())
+		flows = dict((sw_name, []) for sw_name in self.switches())
+		flow = 'table=0,idle_timeout=0,hard_timeout=0,priority=%d,%s,nw_dst=%s,actions=output:%d'
+
 		# Down: spine --> leaf --> tor --> host
 		# spine to leaf
 		for spine_name in self.spine_names:
 			for i, leaf_name in enumerate(self.leaf_names):
 				subnet = "10.{0}.0.0/16".format(i)
 				port = self.port(spine_name, leaf_name)[0]
-				#print(port, '---------')
 				assert isinstance(port, int)
 
 				for pro in ('ip', 'arp'):
-					cmd = "ovs-ofctl add-flow %s -O %s \
-						'table=0,idle_timeout=0,hard_timeout=0,priority=10,%s, \
-						nw_dst=%s, actions=output:%d'" % (spine_name, self.of_version, pro, subnet, port)
-					self.sys_shell(cmd)
-				
+					flows[spine_name].append(flow % (10, pro, subnet, port))
+
 		# leaf to tor
 		for i, leaf_name in enumerate(self.leaf_names):
 			for j in range(self.rack_per_leaf):
@@ -170,23 +190,17 @@ class LeafSpine(Topo):
 				assert isinstance(port, int)
 
 				for pro in ('ip', 'arp'):
-					cmd = "ovs-ofctl add-flow %s -O %s \
-						'table=0,idle_timeout=0,hard_timeout=0,priority=40,%s, \
-						nw_dst=%s,actions=output:%d'" % (leaf_name, self.of_version, pro, subnet, port)
-					self.sys_shell(cmd)
+					flows[leaf_name].append(flow % (40, pro, subnet, port))
 
 				# tor to host
 				for k in range(self.host_per_rack):
 					host_name = 'H' + self.ijk_tuple_to_str(i, j, k)
-					hostip = self.get_host_ip(host_name)
+					hostip = net.get(host_name).IP()
 					port = self.port(tor_name, host_name)[0]
 					assert isinstance(port, int)
 
 					for pro in ('ip', 'arp'):
-						cmd = "ovs-ofctl add-flow %s -O %s \
-							'table=0,idle_timeout=0,hard_timeout=0,priority=40,%s, \
-							nw_dst=%s,actions=output:%d'" % (tor_name, self.of_version, pro, hostip, port)
-						self.sys_shell(cmd)
+						flows[tor_name].append(flow % (40, pro, hostip, port))
 
 		# Up: host --> tor --> leaf --> spine
 		# host: setdefault routes
@@ -200,10 +214,7 @@ class LeafSpine(Topo):
 			assert isinstance(port, int)
 
 			for pro in ('ip', 'arp'):
-				cmd = "ovs-ofctl add-flow %s -O %s \
-					'table=0,idle_timeout=0,hard_timeout=0,priority=20,%s, \
-					nw_dst=%s,actions=output:%d'" % (tor_name, self.of_version, pro, subnet, port)
-				self.sys_shell(cmd)
+				flows[tor_name].append(flow % (20, pro, subnet, port))
 
 		# leaf to spine, with ECMP
 		for i, leaf_name in enumerate(self.leaf_names):
@@ -213,16 +224,54 @@ class LeafSpine(Topo):
 				assert isinstance(port, int)
 				lst.append('bucket=output:{0}'.format(port))
 			bucket_s = ','.join(lst)
-			
-			cmd = "ovs-ofctl add-group %s -O %s \
-			'group_id=1,type=select,%s'" % (leaf_name, self.of_version, bucket_s)
-			self.sys_shell(cmd)
-			subnet = "10.0.0.0/8"
+
+			groups[leaf_name].append('group_id=1,type=select,%s' % bucket_s)
 			for pro in ('ip', 'arp'):
-				cmd = "ovs-ofctl add-flow %s -O %s \
-					'table=0,priority=10,%s,actions=group:1'" % (leaf_name, self.of_version, pro) # TODO
-				self.sys_shell(cmd)
+				flows[leaf_name].append('table=0,priority=10,%s,actions=group:1' % pro) # TODO
 
+		return groups, flows
+
+	def push_flow_sets(self, groups, flows, workers=16):
+		"""
+			Push each switch's groups and flows with one ovs-ofctl
+			add-groups and one add-flows call, up to workers switches at
+			a time. Groups go first since the flows point at them.
+		"""
+		tmpdir = tempfile.mkdtemp(prefix='ecmp-')
+		jobs = []
+		for sw_name in sorted(flows):
+			cmds = []
+			for verb, lines in (('add-groups', groups.get(sw_name)), ('add-flows', flows[sw_name])):
+				if not lines:
+					continue
+				filename = os.path.join(tmpdir, '%s.%s' % (sw_name, verb))
+				with open(filename, 'w') as f:
+					f.write('\n'.join(lines) + '\n')
+				cmds.append(['ovs-ofctl', '-O', self.of_version, verb, sw_name, filename])
+			jobs.append((sw_name, cmds))
+
+		failed = []
+
+		def worker():
+			while jobs:
+				try:
+					sw_name, cmds = jobs.pop()
+				except IndexError:
+					break
+				for cmd in cmds:
+					if subprocess.call(cmd) != 0:
+						failed.append(sw_name)
+						break
+
+		threads = [threading.Thread(target=worker) for _ in range(min(workers, len(jobs)))]
+		for t in threads:
+			t.start()
+		for t in threads:
+			t.join()
+		shutil.rmtree(tmpdir)
+		if failed:
+			print('# failed to program', ' '.join(sorted(failed)))
+		return failed
 
 	def dump_netconf(self, filename='netconf.txt'):
 		topo = {}
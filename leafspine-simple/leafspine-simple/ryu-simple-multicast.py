@@ -13,7 +13,16 @@ from ryu.lib.packet import igmp
 from ipaddress import IPv4Address
 
 from ryu.controller import dpset
+from ryu.lib import hub
 
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from topology import Topology
+from igmp_snooping import IGMP_Handler
+import ofmsg
+from group_ids import GroupIds, SharedGroups
+import fastpath
 
 
 # ryu run --observe-links ryu/app/gui_topology/gui_topology.py
@@ -33,17 +42,31 @@ class APP(app_manager.RyuApp):
 
     def __init__(self, *args, **kwargs):
         super(APP, self).__init__(*args, **kwargs)
-        self.igmp_handler = IGMP_Handler(self)
         self.dpset = kwargs['dpset']
         self.netconf = load_netconf()
 
-        netconf = self.netconf
-        self.dpid_to_switchname = netconf['dpid_to_switchname']
-        self.host_ips = netconf['host_ips']
-        self.topo = netconf['topo']
-        self.switchname_to_dpid = {}
-        for dpid, switch_name in self.dpid_to_switchname.items():
-            self.switchname_to_dpid[switch_name] = dpid    
+        self.topology = Topology(self.netconf)
+        self.dpid_to_switchname = self.topology.switches
+        self.host_ips = self.topology.host_ips
+        self.switchname_to_dpid = self.topology.dpids
+
+        # group ids below 16 are left to the hand-built trees
+        self.group_ids = GroupIds('group_ids.json', first=16)
+        self.shared_groups = SharedGroups(self.group_ids)
+        # group and flow changes go out as one atomic bundle per switch
+        self.use_bundles = True
+        self.igmp_handler = IGMP_Handler(self)
+        self.igmp_thread = hub.spawn(self._igmp_aging)
+
+    def tree_changed(self, group, switches):
+        self.group_ids.save()
+
+    def _igmp_aging(self):
+        # receivers that stop answering the general queries are pruned
+        # like the ones that leave
+        while True:
+            hub.sleep(10)
+            self.igmp_handler.maintain()
 
     def install_simple_multicast_tree(self, datapath):        
         # install H0m0m0 -> H0m0m1, H0m0m2 at switch T0m0
@@ -73,20 +96,25 @@ class APP(app_manager.RyuApp):
         buckets = []
         bucket_id = 0
         for i in range(2):
-            port = self.topo['T0m0']['H0m0m{0}'.format(i + 1)]
+            _, port = self.topology.host_port('H0m0m{0}'.format(i + 1))
             actions = [parser.OFPActionOutput(port), ]
             buckets.append(parser.OFPBucket(bucket_id=bucket_id, actions=actions))
             bucket_id += 1
 
+        batch = ofmsg.MessageBatch(bundle=self.use_bundles)
         req = parser.OFPGroupMod(datapath, ofproto.OFPGC_ADD, ofproto.OFPGT_ALL, group_id=group_id, buckets=buckets)        
         #print('req', req)
-        datapath.send_msg(req)
+        batch.append(datapath, req)
 
         actions = [parser.OFPActionGroup(group_id=group_id)]
         print(match)
         print(actions)
         #  out_group=group_id,
-        self.add_flow(datapath, 10, match, actions, out_group=group_id, command=ofproto.OFPFC_ADD)
+        inst = [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS, actions)]
+        batch.append(datapath, parser.OFPFlowMod(datapath=datapath, priority=10, match=match, instructions=inst,
+                                                 out_group=group_id, command=ofproto.OFPFC_ADD))
+        # the flow never sees the switch without its group
+        batch.commit()
         
         
     @set_ev_cls(dpset.EventDP, dpset.DPSET_EV_DISPATCHER)
@@ -148,28 +176,24 @@ class APP(app_manager.RyuApp):
         dp = msg.datapath
         ofp = dp.ofproto
         ofp_parser = dp.ofproto_parser
+        in_port = msg.match['in_port']
+        # skip the full decode for anything that is neither IGMP nor multicast
+        _, _, ethertype, offset = fastpath.parse_eth(msg.data)
+        if ethertype != fastpath.ETH_TYPE_IP:
+            return
+        proto, _, dst = fastpath.parse_ipv4(msg.data, offset)
+        if proto != fastpath.IPPROTO_IGMP and not fastpath.is_multicast_ip(dst):
+            return
         pkt = packet.Packet(msg.data)
 
         ipv4_pkt = pkt.get_protocol(ipv4.ipv4)
         igmp_pkt = pkt.get_protocol(igmp.igmp)
         if igmp_pkt is not None:
-            return self.igmp_handler.process_igmp(ipv4_pkt, igmp_pkt)
+            return self.igmp_handler.process_igmp(dp, in_port, ipv4_pkt, igmp_pkt)
         else:
             if ipv4_pkt and IPv4Address(ipv4_pkt.dst).is_multicast: 
-                return self.igmp_handler.process_multicast_pktin(ipv4_pkt)
+                return self.igmp_handler.process_multicast_pktin(dp, in_port, ipv4_pkt)
         
         pass
         #print('get pkt', pkt)
         
-
-
-class IGMP_Handler(object):
-    def __init__(self, controller):
-        self.controller = controller
-
-    def process_igmp(self, ipv4_pkt, igmp_pkt):
-        print('# msgtype', igmp_pkt.msgtype)
-        print('#xxx src, dst', ipv4_pkt.src, ipv4_pkt.dst)
-
-    def process_multicast_pktin(self, ipv4_pkt):
-        print("# src, dst", ipv4_pkt.src, ipv4_pkt.dst)
@@ -0,0 +1,66 @@
+import time
+
+# Mbit/s of a link netconf gives no "bw" for
+DEFAULT_BW = 1000
+
+
+class LinkLoad(object):
+    """Utilization of every switch-to-switch link, per direction.
+
+    The traffic on u -> v is what u transmits on its port to v, from the
+    port counters a telemetry.StatsCollector polls; the capacity is the
+    link's "bw" in netconf, DEFAULT_BW when it has none.
+
+    Traffic the controller just moved is not in the counters until the
+    next poll of the switch, so reserve() books it on the links in the
+    meantime; a booking is dropped once a later sample of the port is in.
+    """
+
+    def __init__(self, topo, stats, default_bw=DEFAULT_BW):
+        self.topo = topo
+        self.stats = stats
+        self.default_bw = default_bw
+        self.booked = {}  # (u, v) -> [(time, bps)]
+
+    def capacity(self, u, v):
+        """Capacity of the link in bit/s."""
+        return (self.topo.capacity(u, v) or self.default_bw) * 1e6
+
+    def measured(self, u, v):
+        """(time of the sample, bps) u last transmitted towards v."""
+        port = self.topo.neighbors(u)[v][0]
+        rate = self.stats.port_rate(self.topo.dpids[u], port)
+        return (rate[0], rate[2]) if rate is not None else (0, 0.0)
+
+    def bps(self, u, v):
+        sampled, bps = self.measured(u, v)
+        bookings = self.booked.get((u, v))
+        if bookings:
+            bookings[:] = [b for b in bookings if b[0] > sampled]
+            bps += sum(b[1] for b in bookings)
+        return max(bps, 0.0)
+
+    def utilization(self, u, v, extra=0.0):
+        return (self.bps(u, v) + extra) / self.capacity(u, v)
+
+    def reserve(self, edges, bps, now=None):
+        """Book bps on every (u, v) of edges, negative to release it."""
+        if not bps:
+            return
+        now = now or time.time()
+        for edge in edges:
+            self.booked.setdefault(edge, []).append((now, bps))
+
+    def hot_links(self, threshold):
+        """{(u, v): utilization} of the links above threshold."""
+        hot = {}
+        for u, neighbors in self.topo.adj.items():
+            for v in neighbors:
+                load = self.utilization(u, v)
+                if load > threshold:
+                    hot[(u, v)] = load
+        return hot
+
+    def demand(self, group):
+        """bps the multicast group is measured to carry."""
+        return self.stats.rate(group)[1]
@@ -0,0 +1,135 @@
+import time
+from collections import OrderedDict
+
+# same defaults as the Open vSwitch MAC learning table
+MAC_TABLE_SIZE = 8192
+MAC_AGING_TIME = 300
+# what MacTable.learn() returns when a host moved to another port
+MOVED = 'moved'
+
+
+def mac_to_int(mac):
+    """Pack a raw 6-byte or 'aa:bb:..' MAC into an int."""
+    if isinstance(mac, str):
+        return int(mac.replace(':', ''), 16)
+    return int.from_bytes(mac, 'big')
+
+
+def int_to_mac(value):
+    return ':'.join('%02x' % b for b in value.to_bytes(6, 'big'))
+
+
+class MacTable(object):
+    """Learned MACs of one switch, int mac -> (port, last seen).
+
+    Entries are kept in last-seen order, so the least recently seen host is
+    both the first to age out and the one evicted when the table is full.
+
+    fabric is the set of ports facing other switches, None when unknown
+    (every port then counts as one). A host seen on a second fabric port
+    is a frame that looped back and keeps its binding. A host that comes
+    from or goes to a port facing hosts has moved and is rebound.
+    """
+
+    def __init__(self, capacity=MAC_TABLE_SIZE, aging_time=MAC_AGING_TIME, fabric=None):
+        self.capacity = capacity
+        self.aging_time = aging_time
+        self.fabric = None if fabric is None else set(fabric)
+        self.entries = OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def lookup(self, mac, now=None):
+        entry = self.entries.get(mac)
+        if entry is None:
+            return None
+        if (now or time.time()) - entry[1] > self.aging_time:
+            del self.entries[mac]
+            return None
+        return entry[0]
+
+    def learn(self, mac, port, now=None):
+        """Record mac as seen on port.
+
+        Returns True for a new host, None when it was refreshed on the same
+        port, MOVED when it was rebound from another port and False when it
+        is still bound to another fabric port; that binding is kept until it
+        ages out or the port goes down.
+        """
+        now = now or time.time()
+        old = self.lookup(mac, now)
+        if old is not None and old != port:
+            if self.is_fabric(old) and self.is_fabric(port):
+                return False
+            self.entries[mac] = (port, now)
+            self.entries.move_to_end(mac)
+            return MOVED
+        self.entries[mac] = (port, now)
+        self.entries.move_to_end(mac)
+        if old is not None:
+            return None
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+        return True
+
+    def is_fabric(self, port):
+        return self.fabric is None or port in self.fabric
+
+    def expire(self, now=None):
+        """Drop hosts not seen within the aging time, returns their MACs."""
+        now = now or time.time()
+        expired = []
+        while self.entries:
+            mac, (port, seen) = next(iter(self.entries.items()))
+            if now - seen <= self.aging_time:
+                break
+            del self.entries[mac]
+            expired.append(mac)
+        return expired
+
+    def flush_port(self, port):
+        """Forget every host learned on port, returns their MACs."""
+        flushed = [mac for mac, (p, _) in self.entries.items() if p == port]
+        for mac in flushed:
+            del self.entries[mac]
+        return flushed
+
+    def flush(self):
+        self.entries.clear()
+
+
+class MacTables(object):
+    """One MacTable per switch, keyed by dpid so no datapath is kept alive.
+
+    fabric maps a dpid to its ports facing other switches, see MacTable.
+    """
+
+    def __init__(self, capacity=MAC_TABLE_SIZE, aging_time=MAC_AGING_TIME, fabric=None):
+        self.capacity = capacity
+        self.aging_time = aging_time
+        self.fabric = fabric
+        self.tables = {}
+
+    def table(self, dpid):
+        table = self.tables.get(dpid)
+        if table is None:
+            fabric = self.fabric.get(dpid) if self.fabric is not None else None
+            table = self.tables[dpid] = MacTable(self.capacity, self.aging_time, fabric)
+        return table
+
+    def remove(self, dpid):
+        self.tables.pop(dpid, None)
+
+    def flush_port(self, dpid, port):
+        table = self.tables.get(dpid)
+        return table.flush_port(port) if table is not None else []
+
+    def expire(self, now=None):
+        now = now or time.time()
+        expired = {}
+        for dpid, table in self.tables.items():
+            macs = table.expire(now)
+            if macs:
+                expired[dpid] = macs
+        return expired
@@ -0,0 +1,454 @@
+import heapq
+
+
+def attachment(topo, node):
+    """(switch, port) of a host name; (switch, port) tuples pass through."""
+    if isinstance(node, tuple):
+        return node
+    return topo.host_port(node)
+
+
+class MulticastTree(object):
+    """Source-rooted distribution tree over the switches of a Topology.
+
+    parent maps every tree switch but the root to its upstream switch.
+    buckets maps every tree switch to the output ports a packet is
+    replicated to there, hosts and downstream switches alike, so each
+    packet is copied once per branch.
+
+    Sources and targets are host names or (switch, port) receivers; a
+    (switch, None) target pulls the switch into the tree without a port.
+    """
+
+    def __init__(self, topo, source, targets, parent):
+        self.topo = topo
+        self.source = source
+        self.root, self.root_port = attachment(topo, source)
+        self.parent = {}
+        self.children = {self.root: set()}
+        self.receivers = {}
+        self.buckets = {}
+        self.in_port = {self.root: self.root_port}
+        for target in targets:
+            switch, port = attachment(topo, target)
+            if switch is not None and port is not None:
+                self.receivers.setdefault(switch, set()).add(port)
+        for switch, up in parent.items():
+            self._link(switch, up)
+        for switch in self.children:
+            self._update(switch)
+
+    def _link(self, switch, up):
+        self.parent[switch] = up
+        self.children.setdefault(switch, set())
+        self.children.setdefault(up, set()).add(switch)
+        self.in_port[switch] = self.topo.neighbors(switch)[up][0]
+
+    def _update(self, switch):
+        adj = self.topo.neighbors(switch)
+        ports = [adj[child][0] for child in self.children[switch]]
+        ports.extend(self.receivers.get(switch, ()))
+        self.buckets[switch] = sorted(ports)
+
+    def switches(self):
+        return list(self.buckets)
+
+    def edges(self):
+        """(upstream, downstream) switch pairs."""
+        return [(up, switch) for switch, up in self.parent.items()]
+
+    def path(self, switch):
+        """Switches from the root down to switch."""
+        path = [switch]
+        while path[-1] != self.root:
+            path.append(self.parent[path[-1]])
+        path.reverse()
+        return path
+
+    def depth(self, switch):
+        return len(self.path(switch)) - 1
+
+    def graft(self, target, weight=None):
+        """Add a receiver, joining its switch to the closest tree switch.
+
+        Returns (added, modified): new switches, downstream first, and the
+        switches whose buckets changed.
+        """
+        switch, port = attachment(self.topo, target)
+        if switch is None or port in self.receivers.get(switch, ()):
+            return [], []
+        if switch in self.buckets:
+            self.receivers.setdefault(switch, set()).add(port)
+            self._update(switch)
+            return [], [switch]
+        dist, prev = shortest_paths(self.topo, self.buckets, weight or hop)
+        if switch not in dist:
+            return [], []
+        self.receivers.setdefault(switch, set()).add(port)
+        added = []
+        while switch not in self.buckets:
+            self._link(switch, prev[switch])
+            added.append(switch)
+            switch = prev[switch]
+        for s in added + [switch]:
+            self._update(s)
+        return added, [switch]
+
+    def prune(self, target):
+        """Remove a receiver and every switch left without a reason to be
+        in the tree. Returns (modified, removed)."""
+        switch, port = attachment(self.topo, target)
+        ports = self.receivers.get(switch)
+        if not ports or port not in ports:
+            return [], []
+        ports.discard(port)
+        if not ports:
+            del self.receivers[switch]
+        if switch not in self.buckets:
+            return [], []
+        removed = []
+        while switch != self.root and not self.children[switch] and switch not in self.receivers:
+            up = self.parent.pop(switch)
+            self.children[up].discard(switch)
+            del self.children[switch], self.buckets[switch], self.in_port[switch]
+            removed.append(switch)
+            switch = up
+        self._update(switch)
+        return [switch], removed
+
+
+def hop(u, v):
+    return 1
+
+
+def shortest_paths(topo, sources, weight=hop):
+    """Multi-source Dijkstra over the switch graph.
+
+    Returns (dist, prev); prev[v] is the previous switch on the best path,
+    ties are broken by switch name so trees are stable between runs.
+    """
+    dist = {}
+    prev = {}
+    heap = [(0, s, "") for s in sorted(sources)]
+    heapq.heapify(heap)
+    while heap:
+        d, u, p = heapq.heappop(heap)
+        if u in dist:
+            continue
+        dist[u] = d
+        prev[u] = p or None
+        for v in sorted(topo.neighbors(u)):
+            if v not in dist:
+                w = weight(u, v)
+                if w is not None:
+                    heapq.heappush(heap, (d + w, v, u))
+    return dist, prev
+
+
+def _target_switches(topo, targets):
+    switches = []
+    for target in targets:
+        switch = attachment(topo, target)[0]
+        if switch is not None and switch not in switches:
+            switches.append(switch)
+    return switches
+
+
+def shortest_path_tree(topo, source, targets, weight=hop):
+    """Union of the shortest paths from the source switch to every target."""
+    root = attachment(topo, source)[0]
+    dist, prev = shortest_paths(topo, [root], weight)
+    parent = {}
+    for switch in _target_switches(topo, targets):
+        if switch not in dist:
+            continue
+        while switch != root and switch not in parent:
+            parent[switch] = prev[switch]
+            switch = prev[switch]
+    return MulticastTree(topo, source, targets, parent)
+
+
+def steiner_tree(topo, source, targets, weight=hop):
+    """Takahashi-Matsuyama heuristic: grow the tree from the source switch,
+    each round attaching the target closest to any switch already in it."""
+    root = attachment(topo, source)[0]
+    parent = {}
+    tree = set([root])
+    remaining = set(s for s in _target_switches(topo, targets) if s != root)
+    while remaining:
+        dist, prev = shortest_paths(topo, tree, weight)
+        reachable = [s for s in remaining if s in dist]
+        if not reachable:
+            break
+        switch = min(reachable, key=lambda s: (dist[s], s))
+        while switch not in tree:
+            parent[switch] = prev[switch]
+            tree.add(switch)
+            switch = prev[switch]
+        remaining -= tree
+    return MulticastTree(topo, source, targets, parent)
+
+
+def bottleneck_paths(topo, sources, cost, step=0.05):
+    """Multi-source Dijkstra for the path whose most loaded link is the
+    least loaded, then the fewest hops.
+
+    cost(u, v) is the utilization of the u -> v link once the traffic is
+    on it, None for a link that cannot be used. Utilizations within the
+    same step count as equal, so a longer path is only taken to get
+    off a link that is at least step busier. Returns (band, hops, prev).
+    """
+    band = {}
+    hops = {}
+    prev = {}
+    heap = [(0, 0, s, "") for s in sorted(sources)]
+    heapq.heapify(heap)
+    while heap:
+        b, h, u, p = heapq.heappop(heap)
+        if u in band:
+            continue
+        band[u] = b
+        hops[u] = h
+        prev[u] = p or None
+        for v in sorted(topo.neighbors(u)):
+            if v not in band:
+                c = cost(u, v)
+                if c is not None:
+                    heapq.heappush(heap, (max(b, int(c / step)), h + 1, v, u))
+    return band, hops, prev
+
+
+def load_aware_tree(topo, source, targets, cost=None, step=0.05):
+    """Grow the tree from the source switch like steiner_tree(), each
+    round attaching the target whose path from the tree has the least
+    loaded bottleneck, fewest hops on a tie (see bottleneck_paths()).
+
+    Links already in the tree carry the traffic anyway and cost nothing
+    more. Without cost every link is idle and this is steiner_tree().
+    """
+    cost = cost or (lambda u, v: 0.0)
+    root = attachment(topo, source)[0]
+    parent = {}
+    tree = set([root])
+    remaining = set(s for s in _target_switches(topo, targets) if s != root)
+    while remaining:
+        band, hops, prev = bottleneck_paths(topo, tree, cost, step)
+        reachable = [s for s in remaining if s in band]
+        if not reachable:
+            break
+        switch = min(reachable, key=lambda s: (band[s], hops[s], s))
+        while switch not in tree:
+            parent[switch] = prev[switch]
+            tree.add(switch)
+            switch = prev[switch]
+        remaining -= tree
+    return MulticastTree(topo, source, targets, parent)
+
+
+def spine_tree(topo, source, targets, spines=(), avoid=()):
+    """Shortest paths that cross no spine of avoid, the target switches
+    dealt round-robin to spines, each one reached through its spine.
+
+    Where two targets' paths meet, the one laid first wins, so targets
+    sharing a leaf share its spine too.
+    """
+    root = attachment(topo, source)[0]
+    spines = list(spines) or [None]
+    avoid = set(avoid) | set(s for s in spines if s is not None)
+    prevs = {}
+    for spine in spines:
+        closed = avoid - set([spine])
+        dist, prev = shortest_paths(topo, [root], lambda u, v: None if v in closed else 1)
+        prevs[spine] = (dist, prev)
+    parent = {}
+    for i, switch in enumerate(_target_switches(topo, targets)):
+        dist, prev = prevs[spines[i % len(spines)]]
+        if switch not in dist:
+            continue
+        while switch != root and switch not in parent:
+            parent[switch] = prev[switch]
+            switch = prev[switch]
+    return MulticastTree(topo, source, targets, parent)
+
+
+def delay_bounded_tree(topo, source, targets, bound=None, delay=None, cost=hop):
+    """Cheapest tree (sum of cost over its links, one copy per link) that
+    gets to every target within bound ms of the source.
+
+    Grows from the source switch like steiner_tree(), each round
+    attaching the target that is cheapest to reach from the tree. The
+    search for a target is pruned of every path that could no longer
+    make it in time, even over the least-delay path from there on, so it
+    finds the cheapest path that is certain to. When no target fits any
+    more, the tightest one comes in over its least-delay path from the
+    source, tree switches that path reaches sooner move onto it, and
+    branches left without a receiver are cut. The switches of targets
+    that miss the bound even so are listed in the tree's late.
+
+    Delays are netconf's link "delay", host links included; without a
+    bound this is steiner_tree() over cost.
+    """
+    delay = delay or topo.delay
+    root = attachment(topo, source)[0]
+    src_delay = delay(source, root) if not isinstance(source, tuple) else 0.0
+    wanted = {}  # target switch -> delay budget from the source host
+    for target in targets:
+        switch = attachment(topo, target)[0]
+        if switch is None:
+            continue
+        slack = float("inf") if bound is None else bound
+        if not isinstance(target, tuple):
+            slack -= delay(switch, target)
+        # the tightest target on a switch sets its bound
+        wanted[switch] = min(slack, wanted.get(switch, slack))
+    budget = dict(wanted)
+    least = dict((t, shortest_paths(topo, [t], delay)[0]) for t in wanted)
+    fastest = shortest_paths(topo, [root], delay)[1]
+    parent = {}
+    reach = {root: src_delay}  # tree switch -> delay from the source host
+    wanted.pop(root, None)
+    while wanted:
+        best = None
+        for t in sorted(wanted):
+            found = _bounded_path(topo, reach, t, wanted[t], least[t], delay, cost)
+            if found is not None and (best is None or found[:2] < best[:2]):
+                best = found
+        if best is not None:
+            path = best[2]
+            for up, down in zip(path, path[1:]):
+                parent[down] = up
+        else:
+            t = min(wanted, key=lambda s: (wanted[s], s))
+            if t not in least[t] or root not in least[t]:
+                del wanted[t]
+                continue
+            path = [t]
+            while path[-1] != root:
+                path.append(fastest[path[-1]])
+            path.reverse()
+            for up, down in zip(path, path[1:]):
+                if down not in reach or reach[up] + delay(up, down) < reach[down]:
+                    parent[down] = up
+                    reach[down] = reach[up] + delay(up, down)
+            _cut_branches(parent, set(budget) | set([root]))
+        reach = _tree_delays(parent, root, src_delay, delay)
+        for switch in list(wanted):
+            if switch in reach:
+                del wanted[switch]
+    tree = MulticastTree(topo, source, targets, parent)
+    tree.late = sorted(s for s, b in budget.items() if s in reach and reach[s] > b)
+    return tree
+
+
+def _tree_delays(parent, root, src_delay, delay):
+    reach = {root: src_delay}
+
+    def get(switch):
+        if switch not in reach:
+            reach[switch] = get(parent[switch]) + delay(parent[switch], switch)
+        return reach[switch]
+    for switch in parent:
+        get(switch)
+    return reach
+
+
+def _cut_branches(parent, keep):
+    # drop switches left with neither children nor a reason to stay
+    while True:
+        ups = set(parent.values())
+        dead = [s for s in parent if s not in ups and s not in keep]
+        if not dead:
+            return
+        for s in dead:
+            del parent[s]
+
+
+def _bounded_path(topo, reach, target, bound, least, delay, cost):
+    # cheapest path from any tree switch to target that can still arrive
+    # within bound: (cost, delay on arrival, [tree switch, ..., target])
+    heap = [(0, d, s, None) for s, d in sorted(reach.items())]
+    heapq.heapify(heap)
+    prev = {}
+    while heap:
+        c, d, u, p = heapq.heappop(heap)
+        if u in prev:
+            continue
+        prev[u] = p
+        if u == target:
+            path = [u]
+            while prev[path[-1]] is not None:
+                path.append(prev[path[-1]])
+            path.reverse()
+            return c, d, path
+        for v in sorted(topo.neighbors(u)):
+            if v in prev or v in reach or v not in least:
+                continue
+            w = cost(u, v)
+            if w is None:
+                continue
+            dv = d + delay(u, v)
+            if dv + least[v] <= bound:
+                heapq.heappush(heap, (c + w, dv, v, u))
+    return None
+
+
+def repair_tree(tree, down, weight=hop):
+    """The tree with the switch links of down (frozensets of their two
+    switches) taken out, tree itself when it crosses none of them.
+
+    The switches a down link cuts off from the root leave the tree and
+    the target switches among them are grafted back onto the rest like
+    steiner_tree() does, over links that are up. The part still
+    connected to the root keeps its buckets, so only the switches the
+    cut-off part hung from or is grafted through change. Targets that
+    cannot be reached at all are left out.
+    """
+    cut = [s for s, up in tree.parent.items() if frozenset((s, up)) in down]
+    if not cut:
+        return tree
+    parent = dict(tree.parent)
+    lost = []
+    while cut:
+        switch = cut.pop()
+        # below another down link, already cut off with that one
+        if switch not in parent:
+            continue
+        lost.append(switch)
+        del parent[switch]
+        cut.extend(tree.children[switch])
+    # (switch, None) targets are the leaves without receivers
+    targets = [(s, p) for s, ports in tree.receivers.items() for p in sorted(ports)]
+    targets.extend((s, None) for s in tree.buckets if not tree.children[s] and s not in tree.receivers)
+    remaining = set(s for s in lost if s in tree.receivers or not tree.children[s])
+    usable = lambda u, v: None if frozenset((u, v)) in down else weight(u, v)
+    kept = set(parent) | set([tree.root])
+    while remaining:
+        dist, prev = shortest_paths(tree.topo, kept, usable)
+        reachable = [s for s in remaining if s in dist]
+        if not reachable:
+            break
+        switch = min(reachable, key=lambda s: (dist[s], s))
+        while switch not in kept:
+            parent[switch] = prev[switch]
+            kept.add(switch)
+            switch = prev[switch]
+        remaining -= kept
+    return MulticastTree(tree.topo, tree.source, targets, parent)
+
+
+def bottleneck(tree, cost):
+    """Utilization of the tree's most loaded link, 0 for a single switch."""
+    return max([cost(up, down) for up, down in tree.edges()] or [0.0])
+
+
+TREE_METHODS = {
+    "spt": shortest_path_tree,
+    "steiner": steiner_tree,
+    "load": load_aware_tree,
+    "spine": spine_tree,
+    "delay": delay_bounded_tree,
+}
+
+
+def build_tree(topo, source, targets, method="spt", **kwargs):
+    return TREE_METHODS[method](topo, source, targets, **kwargs)
@@ -1,6 +1,10 @@
+import logging
+import os
+import sys
+
 from ryu.base import app_manager
 from ryu.controller import ofp_event
-from ryu.controller.handler import CONFIG_DISPATCHER, MAIN_DISPATCHER
+from ryu.controller.handler import CONFIG_DISPATCHER, MAIN_DISPATCHER, DEAD_DISPATCHER
 from ryu.controller.handler import set_ev_cls
 from ryu.ofproto import ofproto_v1_3
 from ryu.lib.packet import packet
@@ -9,12 +13,26 @@ from ryu.lib.packet import tcp
 from ryu.lib.packet import ether_types
 from ryu.lib.packet import arp
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+import fastpath
+from topology import load_topology
+from mac_table import MOVED, MacTables, int_to_mac, mac_to_int
+
+# learned flows expire once the host has been quiet this long (seconds)
+IDLE_TIMEOUT = 60
+# marks learned flows so a port going down only removes those
+LEARNED_COOKIE = 0x1
+
 class MulticastController(app_manager.RyuApp):
     OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
 
     def __init__(self, *args, **kwargs):
         super(MulticastController, self).__init__(*args, **kwargs)
-        self.mac_to_port = {}
+        # with a netconf.json the switch-facing ports are known, and hosts
+        # moving between the others are rebound
+        fabric = load_topology().fabric_ports() if os.path.exists("netconf.json") else None
+        self.mac_tables = MacTables(fabric=fabric)
+        self.decisions = fastpath.DecisionCache()
 
     @set_ev_cls(ofp_event.EventOFPSwitchFeatures, CONFIG_DISPATCHER)
     def switch_features_handler(self, ev):
@@ -27,7 +45,7 @@ class MulticastController(app_manager.RyuApp):
                                           ofproto.OFPCML_NO_BUFFER)]
         self.add_flow(datapath, 0, match, actions)
 
-    def add_flow(self, datapath, priority, match, actions, buffer_id=None):
+    def add_flow(self, datapath, priority, match, actions, buffer_id=None, idle_timeout=0, cookie=0):
         ofproto = datapath.ofproto
         parser = datapath.ofproto_parser
 
@@ -36,21 +54,61 @@ class MulticastController(app_manager.RyuApp):
 
         if buffer_id:
           mod = parser.OFPFlowMod(datapath=datapath, buffer_id=buffer_id,
-                             priority=priority, match=match,
-                             instructions=inst)
+                             priority=priority, match=match, cookie=cookie,
+                             idle_timeout=idle_timeout, instructions=inst)
         else:
             mod = parser.OFPFlowMod(datapath=datapath, priority=priority,
-                             match=match, instructions=inst)
+                             match=match, cookie=cookie, idle_timeout=idle_timeout,
+                             instructions=inst)
         datapath.send_msg(mod)
 
+    @set_ev_cls(ofp_event.EventOFPStateChange, DEAD_DISPATCHER)
+    def _state_change_handler(self, ev):
+        # the switch relearns from scratch when it reconnects
+        self.mac_tables.remove(ev.datapath.id)
+        self.decisions.bump(ev.datapath.id)
+
     def mac_learning(self, datapath, src, in_port):
-        self.mac_to_port.setdefault((datapath,datapath.id), {})
-        if src in self.mac_to_port[(datapath,datapath.id)]:
-            if in_port != self.mac_to_port[(datapath,datapath.id)][src]:
-                return False
-        else:
-            self.mac_to_port[(datapath,datapath.id)][src] = in_port
-            return True
+        table = self.mac_tables.table(datapath.id)
+        if table.expire():
+            self.decisions.bump(datapath.id)
+        learned = table.learn(src, in_port)
+        if learned:
+            self.decisions.bump(datapath.id)
+        if learned is MOVED:
+            self.forget_flows_to(datapath, src)
+        return learned
+
+    def forget_flows_to(self, datapath, mac):
+        # the learned flows still send a moved host's traffic where it was
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        mod = parser.OFPFlowMod(datapath=datapath, cookie=LEARNED_COOKIE,
+                                cookie_mask=0xffffffffffffffff,
+                                command=ofproto.OFPFC_DELETE, table_id=ofproto.OFPTT_ALL,
+                                out_port=ofproto.OFPP_ANY, out_group=ofproto.OFPG_ANY,
+                                match=parser.OFPMatch(eth_dst=int_to_mac(mac)))
+        datapath.send_msg(mod)
+
+    @set_ev_cls(ofp_event.EventOFPPortStatus, MAIN_DISPATCHER)
+    def _port_status_handler(self, ev):
+        msg = ev.msg
+        ofproto = msg.datapath.ofproto
+        if msg.reason == ofproto.OFPPR_DELETE or msg.desc.state & ofproto.OFPPS_LINK_DOWN:
+            self.port_down(msg.datapath, msg.desc.port_no)
+
+    def port_down(self, datapath, port_no):
+        """Forget the hosts behind a dead port and the flows leading to it."""
+        if self.mac_tables.flush_port(datapath.id, port_no):
+            self.decisions.bump(datapath.id)
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        mod = parser.OFPFlowMod(datapath=datapath, cookie=LEARNED_COOKIE,
+                                cookie_mask=0xffffffffffffffff,
+                                command=ofproto.OFPFC_DELETE, table_id=ofproto.OFPTT_ALL,
+                                out_port=port_no, out_group=ofproto.OFPG_ANY,
+                                match=parser.OFPMatch())
+        datapath.send_msg(mod)
 
     @set_ev_cls(ofp_event.EventOFPPacketIn, MAIN_DISPATCHER)
     def _packet_in_handler(self, ev):
@@ -59,48 +117,49 @@ class MulticastController(app_manager.RyuApp):
         ofproto = datapath.ofproto
         parser = datapath.ofproto_parser
         in_port = msg.match['in_port']
-        pkt = packet.Packet(msg.data)
-        eth = pkt.get_protocols(ethernet.ethernet)[0]
-        if eth.ethertype == ether_types.ETH_TYPE_LLDP:
-            match = parser.OFPMatch(eth_type=eth.ethertype)
+        # only the Ethernet header is read, no full packet decode
+        dst_mac, src_mac, ethertype, _ = fastpath.parse_eth(msg.data)
+        if ethertype == fastpath.ETH_TYPE_LLDP or ethertype == fastpath.ETH_TYPE_IPV6:
+            match = parser.OFPMatch(eth_type=ethertype)
             actions = []
             self.add_flow(datapath, 10, match, actions)
             return
 
-        if eth.ethertype == ether_types.ETH_TYPE_IPV6:
-            match = parser.OFPMatch(eth_type=eth.ethertype)
-            actions = []
-            self.add_flow(datapath, 10, match, actions)
-            return
-
-        dst = eth.dst
-        src = eth.src
         dpid = datapath.id
-
-        self.logger.info("packet in %s %s %s %s", dpid, src, dst, in_port)
-        self.mac_learning(datapath, src, in_port)
-
-        if dst in self.mac_to_port[(datapath,datapath.id)]:
-            out_port = self.mac_to_port[(datapath,datapath.id)][dst]
+        dst = mac_to_int(dst_mac)
+        src = mac_to_int(src_mac)
+
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug("packet in %s %s %s %s", dpid, fastpath.mac_str(src_mac),
+                              fastpath.mac_str(dst_mac), in_port)
+        if self.mac_learning(datapath, src, in_port) is False:
+            out_port = self.mac_tables.table(dpid).lookup(dst)
+            if out_port is None:
+                # src showed up on another fabric port: a loop, do not flood it again
+                return
         else:
-            if self.mac_learning(datapath, src, in_port) is False:
-                out_port = ofproto.OFPPC_NO_RECV
-            else:
-                out_port = ofproto.OFPP_FLOOD
+            out_port = self.decisions.get(dpid, in_port, dst)
+            if out_port is None:
+                out_port = self.mac_tables.table(dpid).lookup(dst)
+                if out_port is None:
+                    out_port = ofproto.OFPP_FLOOD
+                self.decisions.put(dpid, in_port, dst, out_port)
 
         actions = [parser.OFPActionOutput(out_port)]
 
         if out_port != ofproto.OFPP_FLOOD:
-            match = parser.OFPMatch(in_port=in_port, eth_dst=dst)
+            match = parser.OFPMatch(in_port=in_port, eth_dst=fastpath.mac_str(dst_mac))
             if msg.buffer_id != ofproto.OFP_NO_BUFFER:
-                self.add_flow(datapath, 10, match, actions, msg.buffer_id)
+                self.add_flow(datapath, 10, match, actions, msg.buffer_id,
+                              idle_timeout=IDLE_TIMEOUT, cookie=LEARNED_COOKIE)
                 return
             else:
-                self.add_flow(datapath, 10, match, actions)
+                self.add_flow(datapath, 10, match, actions,
+                              idle_timeout=IDLE_TIMEOUT, cookie=LEARNED_COOKIE)
 
         data = None
         if msg.buffer_id == ofproto.OFP_NO_BUFFER:
             data = msg.data
         out = parser.OFPPacketOut(datapath=datapath, buffer_id=msg.buffer_id,
                                   in_port=in_port, actions=actions, data=data)
-        datapath.send_msg(out)
\ No newline at end of file
+        datapath.send_msg(out)
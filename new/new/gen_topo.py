@@ -10,6 +10,9 @@ from subprocess import call
 import time
 import json
 import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from topology import Topology
 
 json_file =  sys.argv[1] + ".json"
 
@@ -18,6 +21,7 @@ def load_config(filename=json_file):
         return json.load(f)
     
 config = load_config()
+topology = Topology(config)
 
 # print config["dpid_to_switchname"].items()
 
@@ -47,13 +51,8 @@ def myNetwork():
         host_dict[item[0]] = net.addHost(item[0], cls=Host, ip=item[1], defaultRoute=None)
 
     info( '*** Add links\n')
-    temp = []
-    for item in config["topo"].items():
-        for dst in item[1]:
-            if '{}-{}'.format(item[0], dst) not in temp:
-                net.addLink(item[0], dst)
-                temp.append('{}-{}'.format(item[0], dst))
-                temp.append('{}-{}'.format(dst, item[0]))
+    for node1, port1, node2, port2 in topology.links():
+        net.addLink(node1, node2, port1=port1, port2=port2)
 
 
     info( '*** Starting network\n')
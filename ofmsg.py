@@ -0,0 +1,168 @@
+import itertools
+
+OFP14_VERSION = 0x05
+OFP15_VERSION = 0x06
+
+_bundle_ids = itertools.count(1)
+
+
+def action_buckets(dp, action_lists):
+    parser = dp.ofproto_parser
+    if dp.ofproto.OFP_VERSION >= OFP15_VERSION:
+        # OpenFlow 1.5 wants a distinct bucket_id per bucket
+        return [parser.OFPBucket(bucket_id=i, actions=actions)
+                for i, actions in enumerate(action_lists)]
+    return [parser.OFPBucket(actions=actions) for actions in action_lists]
+
+
+def buckets(dp, ports):
+    parser = dp.ofproto_parser
+    return action_buckets(dp, [[parser.OFPActionOutput(p)] for p in ports])
+
+
+def group_mod(dp, command, group_id, ports):
+    ofproto = dp.ofproto
+    return dp.ofproto_parser.OFPGroupMod(dp, command=command, type_=ofproto.OFPGT_ALL,
+                                         group_id=group_id, buckets=buckets(dp, ports))
+
+
+def flow_mod(dp, priority, match, actions, **params):
+    ofproto = dp.ofproto
+    parser = dp.ofproto_parser
+    inst = [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS, actions)] if actions else []
+    return parser.OFPFlowMod(datapath=dp, priority=priority, match=parser.OFPMatch(**match),
+                             instructions=inst, **params)
+
+
+def action_group_mod(dp, command, group_id, action_lists):
+    ofproto = dp.ofproto
+    return dp.ofproto_parser.OFPGroupMod(dp, command=command, type_=ofproto.OFPGT_ALL,
+                                         group_id=group_id,
+                                         buckets=action_buckets(dp, action_lists))
+
+
+def group_flow_mod(dp, priority, match, group_id):
+    return flow_mod(dp, priority, match, [dp.ofproto_parser.OFPActionGroup(group_id)])
+
+
+def bound_group_msgs(dp, priority, match, ports, binding):
+    """Messages applying a SharedGroups.bind() result on dp, in order: the
+    entry's GroupMod, the flow moved onto it, then the entry it left."""
+    gid, command, moved, stale = binding
+    ofproto = dp.ofproto
+    msgs = []
+    if command == "add":
+        msgs.append(group_mod(dp, ofproto.OFPGC_ADD, gid, ports))
+    elif command == "modify":
+        msgs.append(group_mod(dp, ofproto.OFPGC_MODIFY, gid, ports))
+    if moved:
+        msgs.append(group_flow_mod(dp, priority, match, gid))
+    if stale is not None:
+        msgs.append(group_mod(dp, ofproto.OFPGC_DELETE, stale, []))
+    return msgs
+
+
+def unbound_group_msgs(dp, match, binding):
+    """Messages applying a SharedGroups.unbind() result on dp."""
+    gid, stale = binding
+    msgs = [delete_flows(dp, match)] if gid is not None else []
+    if stale is not None:
+        msgs.append(group_mod(dp, dp.ofproto.OFPGC_DELETE, stale, []))
+    return msgs
+
+
+def packet_out(dp, ports, data):
+    """data sent from the controller out of every port of ports."""
+    ofproto = dp.ofproto
+    parser = dp.ofproto_parser
+    actions = [parser.OFPActionOutput(p) for p in ports]
+    if ofproto.OFP_VERSION >= OFP15_VERSION:
+        # OpenFlow 1.5 carries the in_port in a match
+        return parser.OFPPacketOut(dp, buffer_id=ofproto.OFP_NO_BUFFER,
+                                   match=parser.OFPMatch(in_port=ofproto.OFPP_CONTROLLER),
+                                   actions=actions, data=data)
+    return parser.OFPPacketOut(dp, buffer_id=ofproto.OFP_NO_BUFFER, in_port=ofproto.OFPP_CONTROLLER,
+                               actions=actions, data=data)
+
+
+def delete_flows(dp, match):
+    ofproto = dp.ofproto
+    return dp.ofproto_parser.OFPFlowMod(datapath=dp, command=ofproto.OFPFC_DELETE,
+                                        table_id=ofproto.OFPTT_ALL,
+                                        out_port=ofproto.OFPP_ANY,
+                                        out_group=ofproto.OFPG_ANY,
+                                        match=dp.ofproto_parser.OFPMatch(**match))
+
+
+def delete_group_flows(dp, group_id):
+    ofproto = dp.ofproto
+    return dp.ofproto_parser.OFPFlowMod(datapath=dp, command=ofproto.OFPFC_DELETE,
+                                        table_id=ofproto.OFPTT_ALL,
+                                        out_port=ofproto.OFPP_ANY,
+                                        out_group=group_id,
+                                        match=dp.ofproto_parser.OFPMatch())
+
+
+class MessageBatch(object):
+    """OpenFlow messages collected per datapath and sent in one go.
+
+    Plain batches end with a barrier per switch. With bundle=True, switches
+    speaking OpenFlow 1.4+ get their messages in an atomic, ordered bundle
+    instead: every switch is opened and filled first, then all of them are
+    committed, so each one flips to the new state at once and none waits on
+    another's round-trip. Older switches fall back to the barrier.
+    """
+
+    def __init__(self, bundle=False):
+        self.bundle = bundle
+        self.dps = {}
+        self.msgs = {}
+
+    def append(self, dp, msg):
+        self.dps[dp.id] = dp
+        self.msgs.setdefault(dp.id, []).append(msg)
+
+    def __len__(self):
+        return sum(len(msgs) for msgs in self.msgs.values())
+
+    def rewrite(self, fn):
+        """Replace every message by fn(dp, msg), dropping those it maps to None."""
+        for dpid, msgs in self.msgs.items():
+            dp = self.dps[dpid]
+            self.msgs[dpid] = [m for m in (fn(dp, msg) for msg in msgs) if m is not None]
+
+    def commit(self):
+        """Send everything, returns {dpid: xid of the closing barrier or commit}."""
+        xids = {}
+        bundles = {}
+        for dpid, msgs in self.msgs.items():
+            dp = self.dps[dpid]
+            if self.bundle and dp.ofproto.OFP_VERSION >= OFP14_VERSION:
+                bundles[dpid] = self._open_bundle(dp, msgs)
+                continue
+            for msg in msgs:
+                dp.send_msg(msg)
+            barrier = dp.ofproto_parser.OFPBarrierRequest(dp)
+            dp.send_msg(barrier)
+            xids[dpid] = barrier.xid
+        for dpid, bundle_id in bundles.items():
+            dp = self.dps[dpid]
+            ofproto = dp.ofproto
+            commit = dp.ofproto_parser.OFPBundleCtrlMsg(
+                dp, bundle_id, ofproto.OFPBCT_COMMIT_REQUEST,
+                ofproto.OFPBF_ATOMIC | ofproto.OFPBF_ORDERED, [])
+            dp.send_msg(commit)
+            xids[dpid] = commit.xid
+        self.dps = {}
+        self.msgs = {}
+        return xids
+
+    def _open_bundle(self, dp, msgs):
+        ofproto = dp.ofproto
+        parser = dp.ofproto_parser
+        flags = ofproto.OFPBF_ATOMIC | ofproto.OFPBF_ORDERED
+        bundle_id = next(_bundle_ids)
+        dp.send_msg(parser.OFPBundleCtrlMsg(dp, bundle_id, ofproto.OFPBCT_OPEN_REQUEST, flags, []))
+        for msg in msgs:
+            dp.send_msg(parser.OFPBundleAddMsg(dp, bundle_id, flags, msg, []))
+        return bundle_id
@@ -1,35 +1,285 @@
-from __future__ import print_function
+"""Multicast receiver with per-group loss, ordering and delay statistics.
 
+    python receiver.py                                 224.1.10.100 until ^C
+    python receiver.py 224.1.0.0/26 --interval 1 --out rx.jsonl
+    python receiver.py 224.1.0.0/24 --duration 60 --per-socket 20
+
+Joins every group (a CIDR block stands for every address in it),
+spread over as many sockets as the kernel's per-socket membership limit
+needs. The sockets are multiplexed with selectors (epoll on Linux), and
+each ready socket is drained --batch packets per recvmmsg() call into
+one reused buffer.
+
+Packets are expected to carry sender.py's HEADER. Per group and sender
+session it counts received, lost, reordered and duplicate packets,
+and tracks one-way delay (receive time - send time, so the clocks must
+agree, as they do between Mininet hosts) and RFC 3550 interarrival
+jitter. Every --interval seconds it writes one JSON line with the
+cumulative counters and the rates over the interval, and a last one
+marked "final" when it stops.
+"""
+import argparse
+import ctypes
+import errno
+import json
+import os
+import selectors
 import socket
 import struct
+import sys
+import time
+
+from sender import HEADER, MCAST_GRP, MCAST_PORT, iovec, libc_function, mmsghdr, parse_groups
+
+PER_SOCKET = 20  # net.ipv4.igmp_max_memberships default
+RCVBUF = 8 << 20
+SLOT = 9216  # largest packet read in one piece
+REORDER_WINDOW = 1024  # how far back duplicates are told from late packets
+IP_MULTICAST_ALL = getattr(socket, 'IP_MULTICAST_ALL', 49)
+MSG_DONTWAIT = getattr(socket, 'MSG_DONTWAIT', 0x40)
+
+_recvmmsg = libc_function('recvmmsg', [ctypes.c_int, ctypes.POINTER(mmsghdr), ctypes.c_uint,
+                                       ctypes.c_int, ctypes.c_void_p])
+
+
+class GroupStats(object):
+    """One sender session's stream to a group.
+
+    seen has bit i set when sequence number top - i arrived; anything
+    older than REORDER_WINDOW behind top is counted as reordered without
+    checking for a duplicate.
+    """
+
+    def __init__(self, session, seq):
+        self.session = session
+        self.first = seq
+        self.top = seq - 1
+        self.seen = 0
+        self.received = 0
+        self.bytes = 0
+        self.duplicates = 0
+        self.reordered = 0
+        self.delay_sum = 0.0
+        self.delay_min = None
+        self.delay_max = 0.0
+        self.jitter = 0.0
+        self.transit = None
+        self.last = (0, 0)  # received, bytes at the previous report
+
+    def add(self, seq, sent, now, length):
+        behind = self.top - seq
+        if behind < 0:
+            self.seen = ((self.seen << -behind) | 1) & ((1 << REORDER_WINDOW) - 1)
+            self.top = seq
+        elif behind < REORDER_WINDOW:
+            bit = 1 << behind
+            if self.seen & bit:
+                self.duplicates += 1
+                return
+            self.seen |= bit
+            if behind:
+                self.reordered += 1
+        else:
+            self.reordered += 1
+        if seq < self.first:
+            self.first = seq
+        self.received += 1
+        self.bytes += length
+
+        transit = now - sent
+        self.delay_sum += transit
+        if self.delay_min is None or transit < self.delay_min:
+            self.delay_min = transit
+        if transit > self.delay_max:
+            self.delay_max = transit
+        if self.transit is not None:
+            self.jitter += (abs(transit - self.transit) - self.jitter) / 16
+        self.transit = transit
+
+    @property
+    def lost(self):
+        return self.top - self.first + 1 - self.received
+
+    def report(self, interval):
+        received, nbytes = self.last
+        self.last = (self.received, self.bytes)
+        return {
+            'session': self.session,
+            'received': self.received,
+            'lost': self.lost,
+            'reordered': self.reordered,
+            'duplicates': self.duplicates,
+            'pps': (self.received - received) / interval if interval else 0,
+            'mbps': (self.bytes - nbytes) * 8 / interval / 1e6 if interval else 0,
+            'delay_ms': {
+                'min': ms(self.delay_min),
+                'avg': ms(self.delay_sum / self.received if self.received else None),
+                'max': ms(self.delay_max if self.received else None),
+            },
+            'jitter_ms': ms(self.jitter),
+        }
+
+
+def ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+class Receiver(object):
+    """Joins groups on a set of sockets and keeps a GroupStats per group."""
+
+    def __init__(self, groups, port=MCAST_PORT, per_socket=PER_SOCKET, batch=64, use_recvmmsg=True):
+        self.groups = list(groups)
+        self.batch = batch
+        self.stats = {}  # group address -> GroupStats
+        self.restarts = {}  # group address -> sessions replaced
+        self.malformed = 0
+        self.selector = selectors.DefaultSelector()
+        self.sockets = []
+        for i in range(0, len(self.groups), per_socket):
+            self._open(self.groups[i:i + per_socket], port)
+
+        self.buf = ctypes.create_string_buffer(batch * SLOT)
+        self.view = memoryview(self.buf)
+        self.msgs = None
+        if use_recvmmsg and _recvmmsg is not None:
+            self.iovs = (iovec * batch)()
+            self.msgs = (mmsghdr * batch)()
+            base = ctypes.addressof(self.buf)
+            for i in range(batch):
+                self.iovs[i].iov_base = base + i * SLOT
+                self.iovs[i].iov_len = SLOT
+                self.msgs[i].msg_hdr.msg_iov = ctypes.pointer(self.iovs[i])
+                self.msgs[i].msg_hdr.msg_iovlen = 1
+
+    def _open(self, groups, port):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RCVBUF)
+        try:
+            # only the groups joined on this socket, not every group any
+            # socket on the host joined
+            sock.setsockopt(socket.IPPROTO_IP, IP_MULTICAST_ALL, 0)
+        except OSError:
+            pass
+        sock.bind(('', port))
+        for group in groups:
+            mreq = struct.pack("4sl", socket.inet_aton(group), socket.INADDR_ANY)
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+        sock.setblocking(False)
+        self.selector.register(sock, selectors.EVENT_READ, groups)
+        self.sockets.append(sock)
+
+    def poll(self, timeout):
+        """Wait up to timeout seconds and read what arrived, returns the
+        number of packets."""
+        count = 0
+        for key, _ in self.selector.select(timeout):
+            count += self._drain(key.fileobj)
+        return count
+
+    def _drain(self, sock):
+        count = 0
+        while True:
+            lengths = self._read(sock)
+            if not lengths:
+                return count
+            now = time.time()
+            for i, length in enumerate(lengths):
+                self._packet(i * SLOT, length, now)
+            count += len(lengths)
+            if len(lengths) < self.batch:
+                return count
+
+    def _read(self, sock):
+        if self.msgs is not None:
+            n = _recvmmsg(sock.fileno(), self.msgs, self.batch, MSG_DONTWAIT, None)
+            if n < 0:
+                err = ctypes.get_errno()
+                if err in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                    return []
+                raise OSError(err, os.strerror(err))
+            return [self.msgs[i].msg_len for i in range(n)]
+        lengths = []
+        for i in range(self.batch):
+            try:
+                lengths.append(sock.recv_into(self.view[i * SLOT:(i + 1) * SLOT]))
+            except (BlockingIOError, InterruptedError):
+                break
+        return lengths
+
+    def _packet(self, offset, length, now):
+        if length < HEADER.size:
+            self.malformed += 1
+            return
+        group, session, seq, sent = HEADER.unpack_from(self.buf, offset)
+        stats = self.stats.get(group)
+        if stats is None or stats.session != session:
+            if stats is not None:
+                self.restarts[group] = self.restarts.get(group, 0) + 1
+            stats = self.stats[group] = GroupStats(session, seq)
+        stats.add(seq, sent, now, length)
 
-from sender import MCAST_GRP, MCAST_PORT
+    def report(self, interval, final=False):
+        groups = {}
+        for group, stats in self.stats.items():
+            groups[socket.inet_ntoa(group)] = report = stats.report(interval)
+            report['restarts'] = self.restarts.get(group, 0)
+        silent = sorted(set(self.groups) - set(groups))
+        report = {'time': round(time.time(), 3), 'interval': round(interval, 3),
+                  'groups': groups, 'silent': silent, 'malformed': self.malformed}
+        if final:
+            report['final'] = True
+        return report
 
+    def close(self):
+        for sock in self.sockets:
+            self.selector.unregister(sock)
+            sock.close()
+        self.selector.close()
 
-IS_ALL_GROUPS = True
 
-def do():
-  sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
-  sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-  if IS_ALL_GROUPS:
-      # on this port, receives ALL multicast groups
-      sock.bind(('', MCAST_PORT))
-  else:
-      # on this port, listen ONLY to MCAST_GRP
-      sock.bind((MCAST_GRP, MCAST_PORT))
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('groups', nargs='*', default=[MCAST_GRP], help='addresses or CIDR blocks')
+    parser.add_argument('--port', type=int, default=MCAST_PORT)
+    parser.add_argument('--interval', type=float, default=5.0, help='seconds between reports')
+    parser.add_argument('--duration', type=float, default=None, help='stop after this many seconds')
+    parser.add_argument('--per-socket', type=int, default=PER_SOCKET, help='groups joined per socket')
+    parser.add_argument('--batch', type=int, default=64, help='packets per read call')
+    parser.add_argument('--out', default=None, help='append the reports to this file, stdout by default')
+    parser.add_argument('--no-recvmmsg', action='store_true', help='one recv_into() per packet')
+    args = parser.parse_args(argv)
 
-  mreq = struct.pack("4sl", socket.inet_aton(MCAST_GRP), socket.INADDR_ANY)
+    receiver = Receiver(parse_groups(args.groups), port=args.port, per_socket=args.per_socket,
+                        batch=args.batch, use_recvmmsg=not args.no_recvmmsg)
+    out = open(args.out, 'a') if args.out else sys.stdout
+    start = last = time.time()
+    deadline = start + args.duration if args.duration else None
 
-  sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+    def emit(now, final=False):
+        out.write(json.dumps(receiver.report(now - last, final), sort_keys=True) + '\n')
+        out.flush()
 
-  while True:
-    # For Python 3, change next line to "print(sock.recv(10240))"
-    print(sock.recv(10240))
-    break
+    try:
+        while True:
+            now = time.time()
+            if deadline is not None and now >= deadline:
+                break
+            if now - last >= args.interval:
+                emit(now)
+                last = now
+            wake = last + args.interval
+            if deadline is not None:
+                wake = min(wake, deadline)
+            receiver.poll(max(0, wake - now))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        emit(time.time(), final=True)
+        receiver.close()
+        if out is not sys.stdout:
+            out.close()
 
-  sock.setsockopt(socket.SOL_IP, socket.IP_DROP_MEMBERSHIP, socket.inet_aton(MCAST_GRP) + socket.inet_aton('0.0.0.0'))
 
 if __name__ == '__main__':
-  do()
-  print('# Done!')
-  
+    main()
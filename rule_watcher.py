@@ -0,0 +1,50 @@
+import hashlib
+import json
+import os
+
+
+class RuleWatcher(object):
+    """Watches the rule file by mtime and size, and only re-reads it when
+    those change. The content hash filters out touches that leave the
+    rules as they were."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.stat = None
+        self.digest = None
+
+    def poll(self):
+        """Return the new rules if the file content changed, else None."""
+        try:
+            st = os.stat(self.filename)
+        except OSError:
+            return None
+        stat = (st.st_mtime_ns, st.st_size)
+        if stat == self.stat:
+            return None
+        with open(self.filename, 'rb') as f:
+            data = f.read()
+        digest = hashlib.sha1(data).hexdigest()
+        if digest == self.digest:
+            self.stat = stat
+            return None
+        try:
+            rules = json.loads(data.decode())
+        except ValueError:
+            # the front-end may still be writing the file, retry next poll
+            return None
+        self.stat = stat
+        self.digest = digest
+        return rules
+
+
+def diff_rules(installed, rules):
+    """Compare the installed groups with the wanted ones.
+
+    Returns (added, removed, modified) lists of group names.
+    """
+    added = [name for name in rules if name not in installed]
+    removed = [name for name in installed if name not in rules]
+    modified = [name for name in rules
+                if name in installed and rules[name] != installed[name]]
+    return added, removed, modified
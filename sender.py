@@ -1,4 +1,30 @@
+"""Multicast traffic generator.
+
+    python sender.py                                   one packet to 224.1.10.100
+    python sender.py 224.1.0.0/26 --rate 100000 --duration 30 --size 1000
+    python sender.py 224.1.10.100 224.1.10.101 --rate 2000 --burst 200
+
+Packets are spread round-robin over the groups (a CIDR block stands for
+every address in it), --rate is the total over all of them, 0 for as
+fast as the socket takes them. They leave in bursts of --burst packets
+spaced so the average holds, each burst handed to the kernel --batch
+packets per sendmmsg() call where libc has it.
+
+Every payload starts with HEADER: the group, a per-run session id, the
+group's sequence number and the send time, so receiver.py can work out
+loss, reordering and one-way delay. The rest is filler. The packet
+buffers are built once and only the headers are rewritten per batch.
+"""
+import argparse
+import ctypes
+import ctypes.util
+import errno
+import ipaddress
+import os
 import socket
+import struct
+import sys
+import time
 
 MCAST_GRP = '224.1.10.100'
 MCAST_PORT = 5007
@@ -6,15 +32,221 @@ MCAST_PORT = 5007
 
 # regarding socket.IP_MULTICAST_TTL
 # ---------------------------------
-# for all packets sent, after two hops on the network the packet will not 
+# for all packets sent, after two hops on the network the packet will not
 # be re-sent/broadcast (see https://www.tldp.org/HOWTO/Multicast-HOWTO-6.html)
 
 MULTICAST_TTL = 10
-if __name__ == '__main__':
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
-    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, MULTICAST_TTL)
 
-    # For Python 3, change next line to 'sock.sendto(b"robot", ...' to avoid the
-    # "bytes-like object is required" msg (https://stackoverflow.com/a/42612820)
-    sock.sendto(u"robot".encode(), (MCAST_GRP, MCAST_PORT))
+HEADER = struct.Struct('!4sIQd')  # group, session, sequence number, send time
+FILLER = b'robot'
+SNDBUF = 4 << 20
+UDP_OVERHEAD = 14 + 20 + 8  # Ethernet, IPv4, UDP headers on the wire
+
+
+class iovec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_void_p), ('iov_len', ctypes.c_size_t)]
+
+
+class msghdr(ctypes.Structure):
+    _fields_ = [('msg_name', ctypes.c_void_p), ('msg_namelen', ctypes.c_uint32),
+                ('msg_iov', ctypes.POINTER(iovec)), ('msg_iovlen', ctypes.c_size_t),
+                ('msg_control', ctypes.c_void_p), ('msg_controllen', ctypes.c_size_t),
+                ('msg_flags', ctypes.c_int)]
+
+
+class mmsghdr(ctypes.Structure):
+    _fields_ = [('msg_hdr', msghdr), ('msg_len', ctypes.c_uint)]
+
+
+def libc_function(name, argtypes):
+    """name from libc with argtypes and an int result, None when missing."""
+    try:
+        fn = getattr(ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True), name)
+    except (OSError, AttributeError):
+        return None
+    fn.argtypes = argtypes
+    fn.restype = ctypes.c_int
+    return fn
+
+
+_sendmmsg = libc_function('sendmmsg', [ctypes.c_int, ctypes.POINTER(mmsghdr), ctypes.c_uint, ctypes.c_int])
+
+
+def parse_groups(specs):
+    """Group addresses from addresses and CIDR blocks, in order, once each."""
+    groups = []
+    for spec in specs:
+        net = ipaddress.ip_network(u'%s' % spec, strict=False)
+        if not net.is_multicast:
+            raise ValueError('%s is not a multicast address' % spec)
+        for addr in (net if net.num_addresses > 1 else [net.network_address]):
+            if str(addr) not in groups:
+                groups.append(str(addr))
+    return groups
+
+
+class Sender(object):
+    """Sends numbered packets to a fixed set of groups from reused buffers.
 
+    The batch is a block of batch * size bytes, slot i holding the i-th
+    packet of every send() call. Slots are dealt to the groups
+    round-robin, carrying on from where the previous call stopped.
+    """
+
+    def __init__(self, groups, port=MCAST_PORT, size=64, ttl=MULTICAST_TTL, batch=32,
+                 session=None, use_sendmmsg=True):
+        if size < HEADER.size:
+            raise ValueError('packets need at least %d bytes for the header' % HEADER.size)
+        self.groups = list(groups)
+        self.port = port
+        self.size = size
+        self.batch = batch
+        self.session = session if session is not None else struct.unpack('!I', os.urandom(4))[0]
+        self.seqs = [0] * len(self.groups)
+        self.next_group = 0
+        self.sent = 0
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SNDBUF)
+        self.addrs = [(group, port) for group in self.groups]
+        self.raw_addrs = [socket.inet_aton(group) for group in self.groups]
+
+        filler = (FILLER * (size // len(FILLER) + 1))[:size - HEADER.size]
+        self.buf = ctypes.create_string_buffer((b'\0' * HEADER.size + filler) * batch, batch * size)
+        self.slots = [memoryview(self.buf)[i * size:(i + 1) * size] for i in range(batch)]
+
+        self.msgs = None
+        if use_sendmmsg and _sendmmsg is not None:
+            self._init_mmsg()
+
+    def _init_mmsg(self):
+        # one sockaddr_in per group; slots point at their group's
+        self.names = [ctypes.create_string_buffer(
+            struct.pack('=H', socket.AF_INET) + struct.pack('!H', self.port) + raw + b'\0' * 8, 16)
+            for raw in self.raw_addrs]
+        self.iovs = (iovec * self.batch)()
+        self.msgs = (mmsghdr * self.batch)()
+        base = ctypes.addressof(self.buf)
+        for i in range(self.batch):
+            self.iovs[i].iov_base = base + i * self.size
+            self.iovs[i].iov_len = self.size
+            hdr = self.msgs[i].msg_hdr
+            hdr.msg_namelen = 16
+            hdr.msg_iov = ctypes.pointer(self.iovs[i])
+            hdr.msg_iovlen = 1
+        self.first_group = None
+
+    def _point_names(self, first):
+        # with len(groups) dividing the batch every call starts on the
+        # same group and this only ever runs once
+        if first == self.first_group:
+            return
+        n = len(self.groups)
+        for i in range(self.batch):
+            self.msgs[i].msg_hdr.msg_name = ctypes.addressof(self.names[(first + i) % n])
+        self.first_group = first
+
+    def send(self, count=None):
+        """Send count (at most batch, default batch) packets, returns how many went."""
+        count = self.batch if count is None else min(count, self.batch)
+        n = len(self.groups)
+        first = self.next_group
+        now = time.time()
+        seqs, raw_addrs, session = self.seqs, self.raw_addrs, self.session
+        for i in range(count):
+            g = (first + i) % n
+            HEADER.pack_into(self.buf, i * self.size, raw_addrs[g], session, seqs[g], now)
+            seqs[g] += 1
+        self.next_group = (first + count) % n
+
+        if self.msgs is not None:
+            self._point_names(first)
+            done = 0
+            while done < count:
+                sent = _sendmmsg(self.sock.fileno(), ctypes.byref(self.msgs[done]), count - done, 0)
+                if sent < 0:
+                    err = ctypes.get_errno()
+                    if err in (errno.EINTR, errno.ENOBUFS, errno.EAGAIN):
+                        continue
+                    raise OSError(err, os.strerror(err))
+                done += sent
+        else:
+            for i in range(count):
+                self.sock.sendto(self.slots[i], self.addrs[(first + i) % n])
+        self.sent += count
+        return count
+
+    def close(self):
+        self.sock.close()
+
+
+def run(sender, rate=0, burst=None, count=None, duration=None):
+    """Send at rate packets/s in bursts until count packets or duration
+    seconds are done (forever if neither is given), returns the elapsed
+    time.
+
+    A burst that starts late is sent straight away so the average rate
+    catches up, unless the sender is more than a second behind, which
+    resets the schedule instead of flooding.
+    """
+    burst = burst or sender.batch
+    gap = float(burst) / rate if rate else 0
+    start = next_burst = time.time()
+    deadline = start + duration if duration else None
+    while count is None or sender.sent < count:
+        now = time.time()
+        if deadline is not None and now >= deadline:
+            break
+        if gap:
+            if next_burst - now > 0:
+                time.sleep(next_burst - now)
+            elif now - next_burst > 1:
+                next_burst = now
+            next_burst += gap
+        left = burst if count is None else min(burst, count - sender.sent)
+        while left > 0:
+            left -= sender.send(left)
+    return time.time() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('groups', nargs='*', default=[MCAST_GRP], help='addresses or CIDR blocks')
+    parser.add_argument('--port', type=int, default=MCAST_PORT)
+    parser.add_argument('--rate', type=float, default=0, help='packets/s over all groups, 0 for no limit')
+    parser.add_argument('--size', type=int, default=HEADER.size, help='UDP payload bytes')
+    parser.add_argument('--burst', type=int, default=None, help='packets per burst, --batch by default')
+    parser.add_argument('--batch', type=int, default=32, help='packets per send call')
+    parser.add_argument('--count', type=int, default=None, help='stop after this many packets')
+    parser.add_argument('--duration', type=float, default=None,
+                        help='stop after this many seconds; with neither this, --count nor --rate '
+                             'one packet goes to each group')
+    parser.add_argument('--ttl', type=int, default=MULTICAST_TTL)
+    parser.add_argument('--no-sendmmsg', action='store_true', help='one sendto() per packet')
+    args = parser.parse_args(argv)
+    groups = parse_groups(args.groups)
+    if args.count is None and args.duration is None and not args.rate:
+        # one packet per group, like the original sender
+        args.count = len(groups)
+
+    sender = Sender(groups, port=args.port, size=args.size, ttl=args.ttl,
+                    batch=max(1, min(args.batch, args.count or args.batch)),
+                    use_sendmmsg=not args.no_sendmmsg)
+    start = time.time()
+    try:
+        run(sender, rate=args.rate, burst=args.burst, count=args.count, duration=args.duration)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sender.close()
+    elapsed = time.time() - start
+    if elapsed:
+        pps = sender.sent / elapsed
+        sys.stderr.write('sent %d packets to %d groups in %.2fs: %.0f pps, %.1f Mbit/s on the wire (%s)\n' % (
+            sender.sent, len(groups), elapsed, pps, pps * (args.size + UDP_OVERHEAD) * 8 / 1e6,
+            'sendto' if sender.msgs is None else 'sendmmsg'))
+
+
+if __name__ == '__main__':
+    main()
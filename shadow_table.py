@@ -0,0 +1,334 @@
+import json
+
+
+def match_key(match):
+    return tuple(sorted((name, str(value)) for name, value in match.items()))
+
+
+def _action_key(action):
+    name = type(action).__name__
+    fields = dict(action.to_jsondict()[name])
+    for attr in ('len', 'type', 'max_len'):
+        fields.pop(attr, None)
+    return name + json.dumps(fields, sort_keys=True)
+
+
+def actions_key(actions):
+    return tuple(_action_key(a) for a in actions)
+
+
+def instructions_key(instructions):
+    return tuple((inst.type, actions_key(getattr(inst, 'actions', ()))) for inst in instructions)
+
+
+def outputs(instructions):
+    """(output ports, groups) the instructions send packets to."""
+    ports = set()
+    groups = set()
+    for inst in instructions:
+        for action in getattr(inst, 'actions', ()):
+            if hasattr(action, 'group_id'):
+                groups.add(action.group_id)
+            elif hasattr(action, 'port'):
+                ports.add(action.port)
+    return ports, groups
+
+
+class FlowEntry(object):
+    def __init__(self, table_id, priority, match, instructions, cookie=0,
+                 idle_timeout=0, hard_timeout=0, flags=0):
+        self.table_id = table_id
+        self.priority = priority
+        self.match = match
+        self.instructions = instructions
+        self.cookie = cookie
+        self.idle_timeout = idle_timeout
+        self.hard_timeout = hard_timeout
+        self.flags = flags
+        self.key = (table_id, priority, match_key(match))
+        self.value = instructions_key(instructions)
+        self.ports, self.groups = outputs(instructions)
+
+    @classmethod
+    def from_msg(cls, msg):
+        return cls(msg.table_id, msg.priority, msg.match, msg.instructions, msg.cookie,
+                   msg.idle_timeout, msg.hard_timeout, msg.flags)
+
+    def matches(self, req, strict):
+        """Whether a FlowMod/stats request req selects this entry."""
+        ofproto = req.datapath.ofproto
+        if req.table_id not in (ofproto.OFPTT_ALL, self.table_id):
+            return False
+        if (self.cookie ^ req.cookie) & req.cookie_mask:
+            return False
+        # a MODIFY ignores out_port and out_group, deletes and stats use them
+        if getattr(req, 'command', None) not in (ofproto.OFPFC_MODIFY, ofproto.OFPFC_MODIFY_STRICT):
+            if req.out_port != ofproto.OFPP_ANY and req.out_port not in self.ports:
+                return False
+            if req.out_group != ofproto.OFPG_ANY and req.out_group not in self.groups:
+                return False
+        if strict:
+            return self.key[1:] == (req.priority, match_key(req.match))
+        fields = dict(self.key[2])
+        return all(fields.get(name) == value for name, value in match_key(req.match))
+
+
+class GroupEntry(object):
+    def __init__(self, group_id, type_, buckets):
+        self.group_id = group_id
+        self.type = type_
+        self.buckets = buckets
+        self.value = (type_, tuple(actions_key(b.actions) for b in buckets))
+
+
+class SwitchShadow(object):
+    """Intended and confirmed entries of one switch.
+
+    confirmed is None until the switch has been read back. Keys changed
+    while a read is in flight are replayed onto its result, since the
+    switch answered before it saw those changes.
+    """
+
+    def __init__(self):
+        self.flows = {}
+        self.groups = {}
+        self.confirmed_flows = None
+        self.confirmed_groups = None
+        self.reading = None
+        self.changed = set()
+
+
+def apply_flow_mod(flows, msg):
+    """Apply a FlowMod to {key: FlowEntry}, returns the keys it changed."""
+    ofproto = msg.datapath.ofproto
+    if msg.command == ofproto.OFPFC_ADD:
+        entry = FlowEntry.from_msg(msg)
+        flows[entry.key] = entry
+        return [entry.key]
+    strict = msg.command in (ofproto.OFPFC_MODIFY_STRICT, ofproto.OFPFC_DELETE_STRICT)
+    selected = [e for e in flows.values() if e.matches(msg, strict)]
+    for entry in selected:
+        if msg.command in (ofproto.OFPFC_DELETE, ofproto.OFPFC_DELETE_STRICT):
+            del flows[entry.key]
+        else:
+            entry.instructions = msg.instructions
+            entry.value = instructions_key(msg.instructions)
+            entry.ports, entry.groups = outputs(msg.instructions)
+    return [e.key for e in selected]
+
+
+def apply_group_mod(groups, flows, msg):
+    """Apply a GroupMod to {gid: GroupEntry} and the flows using it."""
+    ofproto = msg.datapath.ofproto
+    if msg.command != ofproto.OFPGC_DELETE:
+        groups[msg.group_id] = GroupEntry(msg.group_id, msg.type, msg.buckets)
+        return [('group', msg.group_id)]
+    gids = list(groups) if msg.group_id == ofproto.OFPG_ALL else [msg.group_id]
+    changed = []
+    for gid in gids:
+        if groups.pop(gid, None) is not None:
+            changed.append(('group', gid))
+        # the switch removes the flows pointing at a deleted group too
+        for entry in [e for e in flows.values() if gid in e.groups]:
+            del flows[entry.key]
+            changed.append(entry.key)
+    return changed
+
+
+class ShadowTable(object):
+    """What every switch should hold and what it was last seen holding.
+
+    Messages the controller sends go through apply(), which updates the
+    intended state and returns the message to actually send, or None when
+    the switch is known to hold that state already. audit() reads the
+    switch back with flow stats and group description requests; once both
+    replies are in, diff() returns the FlowMods and GroupMods that bring
+    the switch to the intended state, including the removal of entries
+    nobody asked for.
+
+    Only flows whose cookie matches cookie under cookie_mask are managed;
+    the rest (learned flows, say) are left to whoever installs them.
+    """
+
+    def __init__(self, cookie=0, cookie_mask=0):
+        self.cookie = cookie
+        self.cookie_mask = cookie_mask
+        self.switches = {}
+
+    def switch(self, dpid):
+        shadow = self.switches.get(dpid)
+        if shadow is None:
+            shadow = self.switches[dpid] = SwitchShadow()
+        return shadow
+
+    def managed(self, cookie):
+        return not (cookie ^ self.cookie) & self.cookie_mask
+
+    def confined(self, msg):
+        """Whether a FlowMod can only select managed flows."""
+        return (msg.cookie_mask & self.cookie_mask == self.cookie_mask
+                and self.managed(msg.cookie))
+
+    def synced(self, dpid):
+        shadow = self.switches.get(dpid)
+        return shadow is not None and shadow.confirmed_flows is not None and shadow.reading is None
+
+    def forget(self, dpid):
+        """The switch went away, what it holds is unknown again."""
+        shadow = self.switch(dpid)
+        shadow.confirmed_flows = shadow.confirmed_groups = None
+        shadow.reading = None
+
+    # intended state
+
+    def apply(self, dp, msg):
+        parser = dp.ofproto_parser
+        if isinstance(msg, parser.OFPFlowMod):
+            if not self._flow_managed(dp, msg):
+                return msg
+            needed = self._flow_needed(dp, msg)
+            mutate = lambda flows, groups: apply_flow_mod(flows, msg)
+        elif isinstance(msg, parser.OFPGroupMod):
+            needed = self._group_needed(dp, msg)
+            mutate = lambda flows, groups: apply_group_mod(groups, flows, msg)
+        else:
+            return msg
+        shadow = self.switch(dp.id)
+        changed = mutate(shadow.flows, shadow.groups)
+        if not needed:
+            return None
+        if shadow.reading is not None:
+            shadow.changed.update(changed)
+        if shadow.confirmed_flows is not None:
+            mutate(shadow.confirmed_flows, shadow.confirmed_groups)
+        return msg
+
+    def _flow_managed(self, dp, msg):
+        ofproto = dp.ofproto
+        if msg.command in (ofproto.OFPFC_DELETE, ofproto.OFPFC_DELETE_STRICT):
+            return True
+        return self.managed(msg.cookie) and msg.buffer_id == ofproto.OFP_NO_BUFFER
+
+    def _flow_needed(self, dp, msg):
+        ofproto = dp.ofproto
+        confirmed = self.switch(dp.id).confirmed_flows
+        if confirmed is None:
+            return True
+        if msg.command == ofproto.OFPFC_ADD:
+            entry = FlowEntry.from_msg(msg)
+            old = confirmed.get(entry.key)
+            return old is None or old.value != entry.value
+        if msg.command in (ofproto.OFPFC_DELETE, ofproto.OFPFC_DELETE_STRICT):
+            if not self.confined(msg):
+                return True
+            strict = msg.command == ofproto.OFPFC_DELETE_STRICT
+            return any(e.matches(msg, strict) for e in confirmed.values())
+        return True
+
+    def _group_needed(self, dp, msg):
+        ofproto = dp.ofproto
+        confirmed = self.switch(dp.id).confirmed_groups
+        if confirmed is None:
+            return True
+        if msg.command == ofproto.OFPGC_DELETE:
+            return msg.group_id == ofproto.OFPG_ALL or msg.group_id in confirmed
+        old = confirmed.get(msg.group_id)
+        if old is not None and old.value == GroupEntry(msg.group_id, msg.type, msg.buckets).value:
+            return False
+        # ADD on an existing id fails, and so does MODIFY on a missing one
+        msg.command = ofproto.OFPGC_MODIFY if old is not None else ofproto.OFPGC_ADD
+        return True
+
+    # confirmed state
+
+    def audit(self, dp):
+        """Ask the switch for its flows and groups."""
+        ofproto = dp.ofproto
+        parser = dp.ofproto_parser
+        shadow = self.switch(dp.id)
+        shadow.reading = {'flows': {}, 'groups': {}, 'pending': set(['flows', 'groups'])}
+        shadow.changed = set()
+        dp.send_msg(parser.OFPFlowStatsRequest(dp, 0, ofproto.OFPTT_ALL, ofproto.OFPP_ANY,
+                                               ofproto.OFPG_ANY, self.cookie, self.cookie_mask,
+                                               parser.OFPMatch()))
+        dp.send_msg(parser.OFPGroupDescStatsRequest(dp, 0))
+
+    def flow_stats_reply(self, msg):
+        """Feed an OFPFlowStatsReply, True once the whole read is in."""
+        reading = self.switch(msg.datapath.id).reading
+        if reading is None:
+            return False
+        for stat in msg.body:
+            entry = FlowEntry.from_msg(stat)
+            reading['flows'][entry.key] = entry
+        return self._part_done(msg, 'flows')
+
+    def group_desc_reply(self, msg):
+        reading = self.switch(msg.datapath.id).reading
+        if reading is None:
+            return False
+        for stat in msg.body:
+            reading['groups'][stat.group_id] = GroupEntry(stat.group_id, stat.type, stat.buckets)
+        return self._part_done(msg, 'groups')
+
+    def _part_done(self, msg, part):
+        if msg.flags & msg.datapath.ofproto.OFPMPF_REPLY_MORE:
+            return False
+        shadow = self.switch(msg.datapath.id)
+        reading = shadow.reading
+        reading['pending'].discard(part)
+        if reading['pending']:
+            return False
+        shadow.confirmed_flows = reading['flows']
+        shadow.confirmed_groups = reading['groups']
+        for key in shadow.changed:
+            if key[0] == 'group':
+                if key[1] in shadow.groups:
+                    shadow.confirmed_groups[key[1]] = shadow.groups[key[1]]
+                else:
+                    shadow.confirmed_groups.pop(key[1], None)
+            elif key in shadow.flows:
+                shadow.confirmed_flows[key] = shadow.flows[key]
+            else:
+                shadow.confirmed_flows.pop(key, None)
+        shadow.reading = None
+        shadow.changed = set()
+        return True
+
+    def diff(self, dp):
+        """Messages bringing the switch from confirmed to intended state:
+        groups first, then flows, then the removal of stray groups."""
+        ofproto = dp.ofproto
+        parser = dp.ofproto_parser
+        shadow = self.switch(dp.id)
+        if shadow.confirmed_flows is None or shadow.reading is not None:
+            return []
+        groups, flows, stray = [], [], []
+        for gid, entry in shadow.groups.items():
+            old = shadow.confirmed_groups.get(gid)
+            if old is None or old.value != entry.value:
+                command = ofproto.OFPGC_ADD if old is None else ofproto.OFPGC_MODIFY
+                groups.append(parser.OFPGroupMod(dp, command, entry.type, gid, entry.buckets))
+                shadow.confirmed_groups[gid] = entry
+        for gid in list(shadow.confirmed_groups):
+            if gid not in shadow.groups:
+                stray.append(parser.OFPGroupMod(dp, ofproto.OFPGC_DELETE, ofproto.OFPGT_ALL, gid, []))
+                del shadow.confirmed_groups[gid]
+        for key, entry in shadow.flows.items():
+            old = shadow.confirmed_flows.get(key)
+            if old is None or old.value != entry.value:
+                flows.append(parser.OFPFlowMod(
+                    datapath=dp, cookie=entry.cookie, table_id=entry.table_id,
+                    idle_timeout=entry.idle_timeout, hard_timeout=entry.hard_timeout,
+                    priority=entry.priority, flags=entry.flags, match=entry.match,
+                    instructions=entry.instructions))
+                shadow.confirmed_flows[key] = entry
+        for key, old in list(shadow.confirmed_flows.items()):
+            if key not in shadow.flows and self.managed(old.cookie):
+                flows.append(parser.OFPFlowMod(
+                    datapath=dp, cookie=old.cookie, cookie_mask=0xffffffffffffffff,
+                    table_id=old.table_id, command=ofproto.OFPFC_DELETE_STRICT,
+                    priority=old.priority, out_port=ofproto.OFPP_ANY,
+                    out_group=ofproto.OFPG_ANY, match=old.match))
+                del shadow.confirmed_flows[key]
+        return groups + flows + stray
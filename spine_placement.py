@@ -0,0 +1,148 @@
+import hashlib
+
+# a group nobody measured yet still weighs this much (bit/s), so "pack"
+# spreads those by count instead of stacking them on one spine
+MIN_DEMAND = 1.0
+
+
+def find_spines(topo):
+    """The netconf "spines" list or else the switches farthest from any
+    host, none when every switch has hosts (a flat topology)."""
+    spines = topo.config.get("spines")
+    if spines is not None:
+        return sorted(spines)
+    tier = dict((switch, 0) for switch, _ in topo.hosts.values())
+    frontier = sorted(tier)
+    while frontier:
+        nxt = []
+        for u in frontier:
+            for v in sorted(topo.neighbors(u)):
+                if v not in tier:
+                    tier[v] = tier[u] + 1
+                    nxt.append(v)
+        frontier = nxt
+    top = max(tier.values() or [0])
+    return sorted(s for s, t in tier.items() if t == top) if top else []
+
+
+def _score(group, spine):
+    return hashlib.md5(("%s/%s" % (group, spine)).encode()).digest()
+
+
+class SpinePlacement(object):
+    """Which spines each multicast group's tree may cross, width of them.
+
+    "hash" mode uses rendezvous hashing: a group takes the spines that
+    score highest for it, so a spine coming or going only moves the
+    groups that win or lose it.
+
+    "pack" mode places a group on the least loaded spines, where a
+    spine's load is the measured rate of the groups on it, split evenly
+    across each group's spines. When the spines change, the groups of a
+    lost spine are packed onto the rest. Then groups move from the
+    busiest spine to the idlest for as long as that evens them out.
+    """
+
+    def __init__(self, spines, mode="hash", width=1, demand=None):
+        self.known = set(spines)
+        self.spines = sorted(spines)
+        self.mode = mode
+        self.width = width
+        self.demand = demand or (lambda group: 0.0)
+        self.placed = {}  # group -> sorted spines
+
+    def spines_for(self, group):
+        placed = self.placed.get(group)
+        if placed is None:
+            placed = self.placed[group] = self._choose(group, self.spines)
+        return placed
+
+    def avoid(self, group):
+        """Spines the group's tree must not cross, dead ones included."""
+        return self.known - set(self.spines_for(group))
+
+    def release(self, group):
+        self.placed.pop(group, None)
+
+    def weight(self, group):
+        return max(self.demand(group), MIN_DEMAND)
+
+    def load(self):
+        load = dict((spine, 0.0) for spine in self.spines)
+        for group, spines in self.placed.items():
+            for spine in spines:
+                if spine in load:
+                    load[spine] += self.weight(group) / len(spines)
+        return load
+
+    def _choose(self, group, spines, count=None):
+        count = min(self.width if count is None else count, len(spines))
+        if self.mode == "hash":
+            ranked = sorted(spines, key=lambda s: _score(group, s), reverse=True)
+        else:
+            load = self.load()
+            ranked = sorted(spines, key=lambda s: (load.get(s, 0.0), s))
+        return sorted(ranked[:count])
+
+    def set_spines(self, spines):
+        """The live spines are now spines, returns the groups placed
+        elsewhere than before."""
+        before = dict(self.placed)
+        self.known.update(spines)
+        self.spines = sorted(spines)
+        if self.mode == "hash":
+            for group in self.placed:
+                self.placed[group] = self._choose(group, self.spines)
+        else:
+            live = set(self.spines)
+            for group in sorted(self.placed, key=self.weight, reverse=True):
+                kept = [s for s in self.placed[group] if s in live]
+                missing = min(self.width, len(live)) - len(kept)
+                if missing > 0:
+                    del self.placed[group]
+                    extra = self._choose(group, sorted(live - set(kept)), missing)
+                    self.placed[group] = sorted(kept + extra)
+            self._even_out()
+        return self._moved(before)
+
+    def rebalance(self):
+        """Even the spines out by the rates measured since the groups were
+        placed, returns the groups moved. Only "pack" mode moves any."""
+        before = dict(self.placed)
+        if self.mode == "pack":
+            self._even_out()
+        return self._moved(before)
+
+    def _moved(self, before):
+        return sorted(g for g, spines in self.placed.items() if spines != before.get(g))
+
+    def _even_out(self):
+        # move a group onto the idlest spine from the busiest one that has
+        # a group to give without becoming the idler of the two, until
+        # none has
+        for _ in range(len(self.placed)):
+            load = self.load()
+            if len(load) < 2:
+                return
+            lo = min(load, key=lambda s: (load[s], s))
+            move = None
+            for hi in sorted(load, key=lambda s: (load[s], s), reverse=True):
+                move = self._best_move(load, hi, lo)
+                if move is not None:
+                    break
+            if move is None:
+                return
+            self.placed[move] = sorted([lo if s == hi else s for s in self.placed[move]])
+
+    def _best_move(self, load, hi, lo):
+        # the group on hi whose move to lo comes closest to splitting
+        # the difference between them
+        best = None
+        for group, spines in sorted(self.placed.items()):
+            if hi not in spines or lo in spines:
+                continue
+            share = self.weight(group) / len(spines)
+            miss = abs(share - (load[hi] - load[lo]) / 2)
+            if load[lo] + share < load[hi] and (best is None or miss < best[0]):
+                best = (miss, group)
+        return best[1] if best is not None else None
@@ -0,0 +1,292 @@
+import json
+import os
+import time
+
+from shadow_table import match_key
+
+
+class Ring(object):
+    """The last size items, oldest first, in a list allocated up front."""
+
+    def __init__(self, size):
+        self.items = [None] * size
+        self.size = size
+        self.count = 0
+
+    def append(self, item):
+        self.items[self.count % self.size] = item
+        self.count += 1
+
+    def last(self):
+        return self.items[(self.count - 1) % self.size] if self.count else None
+
+    def __len__(self):
+        return min(self.count, self.size)
+
+    def __iter__(self):
+        for i in range(self.count - len(self), self.count):
+            yield self.items[i % self.size]
+
+
+class Counter(object):
+    """Rates of one cumulative packet/byte counter, (time, pps, bps) samples."""
+
+    def __init__(self, history):
+        self.prev = None
+        self.rates = Ring(history)
+
+    def update(self, now, packets, nbytes):
+        prev = self.prev
+        self.prev = (now, packets, nbytes)
+        # nothing to compare with yet, or the entry was replaced and
+        # its counters started over
+        if prev is None or now <= prev[0] or packets < prev[1]:
+            return None
+        elapsed = now - prev[0]
+        rate = (now, (packets - prev[1]) / elapsed, (nbytes - prev[2]) * 8 / elapsed)
+        self.rates.append(rate)
+        return rate
+
+    @property
+    def pps(self):
+        last = self.rates.last()
+        return last[1] if last else 0.0
+
+    @property
+    def bps(self):
+        last = self.rates.last()
+        return last[2] if last else 0.0
+
+
+class SwitchStats(object):
+    def __init__(self, interval):
+        self.interval = interval
+        self.next_poll = 0
+        self.pending = {}  # xid -> body collected so far
+        self.flows = {}  # match key -> Counter
+        self.groups = {}  # group id -> Counter
+        self.buckets = {}  # group id -> [Counter per bucket]
+        self.ports = {}  # port number -> Counter of what it transmits
+        self.pps = 0.0
+        self.polled = 0
+
+
+class StatsCollector(object):
+    """Per-group packet and byte rates from the switches' own counters.
+
+    poll() sends a flow stats request for the IPv4 flows under cookie /
+    cookie_mask, a group stats and a port stats request to every switch
+    that is due. The counters in the replies become rates, of which the
+    last samples are kept per flow, per group entry and per port. A
+    switch forwarding more than busy_pps is polled twice as often after
+    each poll, down to min_interval; a quieter one 1.5 times less often,
+    up to max_interval.
+
+    Multicast groups are told apart by the match of their flows, given
+    with track(). Group entries can be shared by several multicast
+    groups, so their counters, bucket by bucket, are reported per entry.
+    """
+
+    def __init__(self, cookie=0, cookie_mask=0, min_interval=1.0, max_interval=16.0,
+                 busy_pps=1000, samples=60):
+        self.cookie = cookie
+        self.cookie_mask = cookie_mask
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.busy_pps = busy_pps
+        self.samples = samples
+        self.switches = {}
+        self.keys = {}  # multicast group -> match key of its flows
+
+    def switch(self, dpid):
+        stats = self.switches.get(dpid)
+        if stats is None:
+            stats = self.switches[dpid] = SwitchStats(self.min_interval)
+        return stats
+
+    def track(self, group, match):
+        self.keys[group] = match_key(match)
+
+    def untrack(self, group):
+        self.keys.pop(group, None)
+
+    def forget(self, dpid):
+        self.switches.pop(dpid, None)
+
+    # polling
+
+    def poll(self, datapaths, now=None):
+        """Send requests to the switches that are due, returns their dpids."""
+        now = now or time.time()
+        polled = []
+        for dpid, dp in datapaths.items():
+            stats = self.switch(dpid)
+            # a switch still answering the last poll is not asked again,
+            # unless the replies are so late they are not coming
+            if now < stats.next_poll or (stats.pending and now - stats.polled < self.max_interval):
+                continue
+            stats.pending = {}
+            ofproto = dp.ofproto
+            parser = dp.ofproto_parser
+            requests = [
+                parser.OFPFlowStatsRequest(dp, 0, ofproto.OFPTT_ALL, ofproto.OFPP_ANY,
+                                           ofproto.OFPG_ANY, self.cookie, self.cookie_mask,
+                                           parser.OFPMatch(eth_type=0x0800)),
+                parser.OFPGroupStatsRequest(dp, 0, ofproto.OFPG_ALL),
+                parser.OFPPortStatsRequest(dp, 0, ofproto.OFPP_ANY),
+            ]
+            for req in requests:
+                dp.send_msg(req)
+                stats.pending[req.xid] = []
+            stats.polled = now
+            stats.next_poll = now + stats.interval
+            polled.append(dpid)
+        return polled
+
+    def _collect(self, msg):
+        # the reply's body once it is complete, None for partial replies
+        # and for requests poll() did not send
+        stats = self.switches.get(msg.datapath.id)
+        if stats is None or msg.xid not in stats.pending:
+            return stats, None
+        body = stats.pending[msg.xid]
+        body.extend(msg.body)
+        if msg.flags & msg.datapath.ofproto.OFPMPF_REPLY_MORE:
+            return stats, None
+        del stats.pending[msg.xid]
+        return stats, body
+
+    def flow_stats_reply(self, msg, now=None):
+        """Feed an OFPFlowStatsReply, True if it answers one of ours."""
+        stats, body = self._collect(msg)
+        if body is None:
+            return stats is not None and msg.xid in stats.pending
+        now = now or time.time()
+        flows = {}
+        total = 0.0
+        for stat in body:
+            key = match_key(stat.match)
+            counter = flows[key] = stats.flows.get(key) or Counter(self.samples)
+            counter.update(now, stat.packet_count, stat.byte_count)
+            total += counter.pps
+        # flows that are gone take their history with them
+        stats.flows = flows
+        stats.pps = total
+        if total >= self.busy_pps:
+            stats.interval = max(self.min_interval, stats.interval / 2)
+        else:
+            stats.interval = min(self.max_interval, stats.interval * 1.5)
+        return True
+
+    def group_stats_reply(self, msg, now=None):
+        """Feed an OFPGroupStatsReply, True if it answers one of ours."""
+        stats, body = self._collect(msg)
+        if body is None:
+            return stats is not None and msg.xid in stats.pending
+        now = now or time.time()
+        groups, buckets = {}, {}
+        for stat in body:
+            counter = groups[stat.group_id] = stats.groups.get(stat.group_id) or Counter(self.samples)
+            counter.update(now, stat.packet_count, stat.byte_count)
+            old = stats.buckets.get(stat.group_id, [])
+            if len(old) != len(stat.bucket_stats):
+                old = [Counter(self.samples) for _ in stat.bucket_stats]
+            for bucket, counter in zip(stat.bucket_stats, old):
+                counter.update(now, bucket.packet_count, bucket.byte_count)
+            buckets[stat.group_id] = old
+        stats.groups = groups
+        stats.buckets = buckets
+        return True
+
+    def port_stats_reply(self, msg, now=None):
+        """Feed an OFPPortStatsReply, True if it answers one of ours."""
+        stats, body = self._collect(msg)
+        if body is None:
+            return stats is not None and msg.xid in stats.pending
+        now = now or time.time()
+        ports = {}
+        for stat in body:
+            counter = ports[stat.port_no] = stats.ports.get(stat.port_no) or Counter(self.samples)
+            counter.update(now, stat.tx_packets, stat.tx_bytes)
+        stats.ports = ports
+        return True
+
+    # queries
+
+    def group_rates(self, group):
+        """{dpid: (pps, bps)} of the group's flow on every switch it is on."""
+        key = self.keys.get(group)
+        rates = {}
+        for dpid, stats in self.switches.items():
+            counter = stats.flows.get(key)
+            if counter is not None:
+                rates[dpid] = (counter.pps, counter.bps)
+        return rates
+
+    def rate(self, group):
+        """(pps, bps) the group carries, as seen on its busiest switch,
+        which is the source's unless packets get lost in the tree."""
+        return max(list(self.group_rates(group).values()) or [(0.0, 0.0)])
+
+    def rates(self):
+        """{group: (pps, bps)} for every tracked group."""
+        return dict((group, self.rate(group)) for group in self.keys)
+
+    def hot(self, n=10):
+        """The n groups carrying the most bytes, [(group, pps, bps)]."""
+        ranked = sorted(((group, pps, bps) for group, (pps, bps) in self.rates().items()),
+                        key=lambda item: item[2], reverse=True)
+        return ranked[:n]
+
+    def history(self, group, dpid=None):
+        """[(time, pps, bps)] of the group on dpid, its busiest switch by
+        default, oldest first."""
+        key = self.keys.get(group)
+        if dpid is None:
+            rates = self.group_rates(group)
+            if not rates:
+                return []
+            dpid = max(rates, key=lambda d: rates[d][1])
+        stats = self.switches.get(dpid)
+        counter = stats.flows.get(key) if stats is not None else None
+        return list(counter.rates) if counter is not None else []
+
+    def buckets(self, dpid):
+        """{group id: {pps, bps, buckets: [pps per bucket], idle: [bucket
+        indexes that carried nothing]}} of the entries on dpid."""
+        stats = self.switches.get(dpid)
+        if stats is None:
+            return {}
+        entries = {}
+        for gid, counter in stats.groups.items():
+            bucket_pps = [c.pps for c in stats.buckets.get(gid, [])]
+            entries[gid] = {'pps': counter.pps, 'bps': counter.bps, 'buckets': bucket_pps,
+                            'idle': [i for i, pps in enumerate(bucket_pps) if not pps]}
+        return entries
+
+    def port_rate(self, dpid, port_no):
+        """(time of the last sample, pps, bps) the port transmits, None
+        before two samples are in."""
+        stats = self.switches.get(dpid)
+        counter = stats.ports.get(port_no) if stats is not None else None
+        return counter.rates.last() if counter is not None else None
+
+    def snapshot(self):
+        """Everything above as one JSON-friendly dict."""
+        return {
+            'time': time.time(),
+            'groups': dict((group, {'pps': pps, 'bps': bps,
+                                    'switches': dict((str(dpid), rate) for dpid, rate
+                                                     in self.group_rates(group).items())})
+                           for group, (pps, bps) in self.rates().items()),
+            'switches': dict((str(dpid), {'pps': stats.pps, 'interval': stats.interval,
+                                          'entries': dict((str(gid), entry) for gid, entry
+                                                          in self.buckets(dpid).items())})
+                             for dpid, stats in self.switches.items()),
+        }
+
+    def save(self, filename):
+        tmp = filename + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp, filename)
@@ -0,0 +1,21 @@
+import os
+import sys
+
+# the modules live at the top of the repository, not in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+
+@pytest.fixture
+def fresh_modules():
+    """Drop the modules that index netconf.json at import, so an app
+    loaded by emulate.py reads the netconf of the test."""
+    for name in ('group_table', 'controller'):
+        sys.modules.pop(name, None)
+    import topology
+    topology._cache.clear()
+    yield
+    for name in ('group_table', 'controller'):
+        sys.modules.pop(name, None)
+    topology._cache.clear()
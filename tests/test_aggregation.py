@@ -0,0 +1,64 @@
+import gen_config
+from aggregation import FIRST_TAG, Aggregator
+from topology import Topology
+
+
+def aggregator(**kwargs):
+    return Aggregator(Topology(gen_config.leaf_spine(2, 2, racks=2, hosts=2)), **kwargs)
+
+
+def assign(agg, group, source, targets):
+    return agg.assign(group, source, targets, dict(eth_type=0x0800, ipv4_dst=group))
+
+
+def test_groups_share_a_tree_within_max_leak():
+    agg = aggregator(max_trees=2, max_leak=0.5)
+    wide = assign(agg, 'g1', 'H0m0m0', ['H0m1m0', 'H1m0m0', 'H1m1m0'])
+    assert wide.tag == FIRST_TAG
+    assert wide.edges == set(['T0m0', 'T0m1', 'T1m0', 'T1m1'])
+    # reaches one edge switch for nothing per three it needs
+    assert assign(agg, 'g2', 'H0m0m0', ['H0m1m0', 'H1m0m0']) is wide
+    # two for two is over max_leak, so it gets a tree of its own
+    narrow = assign(agg, 'g3', 'H0m0m0', ['H0m1m0'])
+    assert narrow is not wide and narrow.tag == FIRST_TAG + 1
+    assert narrow.edges == set(['T0m0', 'T0m1'])
+    # with no tree left to add, the one needing the fewest extra edges takes it
+    assert assign(agg, 'g4', 'H1m0m0', ['H1m1m0']) is wide
+    assert len(agg.trees) == 2
+    # a group behind one edge switch needs no core tree
+    assert assign(agg, 'g5', 'H0m0m0', ['H0m0m1']) is None
+
+
+def test_a_lax_max_leak_merges_everything():
+    agg = aggregator(max_leak=1.0)
+    wide = assign(agg, 'g1', 'H0m0m0', ['H0m1m0', 'H1m0m0', 'H1m1m0'])
+    assert assign(agg, 'g2', 'H0m0m0', ['H0m1m0']) is wide
+    assert agg.trees == [wide]
+
+
+def test_full_trees_are_extended():
+    agg = aggregator(max_trees=1, max_leak=0.5)
+    tree = assign(agg, 'g1', 'H0m0m0', ['H0m1m0'])
+    assert assign(agg, 'g2', 'H1m0m0', ['H1m1m0']) is tree
+    assert tree.edges == set(['T0m0', 'T0m1', 'T1m0', 'T1m1'])
+    assert sorted(tree.groups) == ['g1', 'g2']
+
+
+def test_tags_of_removed_trees_are_reused():
+    agg = aggregator(max_leak=0.0)
+    first = assign(agg, 'g1', 'H0m0m0', ['H0m1m0'])
+    second = assign(agg, 'g2', 'H1m0m0', ['H1m1m0'])
+    assert (first.tag, second.tag) == (FIRST_TAG, FIRST_TAG + 1)
+    # a tree goes with its last group
+    assign(agg, 'g3', 'H0m1m0', ['H0m0m0'])
+    agg.remove('g1')
+    assert first in agg.trees
+    agg.remove('g3')
+    assert agg.trees == [second]
+    agg.remove('g3')
+    # and the lowest free tag is handed out again
+    assert assign(agg, 'g4', 'H0m0m0', ['H1m1m0']).tag == FIRST_TAG
+    # a group moving to a new tree gives its old one up first
+    moved = assign(agg, 'g2', 'H1m0m0', ['H0m1m0'])
+    assert moved is not second and moved.tag == FIRST_TAG + 1
+    assert sorted(t.tag for t in agg.trees) == [FIRST_TAG, FIRST_TAG + 1]
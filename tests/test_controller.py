@@ -0,0 +1,143 @@
+import json
+import sys
+
+import pytest
+
+pytest.importorskip("ryu")
+
+import emulate
+import gen_config
+from mac_table import mac_to_int
+
+
+def config_and_rules():
+    config = gen_config.leaf_spine(2, 2, racks=2, hosts=2)
+    rules = gen_config.make_groups(config, 4, fanout='uniform:2:4', seed=1)
+    return config, rules
+
+
+def flows(emulator, switch):
+    dp = emulator.datapaths[emulator.topology.switch_dpid(switch)]
+    return list(dp.flows.values())
+
+
+def stream_flows(emulator, switch, info):
+    src = emulator.topology.host_ip(info["source"])
+    return [e for e in flows(emulator, switch)
+            if e.match.get("ipv4_src") == src and e.match.get("ipv4_dst") == info["multicast_address"]]
+
+
+def test_group_flows_match_the_group_address(fresh_modules):
+    config, rules = config_and_rules()
+    emulator = emulate.run('controller', dict(config, multicast_groups=rules), rules)
+    for info in rules.values():
+        switch = emulator.topology.host_switch(info["source"])
+        entries = stream_flows(emulator, switch, info)
+        # the group's own entry, and the source's drop entry is gone
+        assert [len(e.groups) for e in entries] == [1]
+
+
+def test_streams_are_held_until_their_group_is_added(fresh_modules):
+    config, rules = config_and_rules()
+    added = dict(list(sorted(rules.items()))[:2])
+    emulator = emulate.run('controller', dict(config, multicast_groups=rules), added)
+    for group, info in rules.items():
+        switch, port = emulator.topology.host_port(info["source"])
+        entries = stream_flows(emulator, switch, info)
+        if group in added:
+            assert all(e.groups for e in entries)
+        else:
+            # nothing but the drop on the source's port
+            assert len(entries) == 1
+            assert entries[0].match.get("in_port") == port
+            assert not entries[0].groups and not entries[0].ports
+
+
+
+def test_moved_host_is_rebound_and_its_flows_dropped(fresh_modules):
+    config, rules = config_and_rules()
+    emulator = emulate.Emulator('controller', dict(config, multicast_groups={}))
+    try:
+        emulator.start()
+        topo = emulator.topology
+        switch, port = topo.host_port('H0m0m0')
+        other = topo.host_port('H0m0m1')[1]
+        emulator.event({"op": "switch_enter", "switch": switch})
+        dp = emulator.datapaths[topo.switch_dpid(switch)]
+        frame = emulate.multicast_frame(topo.host_ip('H0m0m0'), '239.1.0.1').hex()
+        emulator.event({"op": "packet_in", "switch": switch, "port": port, "data": frame})
+        table = emulator.app.mac_tables.table(dp.id)
+        mac = mac_to_int(emulate.host_mac(topo.host_ip('H0m0m0')))
+        assert table.lookup(mac) == port
+        flow_mods = dp.counts['OFPFlowMod']
+        emulator.event({"op": "packet_in", "switch": switch, "port": other, "data": frame})
+        assert table.lookup(mac) == other
+        # the learned flows towards the old port are deleted
+        assert dp.counts['OFPFlowMod'] == flow_mods + 1
+    finally:
+        emulator.close()
+
+
+def group_state(emulator):
+    return dict((dpid, sorted(e.value for e in dp.groups.values()))
+                for dpid, dp in emulator.datapaths.items())
+
+
+def crossed_links(group_table, depth):
+    """The switch links depth hops below the sources of the installed trees."""
+    links = set()
+    for _, tree in group_table.trees.values():
+        for u, v in tree.edges():
+            if tree.depth(v) == depth:
+                links.add((u, v))
+    return sorted(links)
+
+
+def round_trip(emulator, group_table, links):
+    before = group_state(emulator)
+    buckets = dict((g, t.buckets) for g, (_, t) in group_table.trees.items())
+    for u, v in links:
+        emulator.event({"op": "link_down", "switch": u, "peer": v})
+    down = set(frozenset(link) for link in links)
+    assert group_table.backups.repaired
+    for _, tree in group_table.trees.values():
+        assert not down & set(frozenset(edge) for edge in tree.edges())
+    assert group_state(emulator) != before
+    for u, v in links:
+        emulator.event({"op": "link_up", "switch": u, "peer": v})
+    assert not group_table.backups.repaired
+    assert dict((g, t.buckets) for g, (_, t) in group_table.trees.items()) == buckets
+    assert group_state(emulator) == before
+
+
+def test_fail_over_and_restore_round_trip(fresh_modules):
+    config, rules = config_and_rules()
+    emulator = emulate.Emulator('controller', dict(config, multicast_groups=rules))
+    try:
+        emulator.start()
+        for dpid in sorted(emulator.topology.switches):
+            emulator.event({"op": "switch_enter", "switch": emulator.topology.switches[dpid]})
+        emulator.install_rules(rules)
+        group_table = sys.modules['group_table']
+        # a ToR-leaf link and a leaf-spine one, one at a time and then together
+        for link in crossed_links(group_table, 1)[:1] + crossed_links(group_table, 2)[:1]:
+            round_trip(emulator, group_table, [link])
+        round_trip(emulator, group_table,
+                   crossed_links(group_table, 1)[:1] + crossed_links(group_table, 2)[:1])
+    finally:
+        emulator.close()
+
+
+def test_missed_delay_bound_is_reported(fresh_modules, tmp_path, monkeypatch, capsys):
+    config = gen_config.leaf_spine(2, 2, racks=2, hosts=2)
+    for u, attrs in config["link_attrs"].items():
+        for v, attr in attrs.items():
+            attr["delay"] = 5 if v.startswith("S") else 1
+    info = {"source": "H0m0m0", "targets": ["H0m1m0", "H1m1m0"], "multicast_address": "239.1.0.1",
+            "tree": "delay", "max_delay": 10}
+    with open(str(tmp_path / "netconf.json"), "w") as f:
+        json.dump(dict(config, multicast_groups={"g1": info}), f)
+    monkeypatch.chdir(tmp_path)
+    import group_table
+    group_table.new_tree("g1")
+    assert "group g1 misses max_delay=10 ms at T1m1" in capsys.readouterr().out
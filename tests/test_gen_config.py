@@ -0,0 +1,14 @@
+import ipaddress
+
+import gen_config
+
+
+def test_group_addresses_are_administratively_scoped():
+    config = gen_config.leaf_spine(2, 2, racks=2, hosts=2)
+    rules = gen_config.make_groups(config, 300, seed=1)
+    trace = gen_config.make_churn(config, rules, 200, group_churn=0.5, seed=1)
+    addresses = [info["multicast_address"] for info in rules.values()]
+    addresses += [e["info"]["multicast_address"] for e in trace if e["op"] == "add"]
+    scope = ipaddress.ip_network(u'239.0.0.0/8')
+    assert all(ipaddress.ip_address(u'%s' % a) in scope for a in addresses)
+    assert len(set(addresses[:300])) == 300
@@ -0,0 +1,84 @@
+from group_ids import GroupIds, SharedGroups
+
+
+def test_groups_with_the_same_ports_share_one_entry():
+    shared = SharedGroups(GroupIds())
+    gid, command, moved, stale = shared.bind("L0", "g1", [2, 1])
+    assert (command, moved, stale) == ("add", True, None)
+    assert shared.bind("L0", "g2", [1, 2]) == (gid, None, True, None)
+    assert shared.bind("L0", "g1", [1, 2]) == (gid, None, False, None)
+    assert shared.entries("L0") == {gid: [1, 2]}
+    # the entry stays while a user is left, and goes with the last one
+    assert shared.unbind("L0", "g1") == (gid, None)
+    assert shared.entries("L0") == {gid: [1, 2]}
+    assert shared.unbind("L0", "g2") == (gid, gid)
+    assert shared.entries("L0") == {}
+    assert shared.unbind("L0", "g2") == (None, None)
+
+
+def test_only_user_takes_its_entry_along():
+    shared = SharedGroups(GroupIds())
+    gid = shared.bind("L0", "g1", [1])[0]
+    assert shared.bind("L0", "g1", [1, 3]) == (gid, "modify", False, None)
+    assert shared.entries("L0") == {gid: [1, 3]}
+
+
+def test_shared_user_moves_to_a_new_entry():
+    shared = SharedGroups(GroupIds())
+    gid = shared.bind("L0", "g1", [1])[0]
+    shared.bind("L0", "g2", [1])
+    new, command, moved, stale = shared.bind("L0", "g1", [1, 3])
+    assert (command, moved, stale) == ("add", True, None)
+    assert new != gid
+    assert shared.entries("L0") == {gid: [1], new: [1, 3]}
+    # g2 follows onto g1's entry, leaving its old one without users
+    assert shared.bind("L0", "g2", [3, 1]) == (new, None, True, gid)
+    assert shared.entries("L0") == {new: [1, 3]}
+    # the released id is handed out again
+    assert shared.bind("L0", "g3", [2])[0] == gid
+
+
+def test_switches_count_their_users_apart():
+    shared = SharedGroups(GroupIds())
+    gid = shared.bind("L0", "g1", [1])[0]
+    assert shared.bind("L1", "g1", [1])[1] == "add"
+    assert shared.unbind("L1", "g1")[1] is not None
+    assert shared.entries("L0") == {gid: [1]}
+    assert shared.groups("L0") == ["g1"]
+
+
+def restarted(tmp_path):
+    """A SharedGroups with g1 on [1] and g2 on [1, 3] of L0, saved and
+    loaded back by a new controller."""
+    filename = str(tmp_path / "group_ids.json")
+    ids = GroupIds(filename)
+    shared = SharedGroups(ids)
+    shared.bind("L0", "g1", [1])
+    shared.bind("L0", "g2", [1, 3])
+    ids.save()
+    ids = GroupIds(filename)
+    return ids, SharedGroups(ids)
+
+
+def test_taking_an_entry_to_a_saved_port_set_frees_its_id(tmp_path):
+    ids, shared = restarted(tmp_path)
+    assert shared.bind("L0", "g1", [1])[0] == 1
+    # [1, 3] still has the id saved for it, nothing is using it though
+    assert shared.bind("L0", "g1", [1, 3]) == (1, "modify", False, None)
+    assert shared.unbind("L0", "g1") == (1, 1)
+    allocator = ids.allocator("L0")
+    assert len(allocator) == 0
+    assert sorted(allocator.free) == [1, 2]
+
+
+def test_prune_frees_the_saved_port_sets_nothing_came_back_to(tmp_path):
+    ids, shared = restarted(tmp_path)
+    ids.allocate("L0", "tree:1")
+    shared.bind("L0", "g1", [1])
+    assert shared.prune() == {"L0": [2]}
+    assert shared.entries("L0") == {1: [1]}
+    # other users of the ids keep theirs
+    assert ids.get("L0", "tree:1") is not None
+    assert shared.prune() == {}
+    # and the id is handed out again
+    assert shared.bind("L0", "g2", [2])[0] == 2
@@ -0,0 +1,95 @@
+import pytest
+
+pytest.importorskip("ryu")
+
+from ryu.lib.packet import igmp, ipv4, packet
+from ryu.ofproto import ofproto_v1_3
+
+import emulate
+import gen_config
+from group_ids import GroupIds, SharedGroups
+from igmp_snooping import GROUP_MEMBERSHIP_INTERVAL, QUERY_INTERVAL, IGMP_Handler, MembershipTable
+from topology import Topology
+
+GROUP = '239.1.0.1'
+
+
+def test_join_refreshes_and_leave_removes():
+    table = MembershipTable()
+    assert table.join(GROUP, 'T0m0', 2, 0)
+    assert not table.join(GROUP, 'T0m0', 2, 5)
+    assert table.join(GROUP, 'T0m1', 3, 5)
+    assert sorted(table.members(GROUP)) == [('T0m0', 2), ('T0m1', 3)]
+    assert table.leave(GROUP, 'T0m0', 2)
+    assert not table.leave(GROUP, 'T0m0', 2)
+    assert table.leave(GROUP, 'T0m1', 3)
+    assert GROUP not in table.groups
+
+
+def test_expire_drops_only_silent_receivers():
+    table = MembershipTable()
+    table.join(GROUP, 'T0m0', 2, 0)
+    table.join(GROUP, 'T0m1', 3, 0)
+    table.join(GROUP, 'T0m1', 3, 200)
+    assert table.expire(GROUP_MEMBERSHIP_INTERVAL + 1) == [(GROUP, ('T0m0', 2))]
+    assert table.members(GROUP) == [('T0m1', 3)]
+
+
+class Controller(object):
+    """What IGMP_Handler needs of an app, over emulated switches."""
+
+    def __init__(self, config):
+        self.topology = Topology(config)
+        self.shared_groups = SharedGroups(GroupIds())
+        self.datapaths = dict((dpid, emulate.FakeDatapath(dpid, ofproto_v1_3.OFP_VERSION))
+                              for dpid in self.topology.switches)
+        self.dpset = self
+
+    def get(self, dpid):
+        return self.datapaths.get(dpid)
+
+
+def handler():
+    controller = Controller(gen_config.leaf_spine(2, 2, racks=2, hosts=2))
+    return controller, IGMP_Handler(controller)
+
+
+def report(igmp_handler, host, join):
+    topo = igmp_handler.topology
+    switch, port = topo.host_port(host)
+    pkt = packet.Packet(emulate.igmp_frame(topo.host_ip(host), GROUP, join))
+    dp = igmp_handler.datapath(switch)
+    igmp_handler.process_igmp(dp, port, pkt.get_protocol(ipv4.ipv4), pkt.get_protocol(igmp.igmp))
+
+
+def test_graft_and_prune_touch_the_branch():
+    controller, igmp_handler = handler()
+    igmp_handler.add_group(GROUP, 'H0m0m0')
+    igmp_handler.tree(GROUP)
+    report(igmp_handler, 'H1m1m1', True)
+    tree = igmp_handler.trees[GROUP]
+    assert 'T1m1' in tree.buckets
+    report(igmp_handler, 'H1m1m1', False)
+    assert 'T1m1' not in tree.buckets
+    assert controller.shared_groups.entries('T1m1') == {}
+
+
+def test_maintain_queries_the_host_ports_and_ages_receivers():
+    controller, igmp_handler = handler()
+    igmp_handler.add_group(GROUP, 'H0m0m0')
+    igmp_handler.tree(GROUP)
+    report(igmp_handler, 'H1m1m1', True)
+    joined = list(igmp_handler.members.groups[GROUP].values())[0]
+    igmp_handler.maintain(now=joined)
+    for dpid, dp in controller.datapaths.items():
+        hosts = controller.topology.switch_name(dpid).startswith('T')
+        assert dp.counts['OFPPacketOut'] == (1 if hosts else 0)
+    first = igmp_handler.last_query
+    igmp_handler.maintain(now=first + 10)
+    assert igmp_handler.last_query == first
+    igmp_handler.maintain(now=first + QUERY_INTERVAL)
+    assert igmp_handler.last_query == first + QUERY_INTERVAL
+    # the receiver never answered
+    igmp_handler.maintain(now=first + GROUP_MEMBERSHIP_INTERVAL + 1)
+    assert igmp_handler.members.members(GROUP) == []
+    assert 'T1m1' not in igmp_handler.trees[GROUP].buckets
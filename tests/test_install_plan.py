@@ -0,0 +1,28 @@
+import pytest
+
+pytest.importorskip("ryu")
+
+from ryu.ofproto import ofproto_v1_3
+
+import emulate
+from install_plan import InstallPlan
+from ofmsg import flow_mod
+
+
+def build(desc, dpid):
+    return [flow_mod(desc, 1, dict(eth_type=0x0800, ip_proto=2), []),
+            flow_mod(desc, 2, dict(eth_type=0x0800, ip_proto=17), [])]
+
+
+def test_replay_takes_its_xids_from_the_datapath():
+    plan = InstallPlan(build, ofproto_v1_3.OFP_VERSION)
+    plan.compile_all([1])
+    dp = emulate.FakeDatapath(1, ofproto_v1_3.OFP_VERSION)
+    # requests the app sent before the switch reconnected
+    dp.xid = 41
+    size = plan.replay(dp)
+    assert dp.counts['OFPFlowMod'] == 2 and size == len(plan.get(1))
+    # two flows and the barrier, which is answered
+    assert dp.xid == 44 and dp.replies[-1].xid == 44
+    plan.replay(dp)
+    assert dp.xid == 47 and dp.replies[-1].xid == 47
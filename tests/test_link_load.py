@@ -0,0 +1,66 @@
+import pytest
+
+pytest.importorskip("ryu")
+
+from ryu.ofproto import ofproto_v1_3
+
+import emulate
+import gen_config
+from link_load import LinkLoad
+from telemetry import StatsCollector
+from topology import Topology
+
+
+def setup():
+    config = gen_config.leaf_spine(2, 2, racks=2, hosts=2)
+    config["link_attrs"] = {"L0": {"S0": {"bw": 10}}}
+    topo = Topology(config)
+    stats = StatsCollector()
+    dp = emulate.FakeDatapath(topo.dpids["L0"], ofproto_v1_3.OFP_VERSION, tables=False)
+    return topo, stats, dp, LinkLoad(topo, stats)
+
+
+def transmitted(topo, stats, dp, now, nbytes):
+    """A poll of L0 whose port to S0 has sent nbytes so far."""
+    parser = dp.ofproto_parser
+    port = topo.neighbors("L0")["S0"][0]
+    stats.poll({dp.id: dp}, now=now)
+    xid = max(stats.switch(dp.id).pending)
+    body = [parser.OFPPortStats(port_no=port, rx_packets=0, tx_packets=nbytes // 1000,
+                                rx_bytes=0, tx_bytes=nbytes, rx_dropped=0, tx_dropped=0,
+                                rx_errors=0, tx_errors=0, rx_frame_err=0, rx_over_err=0,
+                                rx_crc_err=0, collisions=0, duration_sec=0, duration_nsec=0)]
+    msg = parser.OFPPortStatsReply(dp, body=body, flags=0)
+    msg.xid = xid
+    assert stats.port_stats_reply(msg, now=now)
+    stats.switch(dp.id).pending = {}
+
+
+def test_capacity_comes_from_the_link_attrs():
+    topo, stats, dp, load = setup()
+    assert load.capacity("L0", "S0") == 10e6
+    assert load.capacity("L0", "S1") == 1000e6
+
+
+def test_bookings_count_until_a_later_sample():
+    topo, stats, dp, load = setup()
+    assert load.bps("L0", "S0") == 0.0
+    load.reserve([("L0", "S0")], 3e6, now=100)
+    load.reserve([("L0", "S0")], -1e6, now=101)
+    # booked one way only
+    assert load.bps("L0", "S0") == 2e6
+    assert load.bps("S0", "L0") == 0.0
+    assert load.utilization("L0", "S0", extra=1e6) == 0.3
+    transmitted(topo, stats, dp, 100, 0)
+    transmitted(topo, stats, dp, 102, 1000000)
+    load.reserve([("L0", "S0")], 1e6, now=103)
+    # the sample at 102 has the first two bookings in it, not the third
+    assert load.bps("L0", "S0") == 4e6 + 1e6
+    assert load.booked[("L0", "S0")] == [(103, 1e6)]
+    assert load.hot_links(0.4) == {("L0", "S0"): 0.5}
+
+
+def test_releases_never_go_below_zero():
+    topo, stats, dp, load = setup()
+    load.reserve([("L0", "S0")], -1e6, now=100)
+    assert load.bps("L0", "S0") == 0.0
@@ -0,0 +1,51 @@
+from mac_table import MOVED, MacTable, MacTables
+
+HOST = 0x020000000001
+
+
+def test_new_refreshed_and_aged():
+    table = MacTable(aging_time=10, fabric=[1])
+    assert table.learn(HOST, 2, now=100) is True
+    assert table.learn(HOST, 2, now=105) is None
+    assert table.lookup(HOST, now=114) == 2
+    assert table.lookup(HOST, now=125) is None
+
+
+def test_host_moving_between_edge_ports_is_rebound():
+    table = MacTable(fabric=[1])
+    table.learn(HOST, 2, now=100)
+    assert table.learn(HOST, 3, now=101) is MOVED
+    assert table.lookup(HOST, now=102) == 3
+
+
+def test_host_moving_behind_the_fabric_is_rebound():
+    table = MacTable(fabric=[1, 4])
+    table.learn(HOST, 2, now=100)
+    assert table.learn(HOST, 1, now=101) is MOVED
+    # and back onto an edge port of this switch
+    assert table.learn(HOST, 3, now=102) is MOVED
+    assert table.lookup(HOST, now=103) == 3
+
+
+def test_loop_between_fabric_ports_keeps_the_binding():
+    table = MacTable(fabric=[1, 4])
+    table.learn(HOST, 1, now=100)
+    assert table.learn(HOST, 4, now=101) is False
+    assert table.lookup(HOST, now=102) == 1
+
+
+def test_unknown_fabric_guards_every_port():
+    tables = MacTables(fabric={1: set([1])})
+    tables.table(2).learn(HOST, 2, now=100)
+    assert tables.table(2).learn(HOST, 3, now=101) is False
+    tables.table(1).learn(HOST, 2, now=100)
+    assert tables.table(1).learn(HOST, 3, now=101) is MOVED
+
+
+def test_capacity_evicts_the_least_recently_seen():
+    table = MacTable(capacity=2)
+    table.learn(1, 2, now=100)
+    table.learn(2, 2, now=101)
+    table.learn(1, 2, now=102)
+    table.learn(3, 2, now=103)
+    assert sorted(table.entries) == [1, 3]
@@ -0,0 +1,59 @@
+import gen_config
+from multicast_tree import build_tree, repair_tree
+from topology import Topology
+
+
+def leaf_spine():
+    return Topology(gen_config.leaf_spine(2, 2, racks=2, hosts=4))
+
+
+def with_delays(config):
+    """ms on every link: 5 to a spine, 1 leaf-ToR, 0.1 to a host."""
+    for u, attrs in config["link_attrs"].items():
+        for v, attr in attrs.items():
+            attr["delay"] = 5 if v.startswith("S") else 1 if v.startswith("T") else 0.1
+    return config
+
+
+def reached(tree, hosts):
+    return all(tree.topo.host_switch(h) in tree.buckets for h in hosts)
+
+
+def test_repair_untouched_tree_is_itself():
+    topo = leaf_spine()
+    tree = build_tree(topo, "H1m1m0", ["H0m0m2", "H0m1m1"])
+    assert repair_tree(tree, set([frozenset(("T1m0", "L1"))])) is tree
+
+
+def test_repair_grafts_around_a_spine_link():
+    topo = leaf_spine()
+    tree = build_tree(topo, "H1m1m0", ["H0m0m2", "H0m1m1"])
+    spine = [s for s in tree.buckets if s.startswith("S")][0]
+    down = set([frozenset(("L1", spine))])
+    repaired = repair_tree(tree, down)
+    assert reached(repaired, ["H0m0m2", "H0m1m1"])
+    assert not any(frozenset(edge) in down for edge in repaired.edges())
+    # the switches below the spine keep their buckets
+    for switch in ("T0m0", "T0m1", "T1m1"):
+        assert repaired.buckets[switch] == tree.buckets[switch]
+
+
+def test_repair_two_down_links_on_one_path():
+    topo = leaf_spine()
+    tree = build_tree(topo, "H1m1m0", ["H0m0m2", "H0m1m1"])
+    down = set([frozenset(("L1", "S0")), frozenset(("T0m0", "L0"))])
+    repaired = repair_tree(tree, down)
+    assert not any(frozenset(edge) in down for edge in repaired.edges())
+    # T0m0 hangs off L0 alone, the other target still gets there
+    assert "T0m0" not in repaired.buckets
+    assert reached(repaired, ["H0m1m1"])
+
+
+def test_delay_tree_lists_the_targets_it_cannot_reach_in_time():
+    topo = Topology(with_delays(gen_config.leaf_spine(2, 2, racks=2, hosts=4)))
+    targets = ["H0m1m0", "H1m1m0"]
+    assert build_tree(topo, "H0m0m0", targets, "delay", bound=20).late == []
+    # over a spine and back takes 12.2 ms, within the rack 2.2 ms
+    tree = build_tree(topo, "H0m0m0", targets, "delay", bound=10)
+    assert tree.late == ["T1m1"]
+    assert reached(tree, targets)
@@ -0,0 +1,133 @@
+import pytest
+
+pytest.importorskip("ryu")
+
+from ryu.ofproto import ofproto_v1_3
+
+import emulate
+from ofmsg import delete_flows, flow_mod, group_flow_mod, group_mod
+from shadow_table import ShadowTable, apply_flow_mod, apply_group_mod
+
+MATCH = dict(eth_type=0x0800, ipv4_src='10.0.0.100', ipv4_dst='239.1.0.1')
+OTHER = dict(eth_type=0x0800, ipv4_src='10.0.0.101', ipv4_dst='239.1.0.2')
+LEARNED_COOKIE = 0x10
+
+
+def datapath():
+    return emulate.FakeDatapath(1, ofproto_v1_3.OFP_VERSION)
+
+
+def output(dp, port):
+    return [dp.ofproto_parser.OFPActionOutput(port)]
+
+
+def test_flow_mods_add_modify_and_delete():
+    dp = datapath()
+    ofproto = dp.ofproto
+    flows = {}
+    apply_flow_mod(flows, flow_mod(dp, 10, MATCH, output(dp, 1)))
+    apply_flow_mod(flows, flow_mod(dp, 10, OTHER, output(dp, 1)))
+    apply_flow_mod(flows, flow_mod(dp, 20, MATCH, output(dp, 3)))
+    # an ADD of the same priority and match replaces the entry
+    apply_flow_mod(flows, flow_mod(dp, 10, MATCH, output(dp, 2)))
+    assert len(flows) == 3
+    assert sorted(list(e.ports) for e in flows.values() if e.key[1] == 10) == [[1], [2]]
+    # a MODIFY takes every entry its match covers
+    changed = apply_flow_mod(flows, flow_mod(dp, 0, dict(eth_type=0x0800), output(dp, 4),
+                                             command=ofproto.OFPFC_MODIFY))
+    assert len(changed) == 3
+    assert all(e.ports == set([4]) for e in flows.values())
+    # a strict DELETE only the entry of that priority
+    apply_flow_mod(flows, flow_mod(dp, 20, MATCH, [], command=ofproto.OFPFC_DELETE_STRICT,
+                                   out_port=ofproto.OFPP_ANY, out_group=ofproto.OFPG_ANY))
+    assert sorted(e.key[1] for e in flows.values()) == [10, 10]
+    apply_flow_mod(flows, delete_flows(dp, dict(ipv4_dst='239.1.0.1')))
+    assert [e.match['ipv4_dst'] for e in flows.values()] == ['239.1.0.2']
+
+
+def test_group_delete_takes_the_flows_on_it():
+    dp = datapath()
+    ofproto = dp.ofproto
+    flows, groups = {}, {}
+    apply_group_mod(groups, flows, group_mod(dp, ofproto.OFPGC_ADD, 1, [1, 2]))
+    apply_group_mod(groups, flows, group_mod(dp, ofproto.OFPGC_ADD, 2, [3]))
+    apply_group_mod(groups, flows, group_mod(dp, ofproto.OFPGC_MODIFY, 1, [1]))
+    assert len(groups[1].buckets) == 1
+    apply_flow_mod(flows, group_flow_mod(dp, 10, MATCH, 1))
+    apply_flow_mod(flows, group_flow_mod(dp, 10, OTHER, 2))
+    changed = apply_group_mod(groups, flows, group_mod(dp, ofproto.OFPGC_DELETE, 1, []))
+    assert ('group', 1) in changed and len(changed) == 2
+    assert sorted(groups) == [2]
+    assert [e.groups for e in flows.values()] == [set([2])]
+    apply_group_mod(groups, flows, group_mod(dp, ofproto.OFPGC_DELETE, ofproto.OFPG_ALL, []))
+    assert groups == {} and flows == {}
+
+
+def synced(shadow, dp):
+    """Read dp back into shadow the way the controller does."""
+    parser = dp.ofproto_parser
+    shadow.audit(dp)
+    done = False
+    for reply in dp.replies:
+        if isinstance(reply, parser.OFPFlowStatsReply):
+            done = shadow.flow_stats_reply(reply) or done
+        elif isinstance(reply, parser.OFPGroupDescStatsReply):
+            done = shadow.group_desc_reply(reply) or done
+    dp.replies = []
+    assert done and shadow.synced(dp.id)
+
+
+def send(shadow, dp, msg):
+    msg = shadow.apply(dp, msg)
+    if msg is not None:
+        dp.send_msg(msg)
+    return msg
+
+
+def test_group_add_on_a_held_id_becomes_a_modify():
+    dp = datapath()
+    ofproto = dp.ofproto
+    shadow = ShadowTable(cookie=0, cookie_mask=0xffffffffffffffff)
+    synced(shadow, dp)
+    assert send(shadow, dp, group_mod(dp, ofproto.OFPGC_ADD, 1, [1, 2])).command == ofproto.OFPGC_ADD
+    # the switch holds that already
+    assert send(shadow, dp, group_mod(dp, ofproto.OFPGC_ADD, 1, [1, 2])) is None
+    assert send(shadow, dp, group_mod(dp, ofproto.OFPGC_ADD, 1, [3])).command == ofproto.OFPGC_MODIFY
+    # and a MODIFY of an id the switch does not have, an ADD
+    assert send(shadow, dp, group_mod(dp, ofproto.OFPGC_MODIFY, 2, [1])).command == ofproto.OFPGC_ADD
+    assert dict((gid, e.value) for gid, e in dp.groups.items()) == \
+        dict((gid, e.value) for gid, e in shadow.switch(1).groups.items())
+
+
+def test_diff_brings_a_drifted_switch_back():
+    dp = datapath()
+    ofproto = dp.ofproto
+    shadow = ShadowTable(cookie=0, cookie_mask=0xffffffffffffffff)
+    synced(shadow, dp)
+    send(shadow, dp, group_mod(dp, ofproto.OFPGC_ADD, 1, [1, 2]))
+    send(shadow, dp, group_flow_mod(dp, 10, MATCH, 1))
+    send(shadow, dp, flow_mod(dp, 10, OTHER, output(dp, 3)))
+    # someone else's flow is left alone
+    learned = dict(eth_dst='02:00:0a:00:00:64')
+    dp.send_msg(flow_mod(dp, 1, learned, output(dp, 2), cookie=LEARNED_COOKIE))
+    intended = dict((k, e.value) for k, e in dp.flows.items())
+    # behind the controller's back: a changed flow, a stray group and
+    # flow, and the entry the group flow used is gone
+    dp.send_msg(flow_mod(dp, 10, OTHER, output(dp, 4)))
+    dp.send_msg(group_mod(dp, ofproto.OFPGC_ADD, 9, [4]))
+    dp.send_msg(flow_mod(dp, 5, dict(eth_type=0x0800, ipv4_dst='239.1.0.9'), output(dp, 4)))
+    dp.send_msg(group_mod(dp, ofproto.OFPGC_DELETE, 1, []))
+    synced(shadow, dp)
+    msgs = shadow.diff(dp)
+    # the groups go in before the flows that use them, strays out last
+    names = [(type(m).__name__, m.command) for m in msgs]
+    assert names[0] == ('OFPGroupMod', ofproto.OFPGC_ADD)
+    assert names[-1] == ('OFPGroupMod', ofproto.OFPGC_DELETE)
+    for msg in msgs:
+        dp.send_msg(msg)
+    assert dict((k, e.value) for k, e in dp.flows.items()) == intended
+    assert sorted(dp.groups) == [1]
+    # nothing left to do
+    assert shadow.diff(dp) == []
+    synced(shadow, dp)
+    assert shadow.diff(dp) == []
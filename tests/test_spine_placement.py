@@ -0,0 +1,57 @@
+import gen_config
+from spine_placement import SpinePlacement, find_spines
+from topology import Topology
+
+SPINES = ['S0', 'S1', 'S2', 'S3']
+GROUPS = ['g%d' % i for i in range(40)]
+
+
+def test_spines_are_the_top_tier():
+    topo = Topology(gen_config.leaf_spine(2, 3, racks=2, hosts=2))
+    assert find_spines(topo) == ['S0', 'S1']
+
+
+def test_hash_placement_is_stable():
+    first = SpinePlacement(SPINES, width=2)
+    placed = dict((g, first.spines_for(g)) for g in GROUPS)
+    # the same on every controller, whatever order the groups come in
+    again = SpinePlacement(list(reversed(SPINES)), width=2)
+    assert dict((g, again.spines_for(g)) for g in reversed(GROUPS)) == placed
+    assert first.avoid('g0') == set(SPINES) - set(placed['g0'])
+    # a spine going only moves the groups that were on it
+    moved = first.set_spines(['S0', 'S1', 'S2'])
+    assert moved == sorted(g for g in GROUPS if 'S3' in placed[g])
+    for group in GROUPS:
+        assert 'S3' not in first.spines_for(group)
+        assert 'S3' in first.avoid(group)
+    # and coming back only moves the ones it wins back
+    assert first.set_spines(SPINES) == moved
+    assert dict((g, first.spines_for(g)) for g in GROUPS) == placed
+
+
+def test_pack_evens_the_spines_out():
+    demand = dict((g, 1.0) for g in GROUPS[:8])
+    placement = SpinePlacement(SPINES[:2], mode="pack", demand=demand.get)
+    for group in GROUPS[:8]:
+        placement.spines_for(group)
+    assert placement.load() == {'S0': 4.0, 'S1': 4.0}
+    # the groups on S0 turn out to carry more than those on S1
+    for group, spines in placement.placed.items():
+        if spines == ['S0']:
+            demand[group] = 3.0
+    moved = placement.rebalance()
+    assert moved
+    load = placement.load()
+    assert abs(load['S0'] - load['S1']) <= 2.0
+    assert placement.rebalance() == []
+
+
+def test_pack_moves_the_groups_of_a_lost_spine():
+    demand = dict((g, 1.0) for g in GROUPS[:9])
+    placement = SpinePlacement(SPINES[:3], mode="pack", demand=demand.get)
+    for group in GROUPS[:9]:
+        placement.spines_for(group)
+    lost = [g for g, spines in placement.placed.items() if spines == ['S2']]
+    assert placement.set_spines(['S0', 'S1']) == sorted(lost)
+    load = placement.load()
+    assert sorted(load.values()) == [4.0, 5.0]
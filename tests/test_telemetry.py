@@ -0,0 +1,108 @@
+import pytest
+
+pytest.importorskip("ryu")
+
+from ryu.ofproto import ofproto_v1_3
+
+import emulate
+from telemetry import StatsCollector
+
+MATCH = dict(eth_type=0x0800, ipv4_src='10.0.0.1', ipv4_dst='239.1.0.1')
+
+
+def requests(collector, dp):
+    """xids of the flow and group stats requests of the last poll."""
+    return sorted(collector.switch(dp.id).pending)[:2]
+
+
+def flow_reply(dp, xid, packets, nbytes, more=False):
+    parser = dp.ofproto_parser
+    body = []
+    if packets is not None:
+        body.append(parser.OFPFlowStats(table_id=0, duration_sec=0, duration_nsec=0, priority=1,
+                                        idle_timeout=0, hard_timeout=0, flags=0, cookie=0,
+                                        packet_count=packets, byte_count=nbytes,
+                                        match=parser.OFPMatch(**MATCH), instructions=[]))
+    flags = dp.ofproto.OFPMPF_REPLY_MORE if more else 0
+    msg = parser.OFPFlowStatsReply(dp, body=body, flags=flags)
+    msg.xid = xid
+    return msg
+
+
+def group_reply(dp, xid, gid, buckets):
+    parser = dp.ofproto_parser
+    stat = parser.OFPGroupStats(length=0, group_id=gid, ref_count=1,
+                                packet_count=sum(p for p, _ in buckets),
+                                byte_count=sum(b for _, b in buckets),
+                                duration_sec=0, duration_nsec=0,
+                                bucket_stats=[parser.OFPBucketCounter(p, b) for p, b in buckets])
+    msg = parser.OFPGroupStatsReply(dp, body=[stat], flags=0)
+    msg.xid = xid
+    return msg
+
+
+def poll(collector, dp, now, packets, nbytes):
+    collector.poll({dp.id: dp}, now=now)
+    flow_xid, _ = requests(collector, dp)
+    assert collector.flow_stats_reply(flow_reply(dp, flow_xid, packets, nbytes), now=now)
+    # the requests that are still unanswered do not hold up the next poll
+    collector.switch(dp.id).pending = {}
+
+
+def test_flow_replies_become_group_rates():
+    dp = emulate.FakeDatapath(1, ofproto_v1_3.OFP_VERSION, tables=False)
+    collector = StatsCollector(min_interval=1.0, max_interval=16.0)
+    collector.track('g1', MATCH)
+    collector.poll({1: dp}, now=100)
+    flow_xid, group_xid = requests(collector, dp)
+    # a reply poll() did not ask for is someone else's
+    assert not collector.flow_stats_reply(flow_reply(dp, 999, 0, 0), now=100)
+    # nothing is taken in before the last part of a reply
+    assert collector.flow_stats_reply(flow_reply(dp, flow_xid, 10, 1000, more=True), now=100)
+    assert collector.switch(1).flows == {}
+    assert collector.flow_stats_reply(flow_reply(dp, flow_xid, None, None), now=100)
+    # and the first sample only sets the counters off
+    assert collector.rate('g1') == (0.0, 0.0)
+    collector.switch(1).pending = {}
+    collector.poll({1: dp}, now=102)
+    flow_xid, group_xid = requests(collector, dp)
+    assert collector.flow_stats_reply(flow_reply(dp, flow_xid, 210, 41000), now=102)
+    assert collector.rate('g1') == (100.0, 160000.0)
+    assert collector.history('g1') == [(102, 100.0, 160000.0)]
+    assert collector.hot(1) == [('g1', 100.0, 160000.0)]
+
+
+def test_group_replies_count_every_bucket():
+    dp = emulate.FakeDatapath(1, ofproto_v1_3.OFP_VERSION, tables=False)
+    collector = StatsCollector()
+    collector.poll({1: dp}, now=100)
+    _, group_xid = requests(collector, dp)
+    assert collector.group_stats_reply(group_reply(dp, group_xid, 7, [(0, 0), (0, 0)]), now=100)
+    collector.switch(1).pending = {}
+    collector.poll({1: dp}, now=101)
+    _, group_xid = requests(collector, dp)
+    assert collector.group_stats_reply(group_reply(dp, group_xid, 7, [(50, 500), (0, 0)]), now=101)
+    entry = collector.buckets(1)[7]
+    assert entry['buckets'] == [50.0, 0.0]
+    assert entry['idle'] == [1]
+    assert entry['bps'] == 4000.0
+
+
+def test_interval_follows_the_switch_rate():
+    dp = emulate.FakeDatapath(1, ofproto_v1_3.OFP_VERSION, tables=False)
+    collector = StatsCollector(min_interval=1.0, max_interval=16.0, busy_pps=1000)
+    stats = collector.switch(1)
+    # a quiet switch is asked less and less often, up to max_interval
+    now, packets = 1000, 0
+    for _ in range(10):
+        poll(collector, dp, now, packets, 0)
+        now = stats.next_poll
+    assert stats.interval == 16.0
+    # nothing is sent before the switch is due
+    assert collector.poll({1: dp}, now=now - 1) == []
+    # a busy one twice as often after each poll, down to min_interval
+    for _ in range(10):
+        packets += int(2000 * stats.interval)
+        poll(collector, dp, now, packets, 0)
+        now = stats.next_poll
+    assert stats.interval == 1.0
@@ -0,0 +1,68 @@
+import time
+from itertools import groupby
+
+from mininet.log import info
+
+
+def dpid_str(dpid):
+    """netconf dpid -> the 16 hex digit string Mininet and OVS expect.
+
+    Mininet reads dpid as hex, so a decimal "10" would come up as 16 and
+    no longer match the dpid the controller looks the switch up by.
+    """
+    return '%016x' % int(dpid)
+
+
+def link_opts(topology, u, v):
+    """TCLink parameters for the u-v link's netconf attributes, {} when
+    it has none and a plain link will do."""
+    opts = {}
+    bw = topology.capacity(u, v)
+    if bw is not None:
+        opts['bw'] = bw
+    delay = topology.link_attr(u, v, 'delay')
+    if delay is not None:
+        opts['delay'] = '%gms' % float(delay)
+    return opts
+
+
+class StageTimer(object):
+    """Wall time of each bring-up stage, printed as a breakdown."""
+
+    def __init__(self):
+        self.stages = []
+        self.last = time.time()
+
+    def lap(self, stage):
+        now = time.time()
+        self.stages.append((stage, now - self.last))
+        self.last = now
+
+    def report(self):
+        info('*** Bring-up time\n')
+        for stage, elapsed in self.stages:
+            info('    %-20s %8.2fs\n' % (stage, elapsed))
+        info('    %-20s %8.2fs\n' % ('total', sum(t for _, t in self.stages)))
+
+
+def start_switches(net):
+    """Start every switch against the net's controllers.
+
+    Switches created with batch=True only queue their ovs-vsctl commands
+    in start(); batchStartup then runs them as a handful of ovs-vsctl
+    calls instead of one per switch.
+    """
+    for switch in net.switches:
+        switch.start(net.controllers)
+    for cls, switches in groupby(sorted(net.switches, key=lambda s: str(type(s))), type):
+        if hasattr(cls, 'batchStartup'):
+            cls.batchStartup(tuple(switches))
+
+
+def run_on_hosts(hosts, command):
+    """Run command(host) on every host at once and wait for all of them,
+    returns {host name: output}."""
+    for host in hosts:
+        host.sendCmd(command(host))
+    return dict((host.name, host.waitOutput()) for host in hosts)
+
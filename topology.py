@@ -0,0 +1,131 @@
+import json
+import os
+
+
+json_file =  "netconf" + ".json"
+
+
+class Topology(object):
+    """Indexed view of a netconf config.
+
+    netconf.json lists each link once or twice ("topo" maps a switch to its
+    neighbours and the local port). Everything the controllers and topology
+    scripts look up is indexed here once, so lookups are O(1):
+
+        hosts       host -> (switch, port)
+        dpids       switch -> dpid
+        switches    dpid -> switch
+        adj         switch -> {neighbour switch: (local port, remote port)}
+        peers       (switch, port) -> (neighbour, remote port)
+
+    The optional "link_attrs" section has the same shape as "topo" with
+    a dict of link attributes in place of the port: "bw" in Mbit/s and
+    one-way "delay" in ms. A link's attributes can be given from either
+    end.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.switches = {int(dpid): name for dpid, name in config["dpid_to_switchname"].items()}
+        self.dpids = {name: dpid for dpid, name in self.switches.items()}
+        self.host_ips = config["host_ips"]
+        self.ip_hosts = {ip: host for host, ip in self.host_ips.items()}
+        self.hosts = {}
+        self.adj = {name: {} for name in self.dpids}
+        self.peers = {}
+        self._links = []
+        self._index_links(config["topo"])
+        self.attrs = {}
+        for u, conns in config.get("link_attrs", {}).items():
+            for v, attrs in conns.items():
+                self.attrs.setdefault(frozenset((u, v)), {}).update(attrs)
+
+    def _index_links(self, topo):
+        # Ports missing on one side are numbered the way Mininet does when
+        # gen_topo.py adds the link without port2: max used port + 1.
+        used = {}
+        seen = set()
+        for u, conns in topo.items():
+            for v, port in conns.items():
+                key = frozenset((u, v))
+                if key in seen:
+                    continue
+                seen.add(key)
+                used.setdefault(u, set()).add(port)
+                if v in self.host_ips:
+                    peer_port = 0
+                elif v in topo and u in topo[v]:
+                    peer_port = topo[v][u]
+                else:
+                    ports = used.get(v)
+                    peer_port = max(ports) + 1 if ports else 1
+                used.setdefault(v, set()).add(peer_port)
+                self._add_link(u, port, v, peer_port)
+
+    def _add_link(self, u, port_u, v, port_v):
+        self._links.append((u, port_u, v, port_v))
+        for a, pa, b, pb in ((u, port_u, v, port_v), (v, port_v, u, port_u)):
+            self.peers[(a, pa)] = (b, pb)
+            if b in self.host_ips:
+                self.hosts[b] = (a, pa)
+            elif a in self.adj and b in self.adj:
+                self.adj[a][b] = (pa, pb)
+
+    def links(self):
+        """Every link once, as (node1, port1, node2, port2)."""
+        return list(self._links)
+
+    def host_port(self, host):
+        return self.hosts.get(host, (None, None))
+
+    def host_switch(self, host):
+        return self.hosts.get(host, (None, None))[0]
+
+    def host_ip(self, host):
+        return self.host_ips[host]
+
+    def host_for_ip(self, ip):
+        return self.ip_hosts.get(ip)
+
+    def switch_dpid(self, switch):
+        return self.dpids[switch]
+
+    def switch_name(self, dpid):
+        return self.switches.get(int(dpid))
+
+    def neighbors(self, switch):
+        return self.adj.get(switch, {})
+
+    def fabric_ports(self):
+        """dpid -> ports of the switch that face other switches."""
+        return dict((dpid, set(p for p, _ in self.neighbors(name).values()))
+                    for dpid, name in self.switches.items())
+
+    def port_peer(self, switch, port):
+        return self.peers.get((switch, port))
+
+    def link_attr(self, u, v, name, default=None):
+        return self.attrs.get(frozenset((u, v)), {}).get(name, default)
+
+    def capacity(self, u, v):
+        """Configured bandwidth of the u-v link in Mbit/s, None if unknown."""
+        return self.link_attr(u, v, "bw")
+
+    def delay(self, u, v):
+        """Configured one-way delay of the u-v link in ms, 0 if unknown."""
+        return float(self.link_attr(u, v, "delay", 0))
+
+
+def load_config(filename=json_file):
+    with open(filename) as f:
+        return json.load(f)
+
+
+_cache = {}
+
+def load_topology(filename=json_file):
+    """Load and index netconf once per file."""
+    path = os.path.abspath(filename)
+    if path not in _cache:
+        _cache[path] = Topology(load_config(path))
+    return _cache[path]